@@ -36,12 +36,14 @@ from mipp.xrit import bin_reader as rbin
 from mipp.xrit import Metadata
 from StringIO import StringIO
 from mipp.xrit import _xrit
+from mipp.xrit.lut import LutCalibrator
 import numpy as np
 
 
-class _Calibrator(object):
-    def __init__(self, hdr, channel_name):
+class _Calibrator(LutCalibrator):
+    def __init__(self, hdr, channel_name, bits_per_pixel=None):
         self.hdr = hdr
+        self.bits_per_pixel = bits_per_pixel
         self.vis = channel_name.startswith("00_")
         channels = ["00_6",
                     "00_7",
@@ -56,7 +58,7 @@ class _Calibrator(object):
         chnb = channels.index(channel_name)
         self.calibration_table = hdr["ImageCalibration"][chnb, :]
         
-    def __call__(self, image, calibrate=1):
+    def convert(self, image, calibrate=1):
         if calibrate == 0:
             return image
         if calibrate == 1:
@@ -205,7 +207,8 @@ def read_metadata(prologue, image_files, epilogue):
     md.data_type = im.structure.nb
     md.no_data_value = 0
     md.first_pixel = "north west"
-    md.calibrate = _Calibrator(hdr, md.channel)
+    md.calibrate = _Calibrator(hdr, md.channel,
+                               bits_per_pixel=im.structure.nb)
 
     segment_size = im.structure.nl
     md.loff = im.navigation.loff + segment_size * (im.segment.seg_no - 1)
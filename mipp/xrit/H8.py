@@ -8,10 +8,12 @@ JMA HRIT Mission Specific Implementation (Issue 1.2, 1 January, 2003)
 http://www.data.jma.go.jp/mscweb/en/operation/type/HRIT/JMA_HRIT_Issue1.2.pdf
 """
 
+import struct
 import sys
 import numpy
 
 from mipp.xrit import _xrit
+from mipp.xrit.lut import LutCalibrator
 from mipp.xrit import Metadata
 from mipp.xrit import bin_reader as rbin
 
@@ -19,9 +21,10 @@ no_data_value = 0
 
 __all__ = ['read_metadata']
 
-class _Calibrator(object):
-    def __init__(self, hdr):
+class _Calibrator(LutCalibrator):
+    def __init__(self, hdr, bits_per_pixel=None):
         self.hdr = hdr
+        self.bits_per_pixel = bits_per_pixel
 
         dd = []
         for k in sorted(hdr.keys()):
@@ -30,7 +33,7 @@ class _Calibrator(object):
                 dd.append([float(k), v])
         self.calibration_table = numpy.array(dd, dtype=numpy.float32)
 
-    def __call__(self, image, calibrate=1):
+    def convert(self, image, calibrate=1):
         cal = self.calibration_table
 
         if type(cal) != numpy.ndarray:
@@ -56,7 +59,7 @@ def read_metadata(prologue, image_files):
     im = _xrit.read_imagedata(image_files[0])
     hdr = im.data_function.data_definition
     md = Metadata()
-    md.calibrate = _Calibrator(hdr)
+    md.calibrate = _Calibrator(hdr, bits_per_pixel=im.structure.nb)
     md.satname = im.platform.lower()
     md.product_type = 'full disc'
     md.region_name = 'full disc'
@@ -105,9 +108,10 @@ class EncryptionKeyMessageHeader(object):
     hdr_type = 129
     hdr_name = 'EncryptionKey'
 
-    def __init__(self, fp):
-        self.rec_len = rbin.read_uint2(fp.read(2))
-        self.station_id = rbin.read_uint2(fp.read(2))
+    layout = struct.Struct("!HH")
+
+    def __init__(self, buf):
+        self.rec_len, self.station_id = self.layout.unpack_from(buf)
 
     def __str__(self):
         return  "hdr_type:%d, rec_len:%d"%\
@@ -117,9 +121,9 @@ class ImageCompensationInformationHeader(object):
     hdr_type = 130
     hdr_name = 'ImageCompensation'
 
-    def __init__(self, fp):
-        self.rec_len = rbin.read_uint2(fp.read(2))
-        self.text = fp.read(self.rec_len-3).strip()
+    def __init__(self, buf):
+        self.rec_len = rbin.read_uint2(buf[:2])
+        self.text = buf[2:self.rec_len-1].strip()
 
     def __str__(self):
         return  "hdr_type:%d, rec_len:%d"%\
@@ -129,9 +133,9 @@ class ImageObservationTimeHeader(object):
     hdr_type = 131
     hdr_name = 'ImageObservationTime'
 
-    def __init__(self, fp):
-        self.rec_len = rbin.read_uint2(fp.read(2))
-        self.text = fp.read(self.rec_len-3).strip()
+    def __init__(self, buf):
+        self.rec_len = rbin.read_uint2(buf[:2])
+        self.text = buf[2:self.rec_len-1].strip()
 
     def __str__(self):
         return  "hdr_type:%d, rec_len:%d"%\
@@ -141,9 +145,9 @@ class ImageQualityInformationHeader(object):
     hdr_type = 132
     hdr_name = 'ImageQuality'
 
-    def __init__(self, fp):
-        self.rec_len = rbin.read_uint2(fp.read(2))
-        self.text = fp.read(self.rec_len-3).strip()
+    def __init__(self, buf):
+        self.rec_len = rbin.read_uint2(buf[:2])
+        self.text = buf[2:self.rec_len-1].strip()
 
     def __str__(self):
         return  "hdr_type:%d, rec_len:%d"%\
@@ -152,9 +156,9 @@ class ImageQualityInformationHeader(object):
 class AnnotationHeader(object):
     hdr_type = 4
     hdr_name = 'annotation'
-    def __init__(self, fp):
-        self.rec_len = rbin.read_uint2(fp.read(2))
-        self.text = fp.read(self.rec_len-3).strip()
+    def __init__(self, buf):
+        self.rec_len = rbin.read_uint2(buf[:2])
+        self.text = buf[2:self.rec_len-1].strip()
         # a = [x.strip('_') for x in self.text.split('-')]
         # self.xrit_channel_id = a[0]
         # self.dissemination_id = int(a[1])
@@ -171,12 +175,12 @@ class AnnotationHeader(object):
 class SegmentIdentification(object):
     hdr_type = 128
     hdr_name = 'segment'
-    def __init__(self, fp):
-        self.rec_len = rbin.read_uint2(fp.read(2))
-        self.seg_no = rbin.read_uint1(fp.read(1))
-        self.planned_end_seg_no = rbin.read_uint1(fp.read(1))
+    layout = struct.Struct("!HBBH")
+
+    def __init__(self, buf):
+        (self.rec_len, self.seg_no, self.planned_end_seg_no,
+         self.seg_line_no) = self.layout.unpack_from(buf)
         self.planned_start_seg_no = 1
-        self.seg_line_no = rbin.read_uint2(fp.read(2))
 
     def __str__(self):
         return  "hdr_type:%d, rec_len:%d seg_no:%d, total_seg_no:%d, " \
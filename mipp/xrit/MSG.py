@@ -28,14 +28,16 @@
 #raise NotImplementedError
 import logging
 import sys
+from collections import Mapping
 from datetime import datetime
 from StringIO import StringIO
 
 import numpy as np
 
-from mipp import CalibrationError, ReaderError
+from mipp import CalibrationError, DecodeError, ReaderError
 from mipp.xrit import bin_reader as rbin
 from mipp.xrit import Metadata, _xrit
+from mipp.xrit.lut import LutCalibrator
 
 logger = logging.getLogger(__name__)
 
@@ -238,26 +240,31 @@ C1 = 1.19104273e-16
 C2 = 0.0143877523
 
 
-class _Calibrator(object):
+class _Calibrator(LutCalibrator):
 
     def __init__(self, hdr, channel_name, bits_per_pixel):
         self.hdr = hdr
         self.channel_name = channel_name
         self.bits_per_pixel = bits_per_pixel
 
-    def __call__(self, image, calibrate=1):
+    def convert(self, image, calibrate=1):
         """Computes the radiances and reflectances/bt of a given channel.  The
         *calibrate* argument should be set to 0 for no calibration, 1 for
         default reflectances/bt calibration, and 2 for returning radiances. The
         default value is 1.
         """
+        return self.convert_many(image, (calibrate,))[0]
+
+    def convert_many(self, image, calibrates):
+        """Like :meth:`convert`, for each of *calibrates*, computing the
+        radiances only once.
+        """
         hdr = self.hdr
 
         channel_name = self.channel_name
 
-        if calibrate == 0:
-            return (image,
-                    "counts")
+        if all(calibrate == 0 for calibrate in calibrates):
+            return [(image, "counts") for calibrate in calibrates]
 
         channels = {"VIS006": 1,
                     "VIS008": 2,
@@ -275,6 +282,7 @@ class _Calibrator(object):
         cal_type = (hdr["Level 1_5 ImageProduction"]["PlannedChanProcessing"])
         chn_nb = channels[channel_name] - 1
 
+        counts = image
         mask = (image == no_data_value)
         if self.bits_per_pixel == 8:
             logger.info(
@@ -287,9 +295,23 @@ class _Calibrator(object):
         radiances = eval_np('image * cslope + coffset')
         radiances[radiances < 0] = 0
 
-        if calibrate == 2:
-            return (np.ma.MaskedArray(radiances, mask=mask),
-                    "mW m-2 sr-1 (cm-1)-1")
+        results = []
+        for calibrate in calibrates:
+            if calibrate == 0:
+                results.append((counts, "counts"))
+            elif calibrate == 2:
+                results.append((np.ma.MaskedArray(radiances, mask=mask),
+                                "mW m-2 sr-1 (cm-1)-1"))
+            else:
+                results.append(self._convert_radiances(radiances, mask,
+                                                       cal_type[chn_nb]))
+        return results
+
+    def _convert_radiances(self, radiances, mask, cal_type):
+        """Reflectances or brightness temperatures from *radiances*.
+        """
+        hdr = self.hdr
+        channel_name = self.channel_name
 
         sat = hdr["SatelliteDefinition"]["SatelliteId"]
         if sat not in CALIB:
@@ -303,7 +325,7 @@ class _Calibrator(object):
                     "%")
 
         wavenumber = CALIB[sat][channel_name]["VC"]
-        if cal_type[chn_nb] == 2:
+        if cal_type == 2:
             # computation based on effective radiance
             alpha = CALIB[sat][channel_name]["ALPHA"]
             beta = CALIB[sat][channel_name]["BETA"]
@@ -312,7 +334,7 @@ class _Calibrator(object):
                                 'log(C1 * 1.0e6 * wavenumber ** 3 / '
                                 '(1.0e-5 * radiances) + 1)) - beta) / alpha'))
 
-        elif cal_type[chn_nb] == 1:
+        elif cal_type == 1:
             # computation based on spectral radiance
             cal_data = eval_np(('C2 * 100. * wavenumber / '
                                 'log(C1 * 1.0e6 * wavenumber ** 3 / '
@@ -328,519 +350,453 @@ class _Calibrator(object):
         else:
             raise RuntimeError("Something is seriously wrong in the metadata.")
 
-        mask = mask | np.isnan(cal_data) | np.isinf(cal_data)
+        # the mask may be shared with the radiances
+        mask = mask | ~np.isfinite(cal_data)
         cal_data = np.ma.MaskedArray(cal_data, mask=mask)
         return (cal_data,
                 "K")
 
 
-def read_proheader(fp):
-    """Read the msg header.
+#-----------------------------------------------------------------------------
+#
+# Prologue and epilogue record layouts, see EUM/MSG/ICD/105.
+#
+# The data field of a prologue (epilogue) is decoded with one np.frombuffer
+# call into a PROLOGUE_DTYPE (EPILOGUE_DTYPE) record, and presented as a
+# mapping of dictionaries, arrays and python scalars (see LazyHeader).
+#
+#-----------------------------------------------------------------------------
+_CDS_TIME = np.dtype([("days", ">u2"),
+                      ("msecs", ">u4")])
+_CDS_EXPANDED_TIME = np.dtype([("days", ">u2"),
+                               ("msecs", ">u4"),
+                               ("usecs", ">u2"),
+                               ("nsecs", ">u2")])
+_CUC_TIME = np.dtype([("coarse", "u1", (4,)),
+                      ("fine", "u1", (3,))])
+
+_TIME_DECODERS = ((_CDS_TIME, rbin.read_cds_time),
+                  (_CDS_EXPANDED_TIME, rbin.read_cds_expanded_time),
+                  (_CUC_TIME, lambda buf: rbin.read_cuc_time(buf, 4, 3)))
+
+_ORBIT_COEF = np.dtype(">u2, >u4, >u2, >u4,"
+                       " (8,)>f8, (8,)>f8, (8,)>f8,"
+                       " (8,)>f8, (8,)>f8, (8,)>f8")
+_ATTITUDE_COEF = np.dtype(">u2, >u4, >u2, >u4, (8,)>f8, (8,)>f8, (8,)>f8")
+_EPHEMERIS_COEF = np.dtype(">u2, >u4, >u2, >u4, (8,)>f8, (8,)>f8")
+_STAR_COEF = np.dtype(">u2, >u2, >u4, >u2, >u4, (8,)>f8, (8,)>f8")
+
+_REFERENCE_GRID = np.dtype([("NumberOfLines", ">i4"),
+                            ("NumberOfColumns", ">i4"),
+                            ("LineDirGridStep", ">f4"),
+                            ("ColumnDirGridStep", ">f4"),
+                            ("GridOrigin", "u1")])
+
+_CALIBRATION = np.dtype([("Cal_Slope", ">f8"),
+                         ("Cal_Offset", ">f8")])
+
+_EXTRACTED_BB_DATA = np.dtype([("NumberOfPixelsUsed", ">u4"),
+                               ("MeanCount", ">f4"),
+                               ("RMS", ">f4"),
+                               ("MaxCount", ">u2"),
+                               ("MinCount", ">u2"),
+                               ("BB_Processing_Slope", ">f8"),
+                               ("BB_Processing_Offset", ">f8")])
+
+_IMPF_CAL = np.dtype([("ImageQualityFlag", "u1"),
+                      ("ReferenceDataFlag", "u1"),
+                      ("AbsCalMethod", "u1"),
+                      ("Pad1", "u1"),
+                      ("AbsCalWeightVic", ">f4"),
+                      ("AbsCalWeightXsat", ">f4"),
+                      ("AbsCalCoeff", ">f4"),
+                      ("AbsCalError", ">f4"),
+                      ("GSICSCalCoeff", ">f4"),
+                      ("GSICSCalError", ">f4"),
+                      ("GSICSOffsetCount", ">f4")])
+
+PROLOGUE_DTYPE = np.dtype([
+    ("SatelliteDefinition", [
+        ("SatelliteId", ">u2"),
+        ("NominalLongitude", ">f4"),
+        ("SatelliteStatus", "u1")]),
+    ("SatelliteOperations", [
+        ("LastManoeuvreFlag", "?"),
+        ("LastManoeuvreStartTime", _CDS_TIME),
+        ("LastManoeuvreEndTime", _CDS_TIME),
+        ("LastManoeuvreType", "u1"),
+        ("NextManoeuvreFlag", "?"),
+        ("NextManoeuvreStartTime", _CDS_TIME),
+        ("NextManoeuvreEndTime", _CDS_TIME),
+        ("NextManoeuvreType", "u1")]),
+    ("Orbit", [
+        ("PeriodStartTime", _CDS_TIME),
+        ("PeriodEndTime", _CDS_TIME),
+        ("OrbitPolynomial", _ORBIT_COEF, (100,))]),
+    ("Attitude", [
+        ("PeriodStartTime", _CDS_TIME),
+        ("PeriodEndTime", _CDS_TIME),
+        ("PrincipleAxisOffsetAngle", ">f8"),
+        ("AttitudePolynomial", _ATTITUDE_COEF, (100,))]),
+    ("SpinRateatRCStart", ">f8"),
+    ("UTCCorrelation", [
+        ("PeriodStartTime", _CDS_TIME),
+        ("PeriodEndTime", _CDS_TIME),
+        ("OnBoardTimeStart", _CUC_TIME),
+        ("VarOnBoardTimeStart", ">f8"),
+        ("A1", ">f8"),
+        ("VarA1", ">f8"),
+        ("A2", ">f8"),
+        ("VarA2", ">f8")]),
+    ("PlannedAcquisitionTime", [
+        ("TrueRepeatCycleStart", _CDS_EXPANDED_TIME),
+        ("PlannedForwardScanEnd", _CDS_EXPANDED_TIME),
+        ("PlannedRepeatCycleEnd", _CDS_EXPANDED_TIME)]),
+    ("RadiometerStatus", [
+        ("ChannelStatus", "u1", (12,)),
+        ("DetectorStatus", "u1", (42,))]),
+    ("RadiometerSettings", [
+        ("MDUSamplingDelays", ">u2", (42,)),
+        ("HRVFrameOffsets", [
+            ("MDUNomHRVDelay1", ">u2"),
+            ("MDUNomHRVDelay2", ">u2"),
+            ("Spare", ">u2"),
+            ("MDUNomHRVBreakline", ">u2")]),
+        ("DHSSSynchSelection", "u1"),
+        ("MDUOutGain", ">u2", (42,)),
+        ("MDUCourseGain", "u1", (42,)),
+        ("MDUFineGain", ">u2", (42,)),
+        ("MDUNumericalOffset", ">u2", (42,)),
+        ("PUGain", ">u2", (42,)),
+        ("PUOffset", ">u2", (27,)),
+        ("PUBias", ">u2", (15,)),
+        ("OperationParameters", [
+            ("L0_LineCounter", ">u2"),
+            ("K1_RetraceLines", ">u2"),
+            ("K2_PauseDeciseconds", ">u2"),
+            ("K3_RetraceLines", ">u2"),
+            ("K4_PauseDeciseconds", ">u2"),
+            ("K5_RetraceLines", ">u2"),
+            ("X_DeepSpaceWindowPosition", "u1")]),
+        ("RefocusingLines", ">u2"),
+        ("RefocusingDirection", "u1"),
+        ("RefocusingPosition", ">u2"),
+        ("ScanRefPosFlag", "?"),
+        ("ScanRefPosNumber", ">u2"),
+        ("ScanRefPosVal", ">f4"),
+        ("ScanFirstLine", ">u2"),
+        ("ScanLastLine", ">u2"),
+        ("RetraceStartLine", ">u2")]),
+    ("RadiometerOperations", [
+        ("LastGainChangeFlag", "?"),
+        ("LastGainChangeTime", _CDS_TIME),
+        ("Decontamination", [
+            ("DecontaminationNow", "?"),
+            ("DecontaminationStart", _CDS_TIME),
+            ("DecontaminationEnd", _CDS_TIME)]),
+        ("BBCalScheduled", "?"),
+        ("BBCalibrationType", "u1"),
+        ("BBFirstLine", ">u2"),
+        ("BBLastLine", ">u2"),
+        ("ColdFocalPlaneOpTemp", ">u2"),
+        ("WarmFocalPlaneOpTemp", ">u2")]),
+    ("CelestialBodiesPosition", [
+        ("PeriodTimeStart", _CDS_TIME),
+        ("PeriodTimeEnd", _CDS_TIME),
+        ("RelatedOrbitFileTime", "V15"),
+        ("RelatedAttitudeFileTime", "V15"),
+        ("EarthEphemeris", _EPHEMERIS_COEF, (100,)),
+        ("MoonEphemeris", _EPHEMERIS_COEF, (100,)),
+        ("SunEphemeris", _EPHEMERIS_COEF, (100,)),
+        ("StarEphemeris", [("starcoefs", _STAR_COEF, (20,))], (100,))]),
+    ("RelationToImage", [
+        ("TypeofEclipse", "u1"),
+        ("EclipseStartTime", _CDS_TIME),
+        ("EclipseEndTime", _CDS_TIME),
+        ("VisibleBodiesInImage", "u1"),
+        ("BodiesClosetoFOV", "u1"),
+        ("ImpactOnImageQuality", "u1")]),
+    ("ProjectionDescription", [
+        ("TypeOfProjection", "u1"),
+        ("LongitudeOfSSP", ">f4")]),
+    ("ReferenceGridVIS_IR", _REFERENCE_GRID),
+    ("ReferenceGridHRV", _REFERENCE_GRID),
+    ("PlannedCoverageVIS_IR", [
+        ("SouthernLinePlanned", ">i4"),
+        ("NorthernLinePlanned", ">i4"),
+        ("EasternColumnPlanned", ">i4"),
+        ("WesternColumnPlanned", ">i4")]),
+    ("PlannedCoverageHRV", [
+        ("LowerSouthLinePlanned", ">i4"),
+        ("LowerNorthLinePlanned", ">i4"),
+        ("LowerEastColumnPlanned", ">i4"),
+        ("LowerWestColumnPlanned", ">i4"),
+        ("UpperSouthLinePlanned", ">i4"),
+        ("UpperNorthLinePlanned", ">i4"),
+        ("UpperEastColumnPlanned", ">i4"),
+        ("UpperWestColumnPlanned", ">i4")]),
+    ("Level 1_5 ImageProduction", [
+        ("ImageProcDirection", "u1"),
+        ("PixelGenDirection", "u1"),
+        # 0: No processing, 1: Spectral radiance, 2: Effective radiance
+        ("PlannedChanProcessing", "u1", (12,))]),
+    ("RPSummary", [
+        ("RadianceLinearization", "?", (12,)),
+        ("DetectorEqualization", "?", (12,)),
+        ("OnboardCalibrationResult", "?", (12,)),
+        ("MPEFCalFeedback", "?", (12,)),
+        ("MTFAdaptation", "?", (12,)),
+        ("StraylightCorrectionFlag", "?", (12,))]),
+    ("Level1_5ImageCalibration", _CALIBRATION, (12,)),
+    ("BlackBodyDataUsed", [
+        ("BBObservationUTC", _CDS_EXPANDED_TIME),
+        ("BBRelatedData", [
+            ("OnBoardBBTime", _CUC_TIME),
+            ("MDUOutGain", ">u2", (42,)),
+            ("MDUCoarseGain", "u1", (42,)),
+            ("MDUFineGain", ">u2", (42,)),
+            ("MDUNumericalOffset", ">u2", (42,)),
+            ("PUGain", ">u2", (42,)),
+            ("PUOffset", ">u2", (27,)),
+            ("PUBias", ">u2", (15,)),
+            # 12 bits bitstrings
+            ("DCRValues", "u1", (63,)),
+            ("X_DeepSpaceWindowPosition", "u1"),
+            ("ColdFPTemperature", [
+                ("FCUNominalColdFocalPlaneTemp", ">u2"),
+                ("FCURedundantColdFocalPlaneTemp", ">u2")]),
+            ("WarmFPTemperature", [
+                ("FCUNominalWarmFocalPlaneVHROTemp", ">u2"),
+                ("FCURedundantWarmFocalPlaneVHROTemp", ">u2")]),
+            ("ScanMirrorTemperature", [
+                ("FCUNominalScanMirrorSensor1Temp", ">u2"),
+                ("FCURedundantScanMirrorSensor1Temp", ">u2"),
+                ("FCUNominalScanMirrorSensor2Temp", ">u2"),
+                ("FCURedundantScanMirrorSensor2Temp", ">u2")]),
+            ("M1M2M3Temperature", [
+                ("FCUNominalM1MirrorSensor1Temp", ">u2"),
+                ("FCURedundantM1MirrorSensor1Temp", ">u2"),
+                ("FCUNominalM1MirrorSensor2Temp", ">u2"),
+                ("FCURedundantM1MirrorSensor2Temp", ">u2"),
+                ("FCUNominalM23AssemblySensor1Temp", "u1"),
+                ("FCURedundantM23AssemblySensor1Temp", "u1"),
+                ("FCUNominalM23AssemblySensor2Temp", "u1"),
+                ("FCURedundantM23AssemblySensor2Temp", "u1")]),
+            ("BaffleTemperature", [
+                ("FCUNominalM1BaffleTemp", ">u2"),
+                ("FCURedundantM1BaffleTemp", ">u2")]),
+            ("BlackBodyTemperature", [
+                ("FCUNominalBlackBodySensorTemp", ">u2"),
+                ("FCURedundantBlackBodySensorTemp", ">u2")]),
+            ("FCUMode", [
+                ("FCUNominalSMMStatus", ">u2"),
+                ("FCURedundantSMMStatus", ">u2")]),
+            ("ExtractedBBData", _EXTRACTED_BB_DATA, (12,))]),
+        ("MPEFCalFeedback", _IMPF_CAL, (12,)),
+        ("RadTransform", ">f4", (42, 64)),
+        ("RadProcMTFAdaptation", [
+            ("VIS_IRMTFCorrectionE_W", ">f4", (33, 16)),
+            ("VIS_IRMTFCorrectionN_S", ">f4", (33, 16)),
+            ("HRVMTFCorrectionE_W", ">f4", (9, 16)),
+            ("HRVMTFCorrectionN_S", ">f4", (9, 16)),
+            ("StraylightCorrection", ">f4", (12, 8, 8))])]),
+    ("GeometricProcessing", [
+        ("OptAxisDistances", [
+            ("E-WFocalPlane", ">f4", (42,)),
+            ("N-SFocalPlane", ">f4", (42,))]),
+        ("EarthModel", [
+            ("TypeOfEarthModel", "u1"),
+            ("EquatorialRadius", ">f8"),
+            ("NorthPolarRadius", ">f8"),
+            ("SouthPolarRadius", ">f8")]),
+        ("AtmosphericModel", ">f4", (12, 360)),
+        ("ResamplingFunctions", "u1", (12,))])])
+PROLOGUE_SIZE = PROLOGUE_DTYPE.itemsize
+
+_L15_IMAGE_VALIDITY = np.dtype([("NominalImage", ">u1"),
+                                ("NonNominalBecauseIncomplete", ">u1"),
+                                ("NonNominalRadiometricQuality", ">u1"),
+                                ("NonNominalGeometricQuality", ">u1"),
+                                ("NonNominalTimeliness", ">u1"),
+                                ("IncompleteL15", ">u1")])
+
+EPILOGUE_DTYPE = np.dtype([
+    ("15TRAILERVersion", "u1"),
+    ("SateliteID", ">u2"),
+    ("NominalImageScanning", "?"),
+    ("ReducedScan", "?"),
+    ("ForwardScanStart", _CDS_TIME),
+    ("ForwardScanEnd", _CDS_TIME),
+    ("NominalBehaviour", "?"),
+    ("RadScanIrregularity", "?"),
+    ("RadStoppage", "?"),
+    ("RepeatCycleNotCompleted", "?"),
+    ("GainChangeTookPlace", "?"),
+    ("DecontaminationTookPlace", "?"),
+    ("NoBBCalibrationAchieved", "?"),
+    ("IncorrectTemperature", "?"),
+    ("InvalidBBData", "?"),
+    ("InvalidAuxOrHKTMData", "?"),
+    ("RefocusingMechanismActuated", "?"),
+    ("MirrorBackToReferencePos", "?"),
+    ("PlannedNumberOfL10Lines", ">u4", (12,)),
+    ("NumberOfMissingL10Lines", ">u4", (12,)),
+    ("NumberOfCorruptedL10Lines", ">u4", (12,)),
+    ("NumberOfReplacedL10Lines", ">u4", (12,)),
+    ("L15ImageValidity", _L15_IMAGE_VALIDITY, (12,)),
+    ("SouthernLineActual", ">i4"),
+    ("NorthernLineActual", ">i4"),
+    ("EasternColumnActual", ">i4"),
+    ("WesternColumnActual", ">i4"),
+    ("LowerSouthLineActual", ">i4"),
+    ("LowerNorthLineActual", ">i4"),
+    ("LowerEastColumnActual", ">i4"),
+    ("LowerWestColumnActual", ">i4"),
+    ("UpperSouthLineActual", ">i4"),
+    ("UpperNorthLineActual", ">i4"),
+    ("UpperEastColumnActual", ">i4"),
+    ("UpperWestColumnActual", ">i4")])
+EPILOGUE_SIZE = EPILOGUE_DTYPE.itemsize
+
+
+def _dcr_values(data):
+    # 12 bits bitstrings... convert to uint16
+    data = data.astype(np.uint16)
+    data[::3] = data[::3] * 256 + data[1::3] // 16
+    data[1::3] = (data[1::3] & 0x0f) * 16 + data[2::3]
+    return np.ravel(data.reshape(-1, 3)[:, :2])
+
+
+def _lookup(table):
+    return lambda value: table[value]
+
+
+def _scaled(scale, offset=0):
+    return lambda value: value / scale + offset
+
+# Fields which are not presented as stored.
+_CONVERTERS = {
+    "GridOrigin": _lookup(["north west", "south west",
+                           "south east", "north east"]),
+    "ImageProcDirection": _lookup(["North-South", "South-North"]),
+    "PixelGenDirection": _lookup(["East-West", "West-East"]),
+    "DCRValues": _dcr_values,
+    "FCUNominalColdFocalPlaneTemp": _scaled(100.),
+    "FCURedundantColdFocalPlaneTemp": _scaled(100.),
+    "FCUNominalWarmFocalPlaneVHROTemp": _scaled(100., 250),
+    "FCURedundantWarmFocalPlaneVHROTemp": _scaled(100., 250),
+    "FCUNominalScanMirrorSensor1Temp": _scaled(100., 250),
+    "FCURedundantScanMirrorSensor1Temp": _scaled(100., 250),
+    "FCUNominalScanMirrorSensor2Temp": _scaled(100., 250),
+    "FCURedundantScanMirrorSensor2Temp": _scaled(100., 250),
+    "FCUNominalM1MirrorSensor1Temp": _scaled(100., 250),
+    "FCURedundantM1MirrorSensor1Temp": _scaled(100., 250),
+    "FCUNominalM1MirrorSensor2Temp": _scaled(100., 250),
+    "FCURedundantM1MirrorSensor2Temp": _scaled(100., 250),
+    "FCUNominalM23AssemblySensor1Temp": _scaled(4., 265),
+    "FCURedundantM23AssemblySensor1Temp": _scaled(4., 265),
+    "FCUNominalM23AssemblySensor2Temp": _scaled(4., 265),
+    "FCURedundantM23AssemblySensor2Temp": _scaled(4., 265),
+    "FCUNominalM1BaffleTemp": _scaled(100., 250),
+    "FCURedundantM1BaffleTemp": _scaled(100., 250),
+    "FCUNominalBlackBodySensorTemp": _scaled(100., 250),
+    "FCURedundantBlackBodySensorTemp": _scaled(100., 250)}
+
+
+def _converter(name, dtype):
+    """Return a function presenting a field *name* of type *dtype*:
+    structures as dictionaries, arrays as arrays (copied, so they don't hold
+    on to, or modify, the record), time stamps as datetime and numbers as
+    python scalars.
+    """
+    convert = _CONVERTERS.get(name, None)
+    if dtype.subdtype is not None:
+        if convert is None:
+            return lambda value: value.copy()
+        return convert
+    if dtype.names:
+        for time_dtype, decoder in _TIME_DECODERS:
+            if dtype == time_dtype:
+                return lambda value: decoder(value.tostring())
+        fields = [(key, _converter(key, dtype.fields[key][0]))
+                  for key in dtype.names]
+        return lambda value: dict((key, func(value[key]))
+                                  for key, func in fields)
+    if dtype.kind == 'V':
+        # raw bytes
+        return lambda value: value.tostring()
+    if convert is None:
+        return lambda value: value.item()
+    return lambda value: convert(value.item())
+
+
+class LazyHeader(Mapping):
+    """Read-only mapping view of a prologue or epilogue *record* (of
+    PROLOGUE_DTYPE or EPILOGUE_DTYPE). A section, i.e. a top level field, is
+    only converted on first access. The byte offset of each section is found
+    in :attr:`offsets`.
     """
-    hdr = dict()
-
-    # Satellite definition
-
-    satdef = {}
-    satdef["SatelliteId"] = rbin.read_uint2(fp.read(2))
-    satdef["NominalLongitude"] = rbin.read_float4(fp.read(4))
-    satdef["SatelliteStatus"] = ord(fp.read(1))
-
-    hdr["SatelliteDefinition"] = satdef
-    del satdef
-
-    # Satellite operations
-
-    satop = {}
-    satop["LastManoeuvreFlag"] = ord(fp.read(1)) > 0
-    satop["LastManoeuvreStartTime"] = rbin.read_cds_time(fp.read(6))
-    satop["LastManoeuvreEndTime"] = rbin.read_cds_time(fp.read(6))
-    satop["LastManoeuvreType"] = ord(fp.read(1))
-    satop["NextManoeuvreFlag"] = ord(fp.read(1)) > 0
-    satop["NextManoeuvreStartTime"] = rbin.read_cds_time(fp.read(6))
-    satop["NextManoeuvreEndTime"] = rbin.read_cds_time(fp.read(6))
-    satop["NextManoeuvreType"] = ord(fp.read(1))
-
-    hdr["SatelliteOperations"] = satop
-    del satop
-
-    # Orbit
-
-    orbit = {}
-    orbit["PeriodStartTime"] = rbin.read_cds_time(fp.read(6))
-    orbit["PeriodEndTime"] = rbin.read_cds_time(fp.read(6))
-    orbitcoef = np.dtype(">u2, >u4, >u2, >u4,"
-                         " (8,)>f8, (8,)>f8, (8,)>f8,"
-                         " (8,)>f8, (8,)>f8, (8,)>f8")
-    orbit["OrbitPolynomial"] = np.fromstring(fp.read(39600),
-                                             dtype=orbitcoef,
-                                             count=100)
-
-    hdr["Orbit"] = orbit
-    del orbit
-
-    # Attitude
-
-    attitude = {}
-    attitude["PeriodStartTime"] = rbin.read_cds_time(fp.read(6))
-    attitude["PeriodEndTime"] = rbin.read_cds_time(fp.read(6))
-    attitude["PrincipleAxisOffsetAngle"] = rbin.read_float8(fp.read(8))
-    attitudecoef = np.dtype(">u2, >u4, >u2, >u4, (8,)>f8, (8,)>f8, (8,)>f8")
-    attitude["AttitudePolynomial"] = np.fromstring(fp.read(20400),
-                                                   dtype=attitudecoef,
-                                                   count=100)
-
-    hdr["Attitude"] = attitude
-    del attitude
-
-    # SpinRateatRCStart
-
-    hdr["SpinRateatRCStart"] = rbin.read_float8(fp.read(8))
-
-    # UTCCorrelation
-
-    utccor = {}
-
-    utccor["PeriodStartTime"] = rbin.read_cds_time(fp.read(6))
-    utccor["PeriodEndTime"] = rbin.read_cds_time(fp.read(6))
-    utccor["OnBoardTimeStart"] = rbin.read_cuc_time(fp.read(7), 4, 3)
-    utccor["VarOnBoardTimeStart"] = rbin.read_float8(fp.read(8))
-    utccor["A1"] = rbin.read_float8(fp.read(8))
-    utccor["VarA1"] = rbin.read_float8(fp.read(8))
-    utccor["A2"] = rbin.read_float8(fp.read(8))
-    utccor["VarA2"] = rbin.read_float8(fp.read(8))
-
-    hdr["UTCCorrelation"] = utccor
-    del utccor
-
-    # PlannedAcquisitionTime
-
-    pat = {}
-    pat["TrueRepeatCycleStart"] = rbin.read_cds_expanded_time(fp.read(10))
-    pat["PlannedForwardScanEnd"] = rbin.read_cds_expanded_time(fp.read(10))
-    pat["PlannedRepeatCycleEnd"] = rbin.read_cds_expanded_time(fp.read(10))
-
-    hdr["PlannedAcquisitionTime"] = pat
-
-    # RadiometerStatus
-
-    radiostatus = {}
-    radiostatus["ChannelStatus"] = np.fromstring(fp.read(12), dtype=np.uint8)
-    radiostatus["DetectorStatus"] = np.fromstring(fp.read(42), dtype=np.uint8)
-
-    hdr["RadiometerStatus"] = radiostatus
-
-    # RadiometerSettings
-
-    radiosettings = {}
-    radiosettings["MDUSamplingDelays"] = np.fromstring(
-        fp.read(42 * 2), dtype=">u2")
-    radiosettings["HRVFrameOffsets"] = {}
-    radiosettings["HRVFrameOffsets"][
-        "MDUNomHRVDelay1"] = rbin.read_uint2(fp.read(2))
-    radiosettings["HRVFrameOffsets"][
-        "MDUNomHRVDelay2"] = rbin.read_uint2(fp.read(2))
-    radiosettings["HRVFrameOffsets"]["Spare"] = rbin.read_uint2(fp.read(2))
-    radiosettings["HRVFrameOffsets"][
-        "MDUNomHRVBreakline"] = rbin.read_uint2(fp.read(2))
-    radiosettings["DHSSSynchSelection"] = ord(fp.read(1))
-    radiosettings["MDUOutGain"] = np.fromstring(fp.read(42 * 2), dtype=">u2")
-    radiosettings["MDUCourseGain"] = np.fromstring(fp.read(42), dtype=np.uint8)
-    radiosettings["MDUFineGain"] = np.fromstring(fp.read(42 * 2), dtype=">u2")
-    radiosettings["MDUNumericalOffset"] = np.fromstring(
-        fp.read(42 * 2), dtype=">u2")
-    radiosettings["PUGain"] = np.fromstring(fp.read(42 * 2), dtype=">u2")
-    radiosettings["PUOffset"] = np.fromstring(fp.read(27 * 2), dtype=">u2")
-    radiosettings["PUBias"] = np.fromstring(fp.read(15 * 2), dtype=">u2")
-    radiosettings["OperationParameters"] = {}
-    radiosettings["OperationParameters"][
-        "L0_LineCounter"] = rbin.read_uint2(fp.read(2))
-    radiosettings["OperationParameters"][
-        "K1_RetraceLines"] = rbin.read_uint2(fp.read(2))
-    radiosettings["OperationParameters"][
-        "K2_PauseDeciseconds"] = rbin.read_uint2(fp.read(2))
-    radiosettings["OperationParameters"][
-        "K3_RetraceLines"] = rbin.read_uint2(fp.read(2))
-    radiosettings["OperationParameters"][
-        "K4_PauseDeciseconds"] = rbin.read_uint2(fp.read(2))
-    radiosettings["OperationParameters"][
-        "K5_RetraceLines"] = rbin.read_uint2(fp.read(2))
-    radiosettings["OperationParameters"][
-        "X_DeepSpaceWindowPosition"] = ord(fp.read(1))
-    radiosettings["RefocusingLines"] = rbin.read_uint2(fp.read(2))
-    radiosettings["RefocusingDirection"] = ord(fp.read(1))
-    radiosettings["RefocusingPosition"] = rbin.read_uint2(fp.read(2))
-    radiosettings["ScanRefPosFlag"] = ord(fp.read(1)) > 0
-    radiosettings["ScanRefPosNumber"] = rbin.read_uint2(fp.read(2))
-    radiosettings["ScanRefPosVal"] = rbin.read_float4(fp.read(4))
-    radiosettings["ScanFirstLine"] = rbin.read_uint2(fp.read(2))
-    radiosettings["ScanLastLine"] = rbin.read_uint2(fp.read(2))
-    radiosettings["RetraceStartLine"] = rbin.read_uint2(fp.read(2))
-
-    hdr["RadiometerSettings"] = radiosettings
-
-    # RadiometerOperations
-
-    radiooper = {}
-
-    radiooper["LastGainChangeFlag"] = ord(fp.read(1)) > 0
-    radiooper["LastGainChangeTime"] = rbin.read_cds_time(fp.read(6))
-    radiooper["Decontamination"] = {}
-    radiooper["Decontamination"]["DecontaminationNow"] = ord(fp.read(1)) > 0
-    radiooper["Decontamination"][
-        "DecontaminationStart"] = rbin.read_cds_time(fp.read(6))
-    radiooper["Decontamination"][
-        "DecontaminationEnd"] = rbin.read_cds_time(fp.read(6))
-
-    radiooper["BBCalScheduled"] = ord(fp.read(1)) > 0
-    radiooper["BBCalibrationType"] = ord(fp.read(1))
-    radiooper["BBFirstLine"] = rbin.read_uint2(fp.read(2))
-    radiooper["BBLastLine"] = rbin.read_uint2(fp.read(2))
-    radiooper["ColdFocalPlaneOpTemp"] = rbin.read_uint2(fp.read(2))
-    radiooper["WarmFocalPlaneOpTemp"] = rbin.read_uint2(fp.read(2))
-
-    hdr["RadiometerOperations"] = radiooper
-
-    # CelestialEvents
-    # CelestialBodiesPosition
-
-    celbodies = {}
-    celbodies["PeriodTimeStart"] = rbin.read_cds_time(fp.read(6))
-    celbodies["PeriodTimeEnd"] = rbin.read_cds_time(fp.read(6))
-    celbodies["RelatedOrbitFileTime"] = fp.read(15)
-    celbodies["RelatedAttitudeFileTime"] = fp.read(15)
-    earthmoonsuncoef = np.dtype(">u2, >u4, >u2, >u4, (8,)>f8, (8,)>f8")
-    celbodies["EarthEphemeris"] = np.fromstring(fp.read(14000),
-                                                dtype=earthmoonsuncoef,
-                                                count=100)
-    celbodies["MoonEphemeris"] = np.fromstring(fp.read(14000),
-                                               dtype=earthmoonsuncoef,
-                                               count=100)
-    celbodies["SunEphemeris"] = np.fromstring(fp.read(14000),
-                                              dtype=earthmoonsuncoef,
-                                              count=100)
-    starcoef = np.dtype(">u2, >u2, >u4, >u2, >u4, (8,)>f8, (8,)>f8")
-    starcoefs = np.dtype([('starcoefs', starcoef, (20,))])
-
-    celbodies["StarEphemeris"] = np.fromstring(fp.read(284000),
-                                               dtype=starcoefs,
-                                               count=100)
-
-    hdr["CelestialBodiesPosition"] = celbodies
-
-    # RelationToImage
-
-    reltoim = {}
-    reltoim["TypeofEclipse"] = ord(fp.read(1))
-    reltoim["EclipseStartTime"] = rbin.read_cds_time(fp.read(6))
-    reltoim["EclipseEndTime"] = rbin.read_cds_time(fp.read(6))
-    reltoim["VisibleBodiesInImage"] = ord(fp.read(1))
-    reltoim["BodiesClosetoFOV"] = ord(fp.read(1))
-    reltoim["ImpactOnImageQuality"] = ord(fp.read(1))
-
-    hdr["RelationToImage"] = reltoim
-
-    # ImageDescriptionRecord
-
-    grid_origin = ["north west", "south west", "south east", "north east"]
-
-    # ProjectionDescription
-
-    projdes = {}
-    projdes["TypeOfProjection"] = ord(fp.read(1))
-    projdes["LongitudeOfSSP"] = rbin.read_float4(fp.read(4))
-
-    hdr["ProjectionDescription"] = projdes
-
-    # ReferenceGridVIS_IR
-
-    refvisir = {}
-    refvisir["NumberOfLines"] = rbin.read_int4(fp.read(4))
-    refvisir["NumberOfColumns"] = rbin.read_int4(fp.read(4))
-    refvisir["LineDirGridStep"] = rbin.read_float4(fp.read(4))
-    refvisir["ColumnDirGridStep"] = rbin.read_float4(fp.read(4))
-    refvisir["GridOrigin"] = grid_origin[ord(fp.read(1))]
-
-    hdr["ReferenceGridVIS_IR"] = refvisir
-
-    # ReferenceGridHRV
-
-    refhrv = {}
-    refhrv["NumberOfLines"] = rbin.read_int4(fp.read(4))
-    refhrv["NumberOfColumns"] = rbin.read_int4(fp.read(4))
-    refhrv["LineDirGridStep"] = rbin.read_float4(fp.read(4))
-    refhrv["ColumnDirGridStep"] = rbin.read_float4(fp.read(4))
-    refhrv["GridOrigin"] = grid_origin[ord(fp.read(1))]
-
-    hdr["ReferenceGridHRV"] = refhrv
-
-    # PlannedCoverageVIS_IR
-
-    covvisir = {}
-    covvisir["SouthernLinePlanned"] = rbin.read_int4(fp.read(4))
-    covvisir["NorthernLinePlanned"] = rbin.read_int4(fp.read(4))
-    covvisir["EasternColumnPlanned"] = rbin.read_int4(fp.read(4))
-    covvisir["WesternColumnPlanned"] = rbin.read_int4(fp.read(4))
-
-    hdr["PlannedCoverageVIS_IR"] = covvisir
-
-    # PlannedCoverageHRV
-
-    covhrv = {}
-
-    covhrv["LowerSouthLinePlanned"] = rbin.read_int4(fp.read(4))
-    covhrv["LowerNorthLinePlanned"] = rbin.read_int4(fp.read(4))
-    covhrv["LowerEastColumnPlanned"] = rbin.read_int4(fp.read(4))
-    covhrv["LowerWestColumnPlanned"] = rbin.read_int4(fp.read(4))
-    covhrv["UpperSouthLinePlanned"] = rbin.read_int4(fp.read(4))
-    covhrv["UpperNorthLinePlanned"] = rbin.read_int4(fp.read(4))
-    covhrv["UpperEastColumnPlanned"] = rbin.read_int4(fp.read(4))
-    covhrv["UpperWestColumnPlanned"] = rbin.read_int4(fp.read(4))
-
-    hdr["PlannedCoverageHRV"] = covhrv
-
-    # Level 1_5 ImageProduction
-
-    image_proc_direction = ["North-South", "South-North"]
-    pixel_gen_direction = ["East-West", "West-East"]
-
-    l15prod = {}
-    l15prod["ImageProcDirection"] = image_proc_direction[ord(fp.read(1))]
-    l15prod["PixelGenDirection"] = pixel_gen_direction[ord(fp.read(1))]
-
-    # 0: No processing, 1: Spectral radiance, 2: Effective radiance
-    l15prod["PlannedChanProcessing"] = np.fromstring(fp.read(12),
-                                                     dtype=np.uint8)
-
-    hdr["Level 1_5 ImageProduction"] = l15prod
 
-    # RadiometricProcessing
+    # (offsets, converters) per record type
+    _layouts = {}
 
-    # RPSummary
+    def __init__(self, record):
+        self.record = record
+        self._decoded = {}
+        try:
+            self.offsets, self._convert = self._layouts[record.dtype]
+        except KeyError:
+            fields = record.dtype.fields
+            self.offsets = dict((name, fields[name][1]) for name in fields)
+            self._convert = dict((name, _converter(name, fields[name][0]))
+                                 for name in fields)
+            self._layouts[record.dtype] = (self.offsets, self._convert)
 
-    rpsummary = {}
-    rpsummary["RadianceLinearization"] = np.fromstring(
-        fp.read(12), dtype=np.bool)
+    def __getitem__(self, name):
+        try:
+            return self._decoded[name]
+        except KeyError:
+            value = self._convert[name](self.record[name])
+        return self._decoded.setdefault(name, value)
 
-    rpsummary["DetectorEqualization"] = np.fromstring(
-        fp.read(12), dtype=np.bool)
-    rpsummary["OnboardCalibrationResult"] = np.fromstring(
-        fp.read(12), dtype=np.bool)
-    rpsummary["MPEFCalFeedback"] = np.fromstring(fp.read(12), dtype=np.bool)
-    rpsummary["MTFAdaptation"] = np.fromstring(fp.read(12), dtype=np.bool)
-    rpsummary["StraylightCorrectionFlag"] = np.fromstring(
-        fp.read(12), dtype=np.bool)
+    def __iter__(self):
+        return iter(self.record.dtype.names)
 
-    hdr["RPSummary"] = rpsummary
+    def __len__(self):
+        return len(self.record.dtype.names)
 
-    # Level1_5ImageCalibration
 
-    caltype = np.dtype([('Cal_Slope', '>f8'), ('Cal_Offset', '>f8')])
+def _decode_record(buf, dtype, what):
+    if len(buf) < dtype.itemsize:
+        raise DecodeError("%s too short, %d bytes (expected %d)" %
+                          (what, len(buf), dtype.itemsize))
+    return np.frombuffer(buf, dtype=dtype, count=1)[0]
 
-    hdr["Level1_5ImageCalibration"] = np.fromstring(
-        fp.read(192), dtype=caltype)
 
-    # BlackBodyDataUsed
+def read_proheader(fp):
+    """Read the msg header.
+    """
+    return LazyHeader(_decode_record(fp.read(PROLOGUE_SIZE),
+                                     PROLOGUE_DTYPE, "prologue"))
 
-    bbdu = {}
 
-    bbdu["BBObservationUTC"] = rbin.read_cds_expanded_time(fp.read(10))
-    bbdu["BBRelatedData"] = {}
-    bbdu["BBRelatedData"][
-        "OnBoardBBTime"] = rbin.read_cuc_time(fp.read(7), 4, 3)
-    bbdu["BBRelatedData"]["MDUOutGain"] = np.fromstring(fp.read(42 * 2),
-                                                        dtype=">u2")
-    bbdu["BBRelatedData"]["MDUCoarseGain"] = np.fromstring(fp.read(42),
-                                                           dtype=np.uint8)
-    bbdu["BBRelatedData"]["MDUFineGain"] = np.fromstring(fp.read(42 * 2),
-                                                         dtype=">u2")
-    bbdu["BBRelatedData"]["MDUNumericalOffset"] = np.fromstring(fp.read(42 * 2),
-                                                                dtype=">u2")
-    bbdu["BBRelatedData"]["PUGain"] = np.fromstring(fp.read(42 * 2),
-                                                    dtype=">u2")
-    bbdu["BBRelatedData"]["PUOffset"] = np.fromstring(fp.read(27 * 2),
-                                                      dtype=">u2")
-    bbdu["BBRelatedData"]["PUBias"] = np.fromstring(fp.read(15 * 2),
-                                                    dtype=">u2")
-    # 12 bits bitstrings... convert to uint16
-    data = np.fromstring(fp.read(int(42 * 1.5)),
-                         dtype=np.uint8)
-    data = data.astype(np.uint16)
-    data[::3] = data[::3] * 256 + data[1::3] // 16
-    data[1::3] = (data[1::3] & 0x0f) * 16 + data[2::3]
-    result = np.ravel(data.reshape(-1, 3)[:, :2])
-    bbdu["BBRelatedData"]["DCRValues"] = result
-    bbdu["BBRelatedData"]["X_DeepSpaceWindowPosition"] = ord(fp.read(1))
-    bbdu["BBRelatedData"]["ColdFPTemperature"] = {}
-    bbdu["BBRelatedData"]["ColdFPTemperature"][
-        "FCUNominalColdFocalPlaneTemp"] = rbin.read_uint2(fp.read(2)) / 100.
-    bbdu["BBRelatedData"]["ColdFPTemperature"][
-        "FCURedundantColdFocalPlaneTemp"] = rbin.read_uint2(fp.read(2)) / 100.
-    bbdu["BBRelatedData"]["WarmFPTemperature"] = {}
-    bbdu["BBRelatedData"]["WarmFPTemperature"][
-        "FCUNominalWarmFocalPlaneVHROTemp"] = rbin.read_uint2(fp.read(2)) / 100. + 250
-    bbdu["BBRelatedData"]["WarmFPTemperature"][
-        "FCURedundantWarmFocalPlaneVHROTemp"] = rbin.read_uint2(fp.read(2)) / 100. + 250
-    bbdu["BBRelatedData"]["ScanMirrorTemperature"] = {}
-    bbdu["BBRelatedData"]["ScanMirrorTemperature"][
-        "FCUNominalScanMirrorSensor1Temp"] = rbin.read_uint2(fp.read(2)) / 100. + 250
-    bbdu["BBRelatedData"]["ScanMirrorTemperature"][
-        "FCURedundantScanMirrorSensor1Temp"] = rbin.read_uint2(fp.read(2)) / 100. + 250
-    bbdu["BBRelatedData"]["ScanMirrorTemperature"][
-        "FCUNominalScanMirrorSensor2Temp"] = rbin.read_uint2(fp.read(2)) / 100. + 250
-    bbdu["BBRelatedData"]["ScanMirrorTemperature"][
-        "FCURedundantScanMirrorSensor2Temp"] = rbin.read_uint2(fp.read(2)) / 100. + 250
-    bbdu["BBRelatedData"]["M1M2M3Temperature"] = {}
-    bbdu["BBRelatedData"]["M1M2M3Temperature"][
-        "FCUNominalM1MirrorSensor1Temp"] = rbin.read_uint2(fp.read(2)) / 100. + 250
-    bbdu["BBRelatedData"]["M1M2M3Temperature"][
-        "FCURedundantM1MirrorSensor1Temp"] = rbin.read_uint2(fp.read(2)) / 100. + 250
-    bbdu["BBRelatedData"]["M1M2M3Temperature"][
-        "FCUNominalM1MirrorSensor2Temp"] = rbin.read_uint2(fp.read(2)) / 100. + 250
-    bbdu["BBRelatedData"]["M1M2M3Temperature"][
-        "FCURedundantM1MirrorSensor2Temp"] = rbin.read_uint2(fp.read(2)) / 100. + 250
-    bbdu["BBRelatedData"]["M1M2M3Temperature"][
-        "FCUNominalM23AssemblySensor1Temp"] = ord(fp.read(1)) / 4. + 265
-    bbdu["BBRelatedData"]["M1M2M3Temperature"][
-        "FCURedundantM23AssemblySensor1Temp"] = ord(fp.read(1)) / 4. + 265
-    bbdu["BBRelatedData"]["M1M2M3Temperature"][
-        "FCUNominalM23AssemblySensor2Temp"] = ord(fp.read(1)) / 4. + 265
-    bbdu["BBRelatedData"]["M1M2M3Temperature"][
-        "FCURedundantM23AssemblySensor2Temp"] = ord(fp.read(1)) / 4. + 265
-    bbdu["BBRelatedData"]["BaffleTemperature"] = {}
-    bbdu["BBRelatedData"]["BaffleTemperature"][
-        "FCUNominalM1BaffleTemp"] = rbin.read_uint2(fp.read(2)) / 100. + 250
-    bbdu["BBRelatedData"]["BaffleTemperature"][
-        "FCURedundantM1BaffleTemp"] = rbin.read_uint2(fp.read(2)) / 100. + 250
-    bbdu["BBRelatedData"]["BlackBodyTemperature"] = {}
-    bbdu["BBRelatedData"]["BlackBodyTemperature"][
-        "FCUNominalBlackBodySensorTemp"] = rbin.read_uint2(fp.read(2)) / 100. + 250
-    bbdu["BBRelatedData"]["BlackBodyTemperature"][
-        "FCURedundantBlackBodySensorTemp"] = rbin.read_uint2(fp.read(2)) / 100. + 250
-    bbdu["BBRelatedData"]["FCUMode"] = {}
-    bbdu["BBRelatedData"]["FCUMode"][
-        "FCUNominalSMMStatus"] = rbin.read_uint2(fp.read(2))
-    bbdu["BBRelatedData"]["FCUMode"][
-        "FCURedundantSMMStatus"] = rbin.read_uint2(fp.read(2))
-    extracted_data_type = np.dtype([('NumberOfPixelsUsed', '>u4'),
-                                    ('MeanCount', '>f4'),
-                                    ('RMS', '>f4'),
-                                    ('MaxCount', '>u2'),
-                                    ('MinCount', '>u2'),
-                                    ('BB_Processing_Slope', '>f8'),
-                                    ('BB_Processing_Offset', '>f8')])
-
-    bbdu["BBRelatedData"]["ExtractedBBData"] = np.fromstring(fp.read(32 * 12),
-                                                             dtype=extracted_data_type)
-    impf_cal_type = np.dtype([("ImageQualityFlag", "u1"),
-                              ("ReferenceDataFlag", "u1"),
-                              ("AbsCalMethod", "u1"),
-                              ("Pad1", "u1"),
-                              ("AbsCalWeightVic", ">f4"),
-                              ("AbsCalWeightXsat", ">f4"),
-                              ("AbsCalCoeff", ">f4"),
-                              ("AbsCalError", ">f4"),
-                              ("GSICSCalCoeff", ">f4"),
-                              ("GSICSCalError", ">f4"),
-                              ("GSICSOffsetCount", ">f4")])
-
-    bbdu["MPEFCalFeedback"] = np.fromstring(fp.read(32 * 12),
-                                            dtype=impf_cal_type)
-
-    bbdu["RadTransform"] = np.fromstring(fp.read(42 * 64 * 4),
-                                         dtype=">f4").reshape((42, 64))
-    bbdu["RadProcMTFAdaptation"] = {}
-
-    bbdu["RadProcMTFAdaptation"]["VIS_IRMTFCorrectionE_W"] = np.fromstring(fp.read(33 * 16 * 4),
-                                                                           dtype=">f4").reshape((33, 16))
-    bbdu["RadProcMTFAdaptation"]["VIS_IRMTFCorrectionN_S"] = np.fromstring(fp.read(33 * 16 * 4),
-                                                                           dtype=">f4").reshape((33, 16))
-    bbdu["RadProcMTFAdaptation"]["HRVMTFCorrectionE_W"] = np.fromstring(fp.read(9 * 16 * 4),
-                                                                        dtype=">f4").reshape((9, 16))
-    bbdu["RadProcMTFAdaptation"]["HRVMTFCorrectionN_S"] = np.fromstring(fp.read(9 * 16 * 4),
-                                                                        dtype=">f4").reshape((9, 16))
-    bbdu["RadProcMTFAdaptation"]["StraylightCorrection"] = np.fromstring(fp.read(12 * 8 * 8 * 4),
-                                                                         dtype=">f4").reshape((12, 8, 8))
-
-    hdr["BlackBodyDataUsed"] = bbdu
-
-    # GeometricProcessing
-
-    geoproc = {}
-    geoproc["OptAxisDistances"] = {}
-    geoproc["OptAxisDistances"]["E-WFocalPlane"] = np.fromstring(fp.read(42 * 4),
-                                                                 dtype=">f4")
-    geoproc["OptAxisDistances"]["N-SFocalPlane"] = np.fromstring(fp.read(42 * 4),
-                                                                 dtype=">f4")
-
-    geoproc["EarthModel"] = {}
-    geoproc["EarthModel"]["TypeOfEarthModel"] = ord(fp.read(1))
-    geoproc["EarthModel"]["EquatorialRadius"] = rbin.read_float8(fp.read(8))
-    geoproc["EarthModel"]["NorthPolarRadius"] = rbin.read_float8(fp.read(8))
-    geoproc["EarthModel"]["SouthPolarRadius"] = rbin.read_float8(fp.read(8))
-    geoproc["AtmosphericModel"] = np.fromstring(fp.read(12 * 360 * 4),
-                                                dtype=">f4").reshape((12, 360))
-    geoproc["ResamplingFunctions"] = np.fromstring(fp.read(12),
-                                                   dtype=np.uint8)
-
-    hdr["GeometricProcessing"] = geoproc
-
-    return hdr
+def read_epiheader(fp):
+    """Read the msg trailer.
+    """
+    return LazyHeader(_decode_record(fp.read(EPILOGUE_SIZE),
+                                     EPILOGUE_DTYPE, "epilogue"))
 
 
-def read_epiheader(fp):
-    """Read the msg header.
+def read_prologue_records(file_names):
+    """Decode the prologue files *file_names* into one record array of
+    PROLOGUE_DTYPE, e.g. for trend analysis of calibration or orbit data.
     """
-    ftr = dict()
-    ftr["15TRAILERVersion"] = ord(fp.read(1))
-    ftr["SateliteID"] = rbin.read_uint2(fp.read(2))
-    ftr["NominalImageScanning"] = ord(fp.read(1)) > 0
-    ftr["ReducedScan"] = ord(fp.read(1)) > 0
-    ftr["ForwardScanStart"] = rbin.read_cds_time(fp.read(6))
-    ftr["ForwardScanEnd"] = rbin.read_cds_time(fp.read(6))
-    ftr["NominalBehaviour"] = ord(fp.read(1)) > 0
-    ftr["RadScanIrregularity"] = ord(fp.read(1)) > 0
-    ftr["RadStoppage"] = ord(fp.read(1)) > 0
-    ftr["RepeatCycleNotCompleted"] = ord(fp.read(1)) > 0
-    ftr["GainChangeTookPlace"] = ord(fp.read(1)) > 0
-    ftr["DecontaminationTookPlace"] = ord(fp.read(1)) > 0
-    ftr["NoBBCalibrationAchieved"] = ord(fp.read(1)) > 0
-    ftr["IncorrectTemperature"] = ord(fp.read(1)) > 0
-    ftr["InvalidBBData"] = ord(fp.read(1)) > 0
-    ftr["InvalidAuxOrHKTMData"] = ord(fp.read(1)) > 0
-    ftr["RefocusingMechanismActuated"] = ord(fp.read(1)) > 0
-    ftr["MirrorBackToReferencePos"] = ord(fp.read(1)) > 0
-    ftr["PlannedNumberOfL10Lines"] = np.fromstring(fp.read(12 * 4),
-                                                   dtype=">u4")
-    ftr["NumberOfMissingL10Lines"] = np.fromstring(fp.read(12 * 4),
-                                                   dtype=">u4")
-    ftr["NumberOfCorruptedL10Lines"] = np.fromstring(fp.read(12 * 4),
-                                                     dtype=">u4")
-    ftr["NumberOfReplacedL10Lines"] = np.fromstring(fp.read(12 * 4),
-                                                    dtype=">u4")
-    validitytype = np.dtype([('NominalImage', '>u1'),
-                             ('NonNominalBecauseIncomplete', '>u1'),
-                             ('NonNominalRadiometricQuality', '>u1'),
-                             ('NonNominalGeometricQuality', '>u1'),
-                             ('NonNominalTimeliness', '>u1'),
-                             ('IncompleteL15', '>u1')])
-    ftr["L15ImageValidity"] = np.fromstring(fp.read(12 * 6),
-                                            dtype=validitytype)
-
-    ftr["SouthernLineActual"] = rbin.read_int4(fp.read(4))
-    ftr["NorthernLineActual"] = rbin.read_int4(fp.read(4))
-    ftr["EasternColumnActual"] = rbin.read_int4(fp.read(4))
-    ftr["WesternColumnActual"] = rbin.read_int4(fp.read(4))
-    ftr["LowerSouthLineActual"] = rbin.read_int4(fp.read(4))
-    ftr["LowerNorthLineActual"] = rbin.read_int4(fp.read(4))
-    ftr["LowerEastColumnActual"] = rbin.read_int4(fp.read(4))
-    ftr["LowerWestColumnActual"] = rbin.read_int4(fp.read(4))
-    ftr["UpperSouthLineActual"] = rbin.read_int4(fp.read(4))
-    ftr["UpperNorthLineActual"] = rbin.read_int4(fp.read(4))
-    ftr["UpperEastColumnActual"] = rbin.read_int4(fp.read(4))
-    ftr["UpperWestColumnActual"] = rbin.read_int4(fp.read(4))
-
-    return ftr
+    file_names = list(file_names)
+    records = np.empty(len(file_names), dtype=PROLOGUE_DTYPE)
+    for i, file_name in enumerate(file_names):
+        records[i] = _decode_record(_xrit.read_prologue(file_name).data,
+                                    PROLOGUE_DTYPE, "prologue")
+    return records
 
 
 def read_metadata(prologue, image_files, epilogue):
@@ -848,11 +804,8 @@ def read_metadata(prologue, image_files, epilogue):
     """
     segment_size = 464  # number of lines in a segment
 
-    fp = StringIO(prologue.data)
-    hdr = read_proheader(fp)
-
-    fp = StringIO(epilogue.data)
-    ftr = read_epiheader(fp)
+    hdr = _xrit.decoded(prologue, read_proheader)
+    ftr = _xrit.decoded(epilogue, read_epiheader)
 
     try:
         im = _xrit.read_imagedata(image_files[0])
@@ -932,8 +885,7 @@ def read_metadata(prologue, image_files, epilogue):
 def read_obstimes(epilogue):
     """Get the start and end full disk scan times from the Epilogue file."""
     epi = _xrit.read_epilogue(epilogue)
-    fpt = StringIO(epi.data)
-    ftr = read_epiheader(fpt)
+    ftr = _xrit.decoded(epi, read_epiheader)
     return (ftr['ForwardScanStart'], ftr['ForwardScanEnd'])
 
 
@@ -14,6 +14,7 @@ import numpy as np
 from mipp import CalibrationError
 from mipp import strptime
 from mipp.xrit import _xrit
+from mipp.xrit.lut import LutCalibrator
 from mipp.xrit import Metadata
 from mipp.xrit import bin_reader as rbin
 
@@ -261,11 +262,12 @@ temp2rad[7] = np.array([ [170.0, 0.020], [171.0, 0.022], [172.0, 0.024],
 [363.0, 22.113], [364.0, 22.495], [365.0, 22.883], [366.0, 23.274], [367.0,
 23.671], [368.0, 24.072], [369.0, 24.477]])
 
-class _Calibrator(object):
-    def __init__(self, hdr):
+class _Calibrator(LutCalibrator):
+    def __init__(self, hdr, bits_per_pixel=None):
         self.hdr = hdr
+        self.bits_per_pixel = bits_per_pixel
         
-    def __call__(self, image, calibrate=1):
+    def convert(self, image, calibrate=1):
         """From http://www.eumetsat.int/Home/Main/DataProducts/Calibration/MFGCalibration/index.htm?l=en
         """
         # don't know how to calibrate
@@ -298,7 +300,7 @@ def read_metadata(prologue, image_files):
     asc_hdr = _read_ascii_header(fp)
     bin_hdr = _read_binary_header(fp, asc_hdr['ProductType'])
     md = Metadata()
-    md.calibrate = _Calibrator(bin_hdr)
+    md.calibrate = _Calibrator(bin_hdr, bits_per_pixel=im.structure.nb)
     md.product_name = prologue.product_id
     pf = asc_hdr['Platform']
     if pf == 'M7':
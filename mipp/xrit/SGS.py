@@ -11,6 +11,7 @@ import sys
 import numpy
 
 from mipp.xrit import _xrit
+from mipp.xrit.lut import LutCalibrator
 from mipp.xrit import Metadata
 from mipp.xrit import bin_reader as rbin
 
@@ -40,9 +41,10 @@ def _read_sgs_product_header(fp):
     #hdr['ImageProductHeaderData'] = fp.read()
     return hdr
 
-class _Calibrator(object):
-    def __init__(self, hdr):
+class _Calibrator(LutCalibrator):
+    def __init__(self, hdr, bits_per_pixel=None):
         self.hdr = hdr
+        self.bits_per_pixel = bits_per_pixel
 
         dd = []
         for k in sorted(hdr.keys()):
@@ -51,7 +53,7 @@ class _Calibrator(object):
                 dd.append([float(k), v])
         self.calibration_table = numpy.array(dd, dtype=numpy.float32)
 
-    def __call__(self, image, calibrate=1):
+    def convert(self, image, calibrate=1):
         cal = self.calibration_table
 
         if type(cal) != numpy.ndarray:
@@ -77,7 +79,7 @@ def read_metadata(prologue, image_files):
     im = _xrit.read_imagedata(image_files[0])
     hdr = im.data_function.data_definition
     md = Metadata()
-    md.calibrate = _Calibrator(hdr)
+    md.calibrate = _Calibrator(hdr, bits_per_pixel=im.structure.nb)
     md.satname = im.platform.lower()
     md.product_type = 'full disc'
     md.region_name = 'full disc'
@@ -10,4 +10,5 @@ from mipp.xrit._xrit import (read_prologue,
                              read_mpef,
                              read_mpef_clm,
                              decompress,
+                             register_decompressor,
                              list)
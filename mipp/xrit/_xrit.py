@@ -9,10 +9,16 @@
 
 import sys
 import os
+import struct
+import threading
+from collections import OrderedDict
 from StringIO import StringIO 
 
+import numpy
+
 import mipp
 from mipp.xrit import bin_reader as rbin
+from mipp.xrit import index
 
 __all__ = ['read_prologue',
            'read_epilogue',
@@ -21,12 +27,17 @@ __all__ = ['read_prologue',
            'read_mpef',
            'read_mpef_clm',
            'decompress',
+           'register_decompressor',
            'list']
 
 def decompress(infile, outdir='.'):
     """Will decompress an XRIT data file and return the path to the
     decompressed file. It expect to find Eumetsat's xRITDecompress through the
     environment variable XRIT_DECOMPRESS_PATH
+
+    The decompressor is run in *outdir*, the working directory of the
+    process is not changed, so it's safe to decompress several files
+    concurrently.
     """
     from subprocess import Popen, PIPE
     cmd = os.environ.get('XRIT_DECOMPRESS_PATH', None)
@@ -35,8 +46,6 @@ def decompress(infile, outdir='.'):
                       " (complete path to xRITDecompress)")
 
     infile = os.path.abspath(infile)
-    cwd = os.getcwd()
-    os.chdir(outdir)
 
     question = ("Did you set the environment variable " +
                 "XRIT_DECOMPRESS_PATH correctly?")
@@ -45,11 +54,10 @@ def decompress(infile, outdir='.'):
     elif os.path.isdir(cmd):
         raise IOError(str(cmd) + " is a directory!\n" + question)
 
-    p = Popen([cmd, infile], stdout=PIPE)
+    p = Popen([cmd, infile], stdout=PIPE, cwd=outdir)
     stdout = StringIO(p.communicate()[0])
     status = p.returncode
-    os.chdir(cwd)
-    
+
     outfile = ''
     for line in stdout:
         try:
@@ -66,19 +74,83 @@ def decompress(infile, outdir='.'):
         raise mipp.DecodeError("xrit_decompress '%s', failed, no output file is generated"%infile)
     return outdir + '/' + outfile    
     
+#-----------------------------------------------------------------------------
+#
+# In process decompression of image segments
+#
+#-----------------------------------------------------------------------------
+_decompressors = []
+
+def register_decompressor(compress_flag, decompressor, data_definition=None):
+    """Register *decompressor* for image segments with the compression flag
+    *compress_flag* (of the image structure header). If *data_definition*
+    (a dictionary) is given, it's only used for segments with these items in
+    their data definition. Decompressors registered later are tried first.
+
+    *decompressor(segment)* returns the decompressed data field, either as a
+    string (as it would be in the uncompressed file) or as an array of
+    (lines, columns) pixel values. Segments are then read straight from the
+    compressed files, without running xRITDecompress.
+    """
+    _decompressors.insert(0, (compress_flag, data_definition or {},
+                              decompressor))
+
+def unregister_decompressor(decompressor):
+    _decompressors[:] = [d for d in _decompressors if d[2] is not decompressor]
+
+def find_decompressor(segment, default=None):
+    """Return the registered decompressor for *segment*, or *default*.
+    """
+    flag = segment.structure.compress_flag
+    try:
+        definition = segment.data_function.data_definition
+    except AttributeError:
+        definition = {}
+    for compress_flag, items, decompressor in _decompressors:
+        if compress_flag != flag:
+            continue
+        for k, v in items.items():
+            if definition.get(k, None) != v:
+                break
+        else:
+            return decompressor
+    return default
+
+def external_decompressor(segment):
+    """The default decompressor, running xRITDecompress (see
+    :func:`decompress`) in a temporary directory.
+    """
+    import shutil
+    import tempfile
+    tmpdir = tempfile.mkdtemp()
+    try:
+        fp = open(decompress(segment.file_name, tmpdir), 'rb')
+        try:
+            read_headers(fp)
+            return fp.read()
+        finally:
+            fp.close()
+    finally:
+        shutil.rmtree(tmpdir)
+
 #-----------------------------------------------------------------------------
 #
 # XRIT header records
 #
+# All records are decoded from an in-memory copy of the record (starting at
+# the record length, i.e. without the leading header type byte), using
+# precompiled struct layouts.
+#
 #-----------------------------------------------------------------------------
+_rec_len_layout = struct.Struct("!H")
+
 class PrimaryHeader(object):
     hdr_type = 0
-    hdr_name = 'primary_header'    
-    def __init__(self, fp):
-        self.rec_len = rbin.read_uint2(fp.read(2))
-        self.file_type = rbin.read_uint1(fp.read(1))
-        self.total_hdr_len = rbin.read_uint4(fp.read(4))
-        self.data_field_len = rbin.read_uint8(fp.read(8))
+    hdr_name = 'primary_header'
+    layout = struct.Struct("!HBIQ")
+    def __init__(self, buf):
+        (self.rec_len, self.file_type, self.total_hdr_len,
+         self.data_field_len) = self.layout.unpack_from(buf)
         
     def __str__(self):
         return  "hdr_type:%d, rec_len:%d, file_type:%d, total_hdr_len:%d, data_field_len:%d"%\
@@ -87,12 +159,10 @@ class PrimaryHeader(object):
 class ImageStructure(object):
     hdr_type = 1
     hdr_name = 'structure'    
-    def __init__(self, fp):
-        self.rec_len = rbin.read_uint2(fp.read(2))
-        self.nb = rbin.read_uint1(fp.read(1))
-        self.nc = rbin.read_uint2(fp.read(2))
-        self.nl = rbin.read_uint2(fp.read(2))
-        self.compress_flag = rbin.read_uint1(fp.read(1))
+    layout = struct.Struct("!HBHHB")
+    def __init__(self, buf):
+        (self.rec_len, self.nb, self.nc, self.nl,
+         self.compress_flag) = self.layout.unpack_from(buf)
         
     def __str__(self):
         return  "hdr_type:%d, rec_len:%d, nb:%d, nc:%d, nl:%d, compress_flag:%d"%\
@@ -101,13 +171,11 @@ class ImageStructure(object):
 class ImageNavigation(object):
     hdr_type = 2
     hdr_name = 'navigation'    
-    def __init__(self, fp):
-        self.rec_len = rbin.read_uint2(fp.read(2))
-        self.proj_name = fp.read(32).strip()
-        self.cfac = rbin.read_int4(fp.read(4))
-        self.lfac = rbin.read_int4(fp.read(4))
-        self.coff = rbin.read_int4(fp.read(4))
-        self.loff = rbin.read_int4(fp.read(4))
+    layout = struct.Struct("!H32s4i")
+    def __init__(self, buf):
+        (self.rec_len, proj_name, self.cfac, self.lfac,
+         self.coff, self.loff) = self.layout.unpack_from(buf)
+        self.proj_name = proj_name.strip()
         i1 = self.proj_name.find('(')
         i2 = self.proj_name.find(')')
         if i1 != -1 and i2 != -1:
@@ -122,9 +190,9 @@ class ImageNavigation(object):
 class ImageDataFunction(object):
     hdr_type = 3
     hdr_name = 'data_function'    
-    def __init__(self, fp):
-        self.rec_len = rbin.read_uint2(fp.read(2))
-        self.data_definition = _decode_data_definition(fp.read(self.rec_len-3))
+    def __init__(self, buf):
+        self.rec_len = _rec_len_layout.unpack_from(buf)[0]
+        self.data_definition = _decode_data_definition(buf[2:self.rec_len-1])
         
     def __str__(self):
         return  "hdr_type:%d, rec_len:%d, data_definition:'%s'"%\
@@ -133,9 +201,9 @@ class ImageDataFunction(object):
 class AnnotationHeader(object):
     hdr_type = 4
     hdr_name = 'annotation'
-    def __init__(self, fp):
-        self.rec_len = rbin.read_uint2(fp.read(2))
-        self.text = fp.read(self.rec_len-3).strip()
+    def __init__(self, buf):
+        self.rec_len = _rec_len_layout.unpack_from(buf)[0]
+        self.text = buf[2:self.rec_len-1].strip()
         a = [x.strip('_') for x in self.text.split('-')]
         self.xrit_channel_id = a[0]
         self.dissemination_id = int(a[1])
@@ -155,10 +223,11 @@ class AnnotationHeader(object):
 class TimeStampRecord(object):
     hdr_type = 5
     hdr_name = 'time_stamp'    
-    def __init__(self, fp):
-        self.rec_len = rbin.read_uint2(fp.read(2))
-        self.cds_p_field = rbin.read_uint1(fp.read(1))
-        self.time_stamp = rbin.read_cds_time(fp.read(6))
+    layout = struct.Struct("!HBHI")
+    def __init__(self, buf):
+        (self.rec_len, self.cds_p_field,
+         days, msecs) = self.layout.unpack_from(buf)
+        self.time_stamp = rbin.cds_time(days, msecs)
 
     def __str__(self):
         return  "hdr_type:%d, rec_len:%d, time_stamp:%s"%\
@@ -167,14 +236,11 @@ class TimeStampRecord(object):
 class SegmentIdentification(object):
     hdr_type = 128
     hdr_name = 'segment'    
-    def __init__(self, fp):
-        self.rec_len = rbin.read_uint2(fp.read(2))
-        self.gp_sc_id = rbin.read_uint2(fp.read(2))
-        self.spectral_channel_id = rbin.read_uint1(fp.read(1))
-        self.seg_no = rbin.read_uint2(fp.read(2))
-        self.planned_start_seg_no = rbin.read_uint2(fp.read(2))
-        self.planned_end_seg_no = rbin.read_uint2(fp.read(2))
-        self.data_field_repr = rbin.read_uint1(fp.read(1))
+    layout = struct.Struct("!HHBHHHB")
+    def __init__(self, buf):
+        (self.rec_len, self.gp_sc_id, self.spectral_channel_id,
+         self.seg_no, self.planned_start_seg_no, self.planned_end_seg_no,
+         self.data_field_repr) = self.layout.unpack_from(buf)
 
     def __str__(self):
         return  "hdr_type:%d, rec_len:%d gp_sc_id:%d, spectral_channel_id:%d, seg_no:%d, planned_start_seg_no:%d, planned_end_seg_no:%d, data_field_repr:%d"%\
@@ -184,20 +250,28 @@ class SegmentIdentification(object):
 class ImageSegmentLineQuality(object):
     hdr_type = 129
     hdr_name = 'image_quality'
+    layout = numpy.dtype([('ln', '>i4'),
+                          ('days', '>u2'),
+                          ('msecs', '>u4'),
+                          ('lv', 'u1'),
+                          ('lr', 'u1'),
+                          ('lg', 'u1')])
     
-    def __init__(self, fp):
-        self.rec_len = rbin.read_uint2(fp.read(2))
-        a = []
-        nb = 3
-        while nb < (self.rec_len):
-            ln = rbin.read_int4(fp.read(4))
-            stamp = rbin.read_cds_time(fp.read(6))
-            lv = rbin.read_uint1(fp.read(1))
-            lr = rbin.read_uint1(fp.read(1))
-            lg = rbin.read_uint1(fp.read(1))
-            a.append((ln, stamp, lv, lr, lg))
-            nb += 13
-        self.line_quality = a        
+    def __init__(self, buf):
+        self.rec_len = _rec_len_layout.unpack_from(buf)[0]
+        count = (self.rec_len - 3) // self.layout.itemsize
+        self.lines = numpy.frombuffer(buf, dtype=self.layout,
+                                      count=count, offset=2)
+        self._line_quality = None
+
+    @property
+    def line_quality(self):
+        # time stamps are only converted on request
+        if self._line_quality is None:
+            self._line_quality = [
+                (ln, rbin.cds_time(days, msecs), lv, lr, lg)
+                for ln, days, msecs, lv, lr, lg in self.lines.tolist()]
+        return self._line_quality
 
     def __str__(self):
         return  "hdr_type:%d, rec_len:%d"%\
@@ -205,10 +279,10 @@ class ImageSegmentLineQuality(object):
 
 class UnknownHeader(object):
     hdr_name = 'unknown'    
-    def __init__(self, hdr_type, fp):
+    def __init__(self, hdr_type, buf):
         self.hdr_type = hdr_type
-        self.rec_len = rbin.read_uint2(fp.read(2))        
-        self.data = fp.read(self.rec_len-3)
+        self.rec_len = _rec_len_layout.unpack_from(buf)[0]
+        self.data = buf[2:self.rec_len-1]
     def __str__(self):
         return  "hdr_type:%d, rec_len:%d"%\
                (self.hdr_type, self.rec_len)
@@ -238,26 +312,85 @@ base_header_map = {0: PrimaryHeader,
               129: ImageSegmentLineQuality}
 base_header_types = tuple(sorted(base_header_map.keys()))
 
+# header type byte + primary header record
+PRIMARY_HEADER_LEN = 1 + PrimaryHeader.layout.size
+
 def read_header(fp):
-    hdr_type = rbin.read_uint1(fp.read(1))
+    """Read the complete header block of an XRIT file, from the current
+    position of *fp*, and yield the decoded header records. The primary header
+    is read first, to get the total header length, the remaining records are
+    fetched with one single read. On return *fp* is positioned at the start of
+    the data field.
+    """
+    buf = fp.read(PRIMARY_HEADER_LEN)
+    if len(buf) < PRIMARY_HEADER_LEN:
+        raise mipp.DecodeError("could not read primary header, file too short")
+    hdr_type = ord(buf[0])
     if hdr_type != 0:
         raise mipp.DecodeError("first header has to be a Primary Header, this one is of type %d"%hdr_type)
-    phdr = PrimaryHeader(fp)
+    phdr = PrimaryHeader(buf[1:])
     yield phdr
-    current_size = phdr.rec_len
-    while current_size < phdr.total_hdr_len:
-        hdr_type = rbin.read_uint1(fp.read(1))
+    size = phdr.total_hdr_len - phdr.rec_len
+    buf = fp.read(size)
+    if len(buf) < size:
+        raise mipp.DecodeError("could not read header records, file too short")
+    for hdr in decode_headers(buf):
+        yield hdr
+
+def decode_headers(buf):
+    """Decode the secondary header records in *buf* (the header block
+    following the primary header).
+    """
+    pos = 0
+    size = len(buf)
+    while pos < size:
+        hdr_type = ord(buf[pos])
+        if pos + 3 > size:
+            raise mipp.DecodeError("truncated header record of type %d"%hdr_type)
+        rec_len = _rec_len_layout.unpack_from(buf, pos + 1)[0]
+        if rec_len < 3 or pos + rec_len > size:
+            raise mipp.DecodeError("corrupt header record of type %d"%hdr_type)
+        rec = buf[pos+1:pos+rec_len]
         cls = header_map.get(hdr_type, None)
-        if cls:
-            hdr = cls(fp)
-        else:
-            hdr = UnknownHeader(hdr_type, fp)
+        try:
+            if cls:
+                hdr = cls(rec)
+            else:
+                hdr = UnknownHeader(hdr_type, rec)
+        except (struct.error, ValueError, IndexError) as err:
+            raise mipp.DecodeError("could not decode header record of type %d: %s"%
+                                   (hdr_type, err))
         yield hdr
-        current_size += hdr.rec_len
+        pos += rec_len
 
 def read_headers(fp):
     return [h for h in read_header(fp)]
 
+def read_file_headers(file_name):
+    """Return the data field offset and the decoded headers of an XRIT file,
+    using the header index if it's enabled (see :mod:`mipp.xrit.index`).
+    """
+    catalog = index.get_index()
+    if catalog is not None:
+        layout = _header_layout()
+        entry = catalog.lookup(file_name, layout)
+        if entry is not None:
+            return entry
+    fp = open(file_name, 'rb')
+    try:
+        headers = read_headers(fp)
+    finally:
+        fp.close()
+    data_offset = headers[0].total_hdr_len
+    if catalog is not None:
+        catalog.store(file_name, layout, data_offset, headers)
+    return data_offset, headers
+
+def _header_layout():
+    return ','.join('%d:%s.%s' % (k, header_map[k].__module__,
+                                  header_map[k].__name__)
+                    for k in sorted(header_map.keys()))
+
 #-----------------------------------------------------------------------------
 #
 # File level
@@ -266,8 +399,8 @@ def read_headers(fp):
 class Segment(object):
     def __init__(self, file_name):
         self.file_name = file_name
-        fp = open(file_name)
-        for h in read_header(fp):
+        self.data_offset, headers = read_file_headers(file_name)
+        for h in headers:
             if h.hdr_type == 0:
                 self.file_type = h.file_type
             elif h.hdr_type == 4:
@@ -281,7 +414,6 @@ class Segment(object):
                 self.production_time = h.time_stamp
             elif h.hdr_type in header_types:
                 setattr(self, h.hdr_name, h)
-        fp.close()
         try:
             self.is_compressed = bool(self.structure.compress_flag)
         except AttributeError:
@@ -292,8 +424,8 @@ class Segment(object):
     @property
     def data(self):
         if not self._blob:
-            fp = open(self.file_name)
-            read_headers(fp)
+            fp = open(self.file_name, 'rb')
+            fp.seek(self.data_offset)
             self._blob = fp.read()
             fp.close()
         return self._blob
@@ -312,22 +444,73 @@ class ImageSegment(Segment):
 
     def __init__(self, file_name):
         Segment.__init__(self, file_name)
+        if self.file_type != 0:
+            raise mipp.DecodeError("this is no 'image data' file: '%s'"%file_name)
+        if not hasattr(self, 'structure'):
+            raise mipp.DecodeError("no image structure header in '%s'"%file_name)
         self.bytes_per_line = (self.structure.nc*self.structure.nb)/8
         self.fp = None
+        self._memmap = None
     
     def readline(self, nlines=1):
         if not self.fp:
-            self.fp = open(self.file_name)
-            read_headers(self.fp)
+            self.fp = open(self.file_name, 'rb')
+            self.fp.seek(self.data_offset)
         data = self.fp.read(self.bytes_per_line*nlines)
         if not data:
             raise mipp.DecodeError("could not read", self.bytes_per_line*nlines, "bytes")
         return data
+
+    @property
+    def memmap(self):
+        """Read-only memory map of the data field, as an array of
+        (lines, bytes per line) unsigned bytes.
+
+        For compressed segments, it's the decompressed data field in memory
+        (see :func:`register_decompressor`), which might also be an array
+        of (lines, columns) pixel values.
+        """
+        if self._memmap is None:
+            if self.is_compressed:
+                self._memmap = self._decompress()
+            else:
+                size = os.path.getsize(self.file_name) - self.data_offset
+                nlines = min(self.structure.nl, size // self.bytes_per_line)
+                self._memmap = numpy.memmap(
+                    self.file_name, dtype=numpy.uint8, mode='r',
+                    offset=self.data_offset,
+                    shape=(nlines, self.bytes_per_line))
+        return self._memmap
+
+    def _decompress(self):
+        decompressor = find_decompressor(self, external_decompressor)
+        data = decompressor(self)
+        if isinstance(data, numpy.ndarray):
+            if data.dtype != numpy.uint8:
+                # pixel values
+                return data.reshape(-1, self.structure.nc)
+            data = data.ravel()
+        else:
+            data = numpy.frombuffer(data, dtype=numpy.uint8)
+        nlines = min(self.structure.nl, data.size // self.bytes_per_line)
+        return data[:nlines * self.bytes_per_line].reshape(
+            nlines, self.bytes_per_line)
+
+    def read_lines(self, start, count):
+        """Return *count* lines, starting at line *start* (0-based), as a
+        zero-copy view of the memory mapped data field.
+        """
+        data = self.memmap
+        if start < 0 or start + count > data.shape[0]:
+            raise mipp.DecodeError("could not read lines %d to %d from '%s'"%
+                                   (start, start + count - 1, self.file_name))
+        return data[start:start + count]
     
     def close(self):
         if self.fp:
             self.fp.close()
             self.fp = None
+        self._memmap = None
 
 def read_prologue(file_name):
     s = Segment(file_name)
@@ -344,11 +527,78 @@ def read_epilogue(file_name):
         raise mipp.DecodeError("this is no 'epilogue' file: '%s'"%file_name)
 
 def read_imagedata(file_name):
-    s = Segment(file_name)
-    if s.file_type == 0:
-        return ImageSegment(file_name)
-    else:
-        raise mipp.DecodeError("this is no 'image data' file: '%s'"%file_name)
+    return ImageSegment(file_name)
+
+#-----------------------------------------------------------------------------
+#
+# Decoded prologues and epilogues
+#
+#-----------------------------------------------------------------------------
+DECODED_CACHE_SIZE = 16
+
+class _DecodedCache(object):
+    """Process wide, bounded, least recently used cache of decoded prologue
+    and epilogue data, keyed by file identity (path, size, modification time)
+    and decoder.
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        # one lock per key being decoded, so a file is decoded once without
+        # holding up the other keys.
+        self._decoding = {}
+
+    def get(self, segment, reader):
+        try:
+            key = index.file_identity(segment.file_name)
+        except OSError:
+            # file gone, we still have the data.
+            return reader(StringIO(segment.data))
+        # independent of how the format module was imported (see sat.py).
+        key += (reader.__module__.replace('/', '.'), reader.__name__)
+        with self._lock:
+            data = self._lookup(key)
+            if data is not None:
+                return data
+            key_lock = self._decoding.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                data = self._lookup(key)
+            if data is None:
+                try:
+                    data = reader(StringIO(segment.data))
+                    with self._lock:
+                        self._data[key] = data
+                        while len(self._data) > self.maxsize:
+                            self._data.popitem(last=False)
+                finally:
+                    with self._lock:
+                        if self._decoding.get(key) is key_lock:
+                            del self._decoding[key]
+        return data
+
+    def _lookup(self, key):
+        # Call with self._lock held.
+        try:
+            data = self._data.pop(key)
+        except KeyError:
+            return None
+        self._data[key] = data
+        return data
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+_decoded_cache = _DecodedCache(DECODED_CACHE_SIZE)
+
+def decoded(segment, reader):
+    """Return the data field of the prologue or epilogue *segment*, decoded
+    by *reader* (e.g. MSG.read_proheader). Decoded data is cached, so it must
+    not be modified by the caller.
+    """
+    return _decoded_cache.get(segment, reader)
     
     
 def read_gts_message(file_name):
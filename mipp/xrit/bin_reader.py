@@ -32,10 +32,15 @@ def read_float8(buf):
     return struct.unpack("!d", buf)[0]
 
 
+_CDS_EPOCH = datetime(1958, 1, 1)
+
+def cds_time(days, msecs):
+    return _CDS_EPOCH + timedelta(days=days, milliseconds=msecs)
+
 def read_cds_time(buf):
     days = read_uint2(buf[:2])
     msecs = read_uint4(buf[2:6])
-    return datetime(1958, 1, 1) + timedelta(days=days, milliseconds=msecs)
+    return cds_time(days, msecs)
 
 def read_cds_expanded_time(buf):
     days = read_uint2(buf[:2])
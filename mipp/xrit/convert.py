@@ -2,70 +2,150 @@ from StringIO import StringIO
 import numpy as np
 
 def dec10216(in_buffer):
-    return _dec10216(np.fromstring(in_buffer, dtype=np.uint8))
+    return unpack10(in_buffer).tostring()
+
+# HRPT (level 0) records are saved as packed 10 bit words with a record
+# length of (11090 - 2) words (the last two words are ignored). The AAPP
+# software expect 10 bit right adjusted in 16 bit words and a complete record
+# length of 11090 words.
+HRPT_RECLEN = 11090
+HRPT_PACKED_RECLEN = (HRPT_RECLEN - 2) * 10 // 8
 
 def hrpt_dec10216(in_buffer):
-    #
-    # It will handle the input data as raw HRPT data (level 0), which
-    # originally is saved as packed 10 bit words width a record length
-    # of (11090 - 2) (the last two words are ignored).
-    # The AAPP software expect 10 bit right adjusted in 16 bit words
-    # and a complete record length of 11090 words.
-    #
-    # !!! THIS ONE COULD BE FASTER !!!
-    #
-    HRPT_RECLEN = 11090
-    fp = StringIO(dec10216(in_buffer))
-    data = ''
-    blob_size = (HRPT_RECLEN - 2)*2
-    blob = fp.read(blob_size)
-    while blob:
-        if len(blob) == blob_size:
-            blob += '\0\0\0\0'
-        data += blob
-        blob = fp.read(blob_size)
-    return data
+    """Unpack raw HRPT data in *in_buffer*, padding each complete record to
+    HRPT_RECLEN words. Returns a string.
+    """
+    fpo = StringIO()
+    hrpt_stream(StringIO(in_buffer), fpo)
+    return fpo.getvalue()
 
-def _dec10216(inbuf):
-    arr10 = inbuf.astype(np.uint16)
-    arr16 = np.zeros((len(arr10) *4 / 5,), dtype=np.uint16)
-    arr10_len = (len(arr16) * 5) / 4
-    arr10 = arr10[:arr10_len] # adjust size
+def hrpt_stream(fpi, fpo, records=64):
+    """Unpack raw HRPT data read from the file object *fpi* and write it to
+    the file object *fpo*, padding each complete record to HRPT_RECLEN words.
+
+    The data is handled *records* records at a time, so memory use doesn't
+    depend on the length of the pass. A trailing incomplete record is
+    written unpadded.
     """
-    /*
-     * pack 4 10-bit words in 5 bytes into 4 16-bit words
-     * 
-     * 0       1       2       3       4       5
-     * 01234567890123456789012345678901234567890
-     * 0         1         2         3         4
-     */      
-    ip = &in_buffer[i];
-    op = &out_buffer[j];
-    op[0] = ip[0]*4 + ip[1]/64;
-    op[1] = (ip[1] & 0x3F)*16 + ip[2]/16;
-    op[2] = (ip[2] & 0x0F)*64 + ip[3]/4;
-    op[3] = (ip[3] & 0x03)*256 +ip[4];
+    nwords = HRPT_RECLEN - 2
+    chunk_size = records * HRPT_PACKED_RECLEN
+    # The two padding words of each record are never written.
+    out = np.zeros((records, HRPT_RECLEN), dtype=np.uint16)
+    while True:
+        blob = _read_full(fpi, chunk_size)
+        if not blob:
+            break
+        nrec = len(blob) // HRPT_PACKED_RECLEN
+        if nrec:
+            packed = np.frombuffer(blob, dtype=np.uint8,
+                                   count=nrec * HRPT_PACKED_RECLEN)
+            unpack10(packed.reshape(nrec, HRPT_PACKED_RECLEN),
+                     out[:nrec, :nwords])
+            fpo.write(out[:nrec].tostring())
+        if len(blob) < chunk_size:
+            tail = blob[nrec * HRPT_PACKED_RECLEN:]
+            if tail:
+                fpo.write(unpack10(tail).tostring())
+            break
+
+def _read_full(fp, size):
+    # Reads from pipes and sockets might return less than asked for.
+    blob = fp.read(size)
+    if len(blob) in (0, size):
+        return blob
+    blobs = [blob]
+    nbytes = len(blob)
+    while nbytes < size:
+        blob = fp.read(size - nbytes)
+        if not blob:
+            break
+        blobs.append(blob)
+        nbytes += len(blob)
+    return ''.join(blobs)
+
+def unpack10(buf, out=None):
+    """Unpack 10 bit words, packed 4 in 5 bytes (big endian), into 16 bit
+    words.
+
+    *buf* is any object supporting the buffer protocol, or an uint8 array
+    where the last axis holds the packed bytes (e.g. a block of image lines).
+    The result is written into *out*, an uint16 array of the unpacked shape
+    (e.g. a row, or rows, of the final image), which is allocated if not
+    given. Returns *out*.
+
+    Only complete groups of 5 bytes are unpacked.
+    """
+    if isinstance(buf, np.ndarray):
+        packed = buf
+        if packed.dtype != np.uint8:
+            raise TypeError("packed data has to be of type uint8, not %s" %
+                            packed.dtype)
+    else:
+        packed = np.frombuffer(buf, dtype=np.uint8)
+    ngroups = packed.shape[-1] // 5
+    lead = packed.shape[:-1]
+    packed = packed[..., :ngroups * 5].reshape(lead + (ngroups, 5))
+
+    if out is None:
+        out = np.empty(lead + (ngroups * 4,), dtype=np.uint16)
+    elif out.dtype != np.uint16 or out.shape != lead + (ngroups * 4,):
+        raise ValueError("output array has to be of type uint16 and shape %s"
+                         % str(lead + (ngroups * 4,)))
+    words = out.view()
+    # raises if the output can't be reshaped without a copy
+    words.shape = lead + (ngroups, 4)
+
+    b0 = packed[..., 0]
+    b1 = packed[..., 1]
+    b2 = packed[..., 2]
+    b3 = packed[..., 3]
+    b4 = packed[..., 4]
+    w0 = words[..., 0]
+    w1 = words[..., 1]
+    w2 = words[..., 2]
+    w3 = words[..., 3]
+    tmp = np.empty(b0.shape, dtype=np.uint16)
+
+    # w0 = b0*4 + b1/64
+    np.left_shift(b0, 2, out=w0, dtype=np.uint16)
+    np.right_shift(b1, 6, out=tmp, dtype=np.uint16)
+    np.bitwise_or(w0, tmp, out=w0)
+    # w1 = (b1 & 0x3F)*16 + b2/16
+    np.bitwise_and(b1, 0x3F, out=w1, dtype=np.uint16)
+    np.left_shift(w1, 4, out=w1)
+    np.right_shift(b2, 4, out=tmp, dtype=np.uint16)
+    np.bitwise_or(w1, tmp, out=w1)
+    # w2 = (b2 & 0x0F)*64 + b3/4
+    np.bitwise_and(b2, 0x0F, out=w2, dtype=np.uint16)
+    np.left_shift(w2, 6, out=w2)
+    np.right_shift(b3, 2, out=tmp, dtype=np.uint16)
+    np.bitwise_or(w2, tmp, out=w2)
+    # w3 = (b3 & 0x03)*256 + b4
+    np.bitwise_and(b3, 0x03, out=w3, dtype=np.uint16)
+    np.left_shift(w3, 8, out=w3)
+    np.bitwise_or(w3, b4, out=w3)
+
+    return out
+
+def unpack10_columns(lines, col_start, col_count):
+    """Unpack the 10 bit words [col_start, col_start + col_count) of each of
+    the packed *lines* (an uint8 array of (lines, bytes per line)). Only the
+    5 byte groups covering the column window are unpacked.
     """
-    arr16.flat[::4] = np.left_shift(arr10[::5], 2) + \
-        np.right_shift((arr10[1::5]), 6)
-    arr16.flat[1::4] = np.left_shift((arr10[1::5] & 63), 4) + \
-        np.right_shift((arr10[2::5]), 4)
-    arr16.flat[2::4] = np.left_shift(arr10[2::5] & 15, 6) + \
-        np.right_shift((arr10[3::5]), 2)
-    arr16.flat[3::4] = np.left_shift(arr10[3::5] & 3, 8) + \
-        arr10[4::5]    
-    return arr16.tostring()
+    first = col_start // 4
+    last = (col_start + col_count + 3) // 4
+    words = unpack10(lines[..., first * 5:last * 5])
+    start = col_start - first * 4
+    return words[..., start:start + col_count]
 
 if __name__ == '__main__':
-    BLOB_SIZE = 10240 # has to be a multiply of 5
-    import sys    
-    try:
-        if sys.argv[1] == 'hrpt':
-            decoder = hrpt_dec10216
-    except IndexError:
-        decoder = dec10216
-    blob = sys.stdin.read(BLOB_SIZE)
-    while blob:
-        sys.stdout.write(decoder(blob))
-        blob = sys.stdin.read(BLOB_SIZE)
-        
+    BLOB_SIZE = 5*65536 # has to be a multiply of 5
+    import sys
+    if sys.argv[1:2] == ['hrpt']:
+        hrpt_stream(sys.stdin, sys.stdout)
+    else:
+        _out = np.empty((BLOB_SIZE // 5 * 4,), dtype=np.uint16)
+        blob = _read_full(sys.stdin, BLOB_SIZE)
+        while blob:
+            sys.stdout.write(unpack10(blob, _out[:len(blob) // 5 * 4]).tostring())
+            blob = _read_full(sys.stdin, BLOB_SIZE)
@@ -0,0 +1,193 @@
+#
+# $Id$
+#
+"""Reuse of decompressed XRIT files.
+
+For each compressed file, a small stamp file is written next to the
+decompressed output, recording the path, size and modification time of the
+compressed input. When the same input is decompressed again into the same
+directory, the existing output is reused as long as the input hasn't
+changed and the output is intact.
+
+Concurrent decompressions of the same file (threads or processes) are
+serialized with an flock(2) on a lock file, so xRITDecompress runs only once.
+The lock is released by the kernel if its owner dies.
+
+Old outputs are evicted by age (XRIT_DECOMPRESS_MAX_AGE, seconds since last
+use) or total size (XRIT_DECOMPRESS_MAX_SIZE, bytes per directory), if set,
+with :func:`evict_configured`, once per batch of files decompressed.
+
+Stamp and lock files are hidden (dot) files, so they don't match XRIT file
+name patterns.
+"""
+import fcntl
+import json
+import logging
+import os
+import time
+
+from mipp.xrit import _xrit
+from mipp.xrit.index import file_identity
+
+logger = logging.getLogger('mipp')
+
+__all__ = ['decompress',
+           'evict',
+           'evict_configured']
+
+_STAMP_SUFFIX = '.src'
+_LOCK_SUFFIX = '.lock'
+
+
+def decompress(infile, outdir='.'):
+    """Decompress *infile* into *outdir*, like :func:`_xrit.decompress`,
+    unless a valid output of an earlier decompression exists. Returns the
+    path to the decompressed file.
+    """
+    base = os.path.join(outdir, '.' + os.path.basename(infile))
+    stamp = base + _STAMP_SUFFIX
+    identity = list(file_identity(infile))
+
+    outfile = _lookup(stamp, identity, outdir)
+    if outfile:
+        logger.debug("Reusing decompressed file " + outfile)
+        return outfile
+
+    lock = base + _LOCK_SUFFIX
+    fd = _acquire(lock)
+    try:
+        # Someone else might have done it while we waited.
+        outfile = _lookup(stamp, identity, outdir)
+        if not outfile:
+            outfile = _xrit.decompress(infile, outdir)
+            _store(stamp, identity, outfile)
+    finally:
+        _release(lock, fd)
+    return outfile
+
+
+def evict(outdir, max_age=None, max_size=None, keep=()):
+    """Remove decompressed files in *outdir* not used for *max_age* seconds,
+    and then the least recently used ones, until their total size is at most
+    *max_size* bytes. Files in *keep* are never removed. Only files written
+    through this module are considered. Returns the number of files removed.
+    """
+    keep = set(os.path.abspath(f) for f in keep)
+    entries = []
+    for name in os.listdir(outdir):
+        if not (name.startswith('.') and name.endswith(_STAMP_SUFFIX)):
+            continue
+        stamp = os.path.join(outdir, name)
+        try:
+            last_used = os.path.getmtime(stamp)
+            outfile, size = _read_stamp(stamp)[1:]
+        except (IOError, OSError, ValueError):
+            continue
+        outfile = os.path.join(outdir, outfile)
+        if os.path.abspath(outfile) not in keep:
+            entries.append((last_used, stamp, outfile, size))
+    entries.sort()
+
+    now = time.time()
+    total = sum(e[3] for e in entries)
+    removed = 0
+    for last_used, stamp, outfile, size in entries:
+        if ((max_age is None or now - last_used <= max_age) and
+                (max_size is None or total <= max_size)):
+            break
+        logger.debug("Evicting decompressed file " + outfile)
+        for file_name in (stamp, outfile):
+            try:
+                os.remove(file_name)
+            except OSError:
+                pass
+        total -= size
+        removed += 1
+    return removed
+
+def evict_configured(keep):
+    """Evict by XRIT_DECOMPRESS_MAX_AGE and XRIT_DECOMPRESS_MAX_SIZE (if set)
+    in the directories of the decompressed files *keep*, which are not
+    removed. Returns the number of files removed.
+    """
+    max_age = os.environ.get('XRIT_DECOMPRESS_MAX_AGE', None)
+    max_size = os.environ.get('XRIT_DECOMPRESS_MAX_SIZE', None)
+    if not (max_age or max_size):
+        return 0
+    removed = 0
+    for outdir in sorted(set(os.path.dirname(f) or os.curdir for f in keep)):
+        removed += evict(outdir,
+                         max_age=max_age and float(max_age),
+                         max_size=max_size and int(max_size),
+                         keep=keep)
+    return removed
+
+#-----------------------------------------------------------------------------
+
+
+def _read_stamp(stamp):
+    fp = open(stamp)
+    try:
+        rec = json.load(fp)
+    finally:
+        fp.close()
+    return rec['input'], rec['output'], rec['size']
+
+
+def _lookup(stamp, identity, outdir):
+    try:
+        source, outfile, size = _read_stamp(stamp)
+    except (IOError, OSError, ValueError, KeyError):
+        return None
+    outfile = outdir + '/' + outfile
+    try:
+        if source != identity or os.path.getsize(outfile) != size:
+            return None
+        # last use, for eviction
+        os.utime(stamp, None)
+    except OSError:
+        return None
+    return outfile
+
+
+def _store(stamp, identity, outfile):
+    tmp = stamp + '.%d' % os.getpid()
+    fp = open(tmp, 'w')
+    try:
+        json.dump({'input': identity,
+                   'output': os.path.basename(outfile),
+                   'size': os.path.getsize(outfile)}, fp)
+    finally:
+        fp.close()
+    os.rename(tmp, stamp)
+
+
+def _acquire(lock):
+    """Lock the file *lock*, creating it if needed, and return its
+    descriptor.
+    """
+    while True:
+        fd = os.open(lock, os.O_CREAT | os.O_WRONLY, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            locked = os.fstat(fd)
+        except (IOError, OSError):
+            os.close(fd)
+            raise
+        # The owner before us removes the file when it's done, so make sure
+        # we locked the one which is still there.
+        try:
+            current = os.stat(lock)
+        except OSError:
+            current = None
+        if (current is not None and
+                (locked.st_dev, locked.st_ino) == (current.st_dev,
+                                                   current.st_ino)):
+            return fd
+        os.close(fd)
+
+
+def _release(lock, fd):
+    # Removed while still locked, waiters then retry with a new file.
+    os.remove(lock)
+    os.close(fd)
@@ -0,0 +1,186 @@
+#
+# $Id$
+#
+"""In memory index of the XRIT files in a directory.
+
+A directory is listed once, and the file names are parsed into their fields
+and indexed by time stamp. The index is kept for later queries, and the
+directory is only listed again when its modification time has changed.
+
+Only file names are looked at, no files are opened.
+"""
+import bisect
+import fnmatch
+import glob as _glob
+import os
+import threading
+import time
+from collections import namedtuple
+
+__all__ = ['XritName',
+           'parse_name',
+           'DirectoryIndex',
+           'get_index',
+           'glob']
+
+XritName = namedtuple('XritName', ['name', 'resolution', 'mission',
+                                   'platform', 'channel', 'segment',
+                                   'time_stamp', 'compressed'])
+
+
+def parse_name(name):
+    """Parse an XRIT file name like
+    'H-000-MSG2__-MSG2________-IR_108___-000004___-201010111400-C_', and
+    return an XritName (fields without the '_' padding, time stamp as a
+    'YYYYmmddHHMM' string), or None if it's no XRIT file name.
+    """
+    fields = name.split('-')
+    if (len(fields) != 8 or len(fields[6]) != 12 or
+            not fields[6].isdigit() or len(fields[7]) != 2 or
+            name.startswith('.')):
+        return None
+    return XritName(name, fields[0], fields[2].rstrip('_'),
+                    fields[3].rstrip('_'), fields[4].rstrip('_'),
+                    fields[5].rstrip('_'), fields[6], fields[7] == 'C_')
+
+
+class DirectoryIndex(object):
+    """Index of the XRIT files in the directory *path*.
+    """
+
+    # A listing taken within this many seconds of a change of the directory
+    # might miss files created in the same clock tick, it's redone.
+    RACY_INTERVAL = 1.0
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._listed = None
+        self._times = []
+        self._by_time = {}
+        self._other = []
+
+    def refresh(self):
+        """List the directory again if it has changed since last time.
+        """
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            mtime = None
+        with self._lock:
+            if (mtime is not None and mtime == self._mtime and
+                    self._listed - mtime > self.RACY_INTERVAL):
+                return
+            listed = time.time()
+            try:
+                names = os.listdir(self.path)
+            except OSError:
+                names = []
+            by_time = {}
+            other = []
+            for name in names:
+                rec = parse_name(name)
+                if rec is None:
+                    other.append(name)
+                else:
+                    by_time.setdefault(rec.time_stamp, []).append(rec)
+            self._by_time = by_time
+            self._times = sorted(by_time.keys())
+            self._other = sorted(other)
+            self._mtime = mtime
+            self._listed = listed
+
+    def query(self, start_time, end_time=None, channel=None, segment=None):
+        """Return the XritName of the files with a time stamp in
+        [*start_time*, *end_time*] (minute resolution), optionally only those
+        of *channel* and *segment* (e.g. 'IR_108', '000004' or 'PRO').
+        """
+        self.refresh()
+        if end_time is None:
+            end_time = start_time
+        with self._lock:
+            lo = bisect.bisect_left(self._times,
+                                    start_time.strftime('%Y%m%d%H%M'))
+            hi = bisect.bisect_right(self._times,
+                                     end_time.strftime('%Y%m%d%H%M'))
+            recs = []
+            for key in self._times[lo:hi]:
+                recs.extend(self._by_time[key])
+        return sorted(r for r in recs
+                      if (channel is None or r.channel == channel) and
+                      (segment is None or r.segment == segment))
+
+    def glob(self, pattern, refresh=True):
+        """Return the sorted names in the directory matching the shell
+        pattern *pattern* (no directory part), as :func:`glob.glob` would.
+        """
+        if refresh:
+            self.refresh()
+        key = _time_key(pattern)
+        with self._lock:
+            if key is None:
+                names = [r.name for recs in self._by_time.values()
+                         for r in recs]
+            else:
+                names = [r.name for r in self._by_time.get(key, [])]
+            names.extend(self._other)
+        if not pattern.startswith('.'):
+            names = [n for n in names if not n.startswith('.')]
+        return sorted(fnmatch.filter(names, pattern))
+
+
+def _time_key(pattern):
+    # An XRIT name pattern with a literal time stamp only matches XRIT file
+    # names with that time stamp.
+    if '[' in pattern:
+        return None
+    fields = pattern.split('-')
+    if (len(fields) == 8 and len(fields[6]) == 12 and
+            fields[6].isdigit()):
+        return fields[6]
+    return None
+
+#-----------------------------------------------------------------------------
+#
+# Process wide indexes
+#
+#-----------------------------------------------------------------------------
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(path):
+    """Return the (shared) index of the directory *path*.
+    """
+    path = os.path.abspath(path)
+    with _indexes_lock:
+        try:
+            return _indexes[path]
+        except KeyError:
+            index = _indexes[path] = DirectoryIndex(path)
+            return index
+
+
+def glob(patterns):
+    """Like :func:`glob.glob`, but answered from the directory index, if only
+    the file name part has wildcards. *patterns* is one pattern or a list of
+    patterns, for which each directory is only checked for changes once.
+    Returns the sorted list of matching paths.
+    """
+    if isinstance(patterns, basestring):
+        patterns = [patterns]
+    refreshed = set()
+    paths = []
+    for pattern in patterns:
+        dirname, basename = os.path.split(pattern)
+        if _glob.has_magic(dirname):
+            paths.extend(_glob.glob(pattern))
+            continue
+        index = get_index(dirname or os.curdir)
+        if index not in refreshed:
+            index.refresh()
+            refreshed.add(index)
+        paths.extend(os.path.join(dirname, name)
+                     for name in index.glob(basename, refresh=False))
+    return sorted(set(paths))
@@ -0,0 +1,289 @@
+#
+# $Id$
+#
+"""Persistent catalog of decoded XRIT segment headers.
+
+The decoded header records of each XRIT file are stored in an SQLite file,
+keyed by path and header layout, and validated against the size and
+modification time of the file. It is enabled by setting the environment
+variable XRIT_HEADER_INDEX to the path of the SQLite file, or by calling
+:func:`set_index`.
+
+The catalog is a cache: it can be deleted at any time and is rebuilt on the
+fly. The header attributes are stored as JSON, so reading a catalog never
+runs code from it. Each entry is committed when it's stored, and database
+errors (e.g. a locked or read-only catalog) are logged and handled as cache
+misses, so a broken catalog never breaks a load.
+"""
+import base64
+import json
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+import numpy as np
+
+logger = logging.getLogger('mipp')
+
+__all__ = ['SegmentIndex',
+           'set_index',
+           'get_index']
+
+# Seconds to wait for a catalog locked by another process.
+BUSY_TIMEOUT = 2.0
+
+_SCHEMA = """\
+CREATE TABLE IF NOT EXISTS segment_headers (
+    path TEXT NOT NULL,
+    layout TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    data_offset INTEGER NOT NULL,
+    headers TEXT NOT NULL,
+    PRIMARY KEY (path, layout))"""
+
+
+class SegmentIndex(object):
+    """Header catalog stored in the SQLite file *path*.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = None
+        try:
+            self._db = sqlite3.connect(path, timeout=BUSY_TIMEOUT,
+                                       check_same_thread=False)
+            # It's a cache, if it gets corrupted it can be rebuilt.
+            self._db.execute("PRAGMA synchronous = OFF")
+            # readers and the writer don't block each other.
+            self._db.execute("PRAGMA journal_mode = WAL")
+            self._db.execute(_SCHEMA)
+            self._db.commit()
+        except sqlite3.Error as err:
+            logger.warning("Header index %s disabled: %s", path, err)
+            self.close()
+
+    def lookup(self, file_name, layout):
+        """Return (data_offset, headers) for *file_name*, or None if the file
+        is not in the catalog or has changed since it was stored.
+        """
+        path, size, mtime = file_identity(file_name)
+        with self._lock:
+            if self._db is None:
+                return None
+            try:
+                row = self._db.execute(
+                    "SELECT size, mtime, data_offset, headers "
+                    "FROM segment_headers WHERE path = ? AND layout = ?",
+                    (path, layout)).fetchone()
+            except sqlite3.Error as err:
+                logger.warning("Header index lookup of %s failed: %s",
+                               path, err)
+                return None
+        if row is None or row[0] != size or row[1] != mtime:
+            return None
+        try:
+            return row[2], _unpack_headers(row[3])
+        except (ValueError, TypeError, KeyError):
+            logger.warning("Unreadable header index entry for %s", path)
+            return None
+
+    def store(self, file_name, layout, data_offset, headers):
+        """Add the headers of *file_name* to the catalog.
+        """
+        path, size, mtime = file_identity(file_name)
+        try:
+            text = _pack_headers(headers)
+        except TypeError as err:
+            logger.debug("Not indexing %s: %s", path, err)
+            return
+        with self._lock:
+            if self._db is None:
+                return
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO segment_headers "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (path, layout, size, mtime, data_offset, text))
+                self._db.commit()
+            except sqlite3.Error as err:
+                logger.warning("Header index store of %s failed: %s",
+                               path, err)
+                try:
+                    self._db.rollback()
+                except sqlite3.Error:
+                    pass
+
+    def purge(self):
+        """Remove entries for files which are gone or has changed.
+        """
+        with self._lock:
+            if self._db is None:
+                return 0
+            rows = self._db.execute(
+                "SELECT path, layout, size, mtime "
+                "FROM segment_headers").fetchall()
+            stale = []
+            for path, layout, size, mtime in rows:
+                try:
+                    if file_identity(path)[1:] != (size, mtime):
+                        stale.append((path, layout))
+                except OSError:
+                    stale.append((path, layout))
+            self._db.executemany(
+                "DELETE FROM segment_headers WHERE path = ? AND layout = ?",
+                stale)
+            self._db.commit()
+        return len(stale)
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+def file_identity(file_name):
+    """Return (absolute path, size, modification time) of *file_name*.
+    """
+    path = os.path.abspath(file_name)
+    st = os.stat(path)
+    return path, st.st_size, st.st_mtime
+
+
+def _pack_headers(headers):
+    # Store plain attributes, not the instances, so the catalog doesn't
+    # depend on where the header classes live.
+    return json.dumps([[h.hdr_type, h.__class__.__name__,
+                        _encode(h.__dict__)] for h in headers],
+                      separators=(',', ':'))
+
+
+def _unpack_headers(text):
+    from mipp.xrit import _xrit
+    headers = []
+    for hdr_type, name, attrs in json.loads(text):
+        cls = _xrit.header_map.get(hdr_type, None)
+        if cls is None or cls.__name__ != name:
+            cls = _xrit.UnknownHeader
+        hdr = cls.__new__(cls)
+        hdr.__dict__.update(_decode(attrs))
+        headers.append(hdr)
+    return headers
+
+def _encode(value):
+    """Turn a header attribute into JSON types. Values that JSON can't
+    represent as they are are tagged with a one key object.
+    """
+    if value is None or isinstance(value, (bool, int, long, float)):
+        return value
+    if isinstance(value, str):
+        # Raw header bytes don't have to be valid UTF-8.
+        return value.decode('latin-1')
+    if isinstance(value, unicode):
+        return {'u': value}
+    if isinstance(value, datetime):
+        return {'datetime': value.isoformat()}
+    if isinstance(value, np.generic):
+        return {'scalar': _encode_array(np.array(value))}
+    if isinstance(value, np.ndarray):
+        return {'ndarray': _encode_array(value)}
+    if isinstance(value, tuple):
+        return {'tuple': [_encode(v) for v in value]}
+    if isinstance(value, list):
+        return [_encode(v) for v in value]
+    if isinstance(value, dict):
+        return {'dict': [[_encode(k), _encode(v)]
+                         for k, v in value.items()]}
+    raise TypeError("can't index a header attribute of type %s" %
+                    type(value).__name__)
+
+
+def _decode(value):
+    if isinstance(value, unicode):
+        return value.encode('latin-1')
+    if isinstance(value, list):
+        return [_decode(v) for v in value]
+    if not isinstance(value, dict):
+        return value
+    (tag, value), = value.items()
+    if tag == 'u':
+        return value
+    if tag == 'datetime':
+        if '.' in value:
+            return datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.%f')
+        return datetime.strptime(value, '%Y-%m-%dT%H:%M:%S')
+    if tag == 'scalar':
+        return _decode_array(value)[()]
+    if tag == 'ndarray':
+        return _decode_array(value)
+    if tag == 'tuple':
+        return tuple(_decode(v) for v in value)
+    if tag == 'dict':
+        return dict((_decode(k), _decode(v)) for k, v in value)
+    raise ValueError("unknown header index tag '%s'" % tag)
+
+
+def _encode_array(array):
+    if array.dtype.hasobject:
+        raise TypeError("can't index an object array")
+    if array.dtype.fields is None:
+        dtype = array.dtype.str
+    else:
+        dtype = array.dtype.descr
+    return [dtype, list(array.shape),
+            base64.b64encode(np.ascontiguousarray(array).tostring())]
+
+
+def _decode_array(value):
+    dtype, shape, data = value
+    array = np.fromstring(base64.b64decode(data), dtype=_decode_dtype(dtype))
+    return array.reshape(shape)
+
+
+def _decode_dtype(descr):
+    """Rebuild a dtype from its JSON'ed str or descr.
+    """
+    if not isinstance(descr, list):
+        return np.dtype(str(descr))
+
+    def field(item):
+        name, fmt = item[:2]
+        if isinstance(fmt, list):
+            fmt = _decode_dtype(fmt)
+        else:
+            fmt = str(fmt)
+        return (str(name), fmt) + tuple(tuple(shape) for shape in item[2:])
+    return np.dtype([field(item) for item in descr])
+
+#-----------------------------------------------------------------------------
+#
+# Process wide catalog
+#
+#-----------------------------------------------------------------------------
+_index = None
+_configured = False
+
+
+def set_index(path):
+    """Use the catalog in *path* (None to disable it).
+    """
+    global _index, _configured
+    if _index is not None:
+        _index.close()
+    _index = None
+    _configured = True
+    if path:
+        logger.info("Using XRIT header index %s", path)
+        _index = SegmentIndex(path)
+
+
+def get_index():
+    """Return the current catalog, or None if it's disabled.
+    """
+    if not _configured:
+        set_index(os.environ.get('XRIT_HEADER_INDEX', None))
+    return _index
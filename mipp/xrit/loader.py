@@ -5,7 +5,11 @@
 #
 import copy
 import logging
+import os
+import threading
+import time
 import types
+from multiprocessing.pool import ThreadPool
 
 import numpy
 
@@ -17,21 +21,177 @@ logger = logging.getLogger('mipp')
 
 __all__ = ['ImageLoader']
 
+# Default seconds :meth:`ImageLoader.progressive` waits for a new segment,
+# a bit more than a full disc repeat cycle, so a segment that was never
+# delivered doesn't make it wait forever.
+PROGRESSIVE_TIMEOUT = 20 * 60
+
 
 def _null_converter(blob):
     return blob
 
 
 class ImageLoader(object):
-
-    def __init__(self, mda, image_files, mask=False, calibrate=False):
+    """Slice-able reader of the image segments *image_files*.
+
+    With *workers* > 1, the segments covered by a slice are read and decoded
+    by a pool of that many threads.
+
+    Segments arriving later can be added with :meth:`add_files`, or be
+    waited for with :meth:`progressive`.
+
+    *calibrate* is 0 (counts), 1 (reflectances/brightness temperatures) or 2
+    (radiances), or a tuple of those, e.g. (0, 2, 1). All quantities of a
+    tuple are calibrated from one read, and slices are then tuples of
+    images (and mda.calibration_unit a tuple of units).
+
+    *dtype* (e.g. numpy.float32) is the data type of the returned images
+    (calibrated or counts), default is that of the calibration. With *fill*
+    (e.g. 'nan'), no data pixels are set to that value and plain arrays are
+    returned, instead of masked arrays (*mask* is then ignored).
+
+    With *stats*, statistics of the valid pixels of a slice are accumulated
+    while the segments are read, and set as mda.stats: a dictionary of
+    'count' (valid pixels), 'min', 'max', 'mean', 'std' (of the calibrated
+    values) and 'histogram' (of the counts of all pixels read), or a tuple
+    of those, for a tuple of *calibrate*. With *stats_only*, only the
+    statistics are computed, segment by segment, and slices return
+    (mda, None).
+    """
+
+    def __init__(self, mda, image_files, mask=False, calibrate=False,
+                 workers=None, dtype=None, fill=None, stats=False,
+                 stats_only=False):
         self.mda = mda
         self.image_files = image_files
         self.do_mask = mask
         self.do_calibrate = calibrate
+        self.workers = workers or 1
+        self.dtype = dtype
+        if isinstance(fill, basestring):
+            fill = float(fill)
+        self.fill = fill
+        self.stats = stats or stats_only
+        self.stats_only = stats_only
+        # headers are only parsed once, and reused for all slices.
+        self._segments, self._segment_nlines = _segment_catalog(image_files)
         # full disc and square
         self._allrows = slice(0, self.mda.image_size[0])  # !!!
         self._allcolumns = slice(0, self.mda.image_size[0])
+        # for progressive loading, see SatelliteLoader.load
+        self.find_files = None
+
+    def add_files(self, image_files):
+        """Add image segment files which have arrived since the loader was
+        made. Files not (completely) written yet are skipped. Returns the
+        numbers of the new segments.
+        """
+        known = set(self.image_files)
+        added = []
+        for f in image_files:
+            if f in known:
+                continue
+            try:
+                s = _xrit.read_imagedata(f)
+            except (IOError, OSError, mipp.DecodeError):
+                continue
+            if (not hasattr(s, 'segment') or
+                    s.segment.seg_no in self._segments or
+                    not _is_written(s)):
+                continue
+            self._segments[s.segment.seg_no] = s
+            self._segment_nlines = s.structure.nl
+            self.image_files = sorted(self.image_files + [f])
+            added.append(s.segment.seg_no)
+        return sorted(added)
+
+    @property
+    def valid_rows(self):
+        """Row slices (as used for slicing) covered by the segments added so
+        far.
+        """
+        rows = []
+        for r in sorted((self._segment_rows(n) for n in self._segments),
+                        key=lambda r: r.start):
+            if rows and rows[-1].stop == r.start:
+                rows[-1] = slice(rows[-1].start, r.stop)
+            else:
+                rows.append(r)
+        return rows
+
+    def progressive(self, find_files=None, interval=5.0,
+                    timeout=PROGRESSIVE_TIMEOUT, out=None):
+        """Yield (rows, image) for each image segment (rows is a slice as used
+        for slicing), as soon as it's there.
+
+        *find_files()* returns the current list of image segment files
+        (default is the one of :meth:`SatelliteLoader.load`). It's called
+        every *interval* seconds until all planned segments are read, or no
+        new segment has arrived for *timeout* seconds (default
+        :data:`PROGRESSIVE_TIMEOUT`, None to wait for ever). Segments that
+        didn't arrive by then are just missing from the image. Without
+        *find_files*, only the segments already there are read.
+
+        If *out* is given, an array of the full image shape, the rows are
+        also written into it. With a tuple *calibrate*, images are tuples, and
+        *out* must be a tuple of as many arrays.
+        """
+        several = isinstance(self.do_calibrate, (tuple, list))
+        if out is not None:
+            if several:
+                if (not isinstance(out, (tuple, list)) or
+                        len(out) != len(self.do_calibrate)):
+                    raise ValueError("out must be a tuple of %d arrays, for "
+                                     "calibrate=%s" % (len(self.do_calibrate),
+                                                       self.do_calibrate))
+                outs = out
+            else:
+                outs = (out,)
+        if find_files is None:
+            find_files = self.find_files
+        done = set()
+        last_arrival = time.time()
+        while True:
+            if find_files is not None:
+                try:
+                    self.add_files(find_files())
+                except mipp.NoFiles:
+                    pass
+            ready = sorted(n for n in self._segments if n not in done)
+            for seg_no in ready:
+                done.add(seg_no)
+                rows = self._segment_rows(seg_no)
+                image = self[rows][1]
+                if image is None:
+                    # e.g. outside the HRV regions
+                    continue
+                if out is not None:
+                    for o, img in zip(outs, image if several else (image,)):
+                        o[rows] = img
+                yield rows, image
+            now = time.time()
+            if ready:
+                last_arrival = now
+            if (find_files is None or self._planned_segments() <= done or
+                    (timeout is not None and now - last_arrival > timeout)):
+                return
+            time.sleep(interval)
+
+    def _segment_rows(self, seg_no):
+        """Rows of segment *seg_no*, as used for slicing.
+        """
+        nrows = self.mda.image_size[1]
+        start = min((seg_no - 1) * self._segment_nlines, nrows)
+        stop = min(seg_no * self._segment_nlines, nrows)
+        if self.mda.first_pixel.split()[0] == 'south':
+            start, stop = nrows - stop, nrows - start
+        return slice(start, stop)
+
+    def _planned_segments(self):
+        for s in self._segments.values():
+            return set(range(s.segment.planned_start_seg_no,
+                             s.segment.planned_end_seg_no + 1))
+        return set()
 
     def raw_slicing(self, item):
         """Raw slicing, no rotation of image.
@@ -44,8 +204,13 @@ class ImageLoader(object):
 
         ns_, ew_ = mda.first_pixel.split()
 
+        hist = None
+        if self.stats:
+            # histogram of the counts, added to for each segment read
+            hist = numpy.zeros(2 ** abs(mda.data_type), dtype=numpy.int64)
+
         if not hasattr(mda, "boundaries"):
-            image = self._read(rows, columns, mda)
+            image = self._read(rows, columns, mda, hist)
 
         else:
             #
@@ -53,6 +218,7 @@ class ImageLoader(object):
             # (for example MSG's HRV channel)
             #
             image = None
+            images = None
 
             for region in (mda.boundaries - 1):
                 rlines = slice(region[0], region[1] + 1)
@@ -69,32 +235,63 @@ class ImageLoader(object):
                               min(rows.stop, rlines.stop))
                 cols = slice(max(columns.start, rcols.start) - rcols.start,
                              min(columns.stop, rcols.stop) - rcols.start)
-                rdata = self._read(lines, cols, mda)
+                rdata = self._read(lines, cols, mda, hist)
+                if self.stats_only:
+                    continue
+                if not isinstance(rdata, tuple):
+                    rdata = (rdata,)
                 lines = slice(max(rows.start, rlines.start) - rows.start,
                               min(rows.stop, rlines.stop) - rows.start)
                 cols = slice(max(columns.start, rcols.start) - columns.start,
                              min(columns.stop, rcols.stop) - columns.start)
-                if image is None:
-                    image = (numpy.zeros((rows.stop - rows.start,
-                                          columns.stop - columns.start),
-                                         dtype=rdata.dtype)
-                             + mda.no_data_value)
-                    if self.do_mask:
-                        image = numpy.ma.masked_all_like(image)
-
+                if (images is None and
+                        (lines.stop - lines.start,
+                         cols.stop - cols.start) == rdata[0].shape[:2] ==
+                        (rows.stop - rows.start,
+                         columns.stop - columns.start)):
+                    # the region covers the whole slice
+                    images = list(rdata)
+                    continue
+                if images is None:
+                    images = []
+                    for data in rdata:
+                        image = numpy.zeros((rows.stop - rows.start,
+                                             columns.stop - columns.start),
+                                            dtype=data.dtype)
+                        if self.fill is not None:
+                            image[:] = self.fill
+                        else:
+                            image += mda.no_data_value
+                        if self.do_mask and self.fill is None:
+                            image = numpy.ma.masked_all_like(image)
+                        images.append(image)
+
+                shape = images[0].shape
                 if ns_ == "south":
-                    lines = slice(image.shape[0] - lines.stop,
-                                  image.shape[0] - lines.start)
+                    lines = slice(shape[0] - lines.stop,
+                                  shape[0] - lines.start)
                 if ew_ == "east":
-                    cols = slice(image.shape[1] - cols.stop,
-                                 image.shape[1] - cols.start)
-                if self.do_mask:
-                    image.mask[lines, cols] = rdata.mask
-                image[lines, cols] = rdata
+                    cols = slice(shape[1] - cols.stop,
+                                 shape[1] - cols.start)
+                for image, data in zip(images, rdata):
+                    if self.do_mask and self.fill is None:
+                        image.mask[lines, cols] = data.mask
+                    image[lines, cols] = data
 
-        if not hasattr(image, 'shape'):
-            logger.warning("Produced no image")
-            return None, None
+            if images is not None:
+                image = images[0] if len(images) == 1 else tuple(images)
+
+        if self.stats_only:
+            image = None
+            shape = (rows.stop - rows.start, columns.stop - columns.start)
+        else:
+            # the first quantity, if several
+            first = image[0] if isinstance(image, tuple) else image
+            if not hasattr(first, 'shape'):
+                logger.warning("Produced no image")
+                return None, None
+            shape = first.shape
+            mda.data_type = 8 * first.itemsize
 
         #
         # Update meta-data
@@ -105,8 +302,10 @@ class ImageLoader(object):
         if (rows != self._allrows) or (columns != self._allcolumns):
             mda.region_name = 'sliced'
 
-        mda.data_type = 8 * image.itemsize
-        mda.image_size = numpy.array([image.shape[1], image.shape[0]])
+        mda.image_size = numpy.array([shape[1], shape[0]])
+
+        if hist is not None:
+            mda.stats = self._statistics(hist)
 
         return mipp.mda.mslice(mda), image
 
@@ -126,7 +325,7 @@ class ImageLoader(object):
     def __call__(self, area_extent=None):
         """Slice according to (ll_x, ll_y, ur_x, ur_y) or read full disc.
         """
-        if area_extent == None:
+        if area_extent is None:
             # full disc
             return self[:]
 
@@ -262,7 +461,30 @@ class ImageLoader(object):
 
         return [ll_x, ll_y, ur_x, ur_y]
 
-    def _read(self, rows, columns, mda):
+    def _statistics(self, hist):
+        """Statistics of the valid pixels, from the histogram *hist* of their
+        counts, for each quantity calibrated.
+        """
+        counts = numpy.arange(len(hist), dtype=numpy.uint16)
+        several = isinstance(self.do_calibrate, (tuple, list))
+        stats = []
+        for calibrate in (self.do_calibrate if several
+                          else (self.do_calibrate,)):
+            valid = counts != self.mda.no_data_value
+            if int(calibrate):
+                # through the lookup table of the calibration
+                values = self.mda.calibrate(counts, calibrate=int(calibrate))[0]
+                valid &= ~numpy.ma.getmaskarray(values)
+                values = numpy.ma.getdata(values).astype(numpy.float64)
+                valid &= numpy.isfinite(values)
+            else:
+                values = counts.astype(numpy.float64)
+            stats.append(_statistics(hist, values, valid))
+        if several:
+            return tuple(stats)
+        return stats[0]
+
+    def _read(self, rows, columns, mda, hist=None):
         shape = (rows.stop - rows.start, columns.stop - columns.start)
         if (columns.start < 0 or
                 columns.stop > mda.image_size[0] or
@@ -270,19 +492,8 @@ class ImageLoader(object):
                 rows.stop > mda.image_size[1]):
             raise IndexError, "index out of range"
 
-        image_files = self.image_files
-
-        #
-        # Order segments
-        #
-        segments = {}
-        for f in image_files:
-            s = _xrit.read_imagedata(f)
-            segments[s.segment.seg_no] = f
-        start_seg_no = s.segment.planned_start_seg_no
-        end_seg_no = s.segment.planned_end_seg_no
-        ncols = s.structure.nc
-        segment_nlines = s.structure.nl
+        segments = self._segments
+        segment_nlines = self._segment_nlines
 
         #
         # Data type
@@ -292,7 +503,7 @@ class ImageLoader(object):
             data_type = numpy.uint8
             data_type_len = 8
         elif mda.data_type == 10:
-            converter = convert.dec10216
+            converter = convert.unpack10
             data_type = numpy.uint16
             data_type_len = 16
         elif mda.data_type == 16:
@@ -353,16 +564,21 @@ class ImageLoader(object):
         #
         # Generate final image with no data
         #
-        image = numpy.zeros(shape, dtype=data_type) + mda.no_data_value
+        if self.stats_only:
+            # segments are read into buffers of their own
+            image = None
+        else:
+            image = numpy.zeros(shape, dtype=data_type) + mda.no_data_value
+        hist_lock = threading.Lock()
 
         #
-        # Begin the segment processing.
+        # Collect the segments to process, which lines to read from each of
+        # them, and where they go in the image.
         #
+        jobs = []
         seg_no = seg_init
         line_in_image = first_line
         while seg_no <= seg_end:
-            line_in_segment = 1
-
             #
             # Calculate initial line in actual segment.
             #
@@ -381,41 +597,66 @@ class ImageLoader(object):
             else:
                 end_line_in_segment = segment_nlines
 
-            #
-            # Open segment file.
-            #
-            seg_file = segments.get(seg_no, None)
-            if not seg_file:
+            nlines = end_line_in_segment - init_line_in_segment + 1
+
+            seg = segments.get(seg_no, None)
+            if seg is None:
                 #
                 # No data for this segment.
                 #
                 logger.warning("Segment number %d not found" % seg_no)
-
                 # all image lines are already set to no-data count.
-                line_in_segment = init_line_in_segment
-                while line_in_segment <= end_line_in_segment:
-                    line_in_segment += 1
-                    line_in_image += increment_line
             else:
-                #
-                # Data for this segment.
-                #
-                logger.info("Read %s" % seg_file)
-                seg = _xrit.read_imagedata(seg_file)
+                jobs.append((seg, init_line_in_segment, nlines,
+                             line_in_image))
+
+            line_in_image += increment_line * nlines
+            seg_no += 1
+
+        def read_segment(job):
+            seg, init_line_in_segment, nlines, line_in_image = job
+            logger.info("Read %s" % seg.file_name)
 
+            target = image
+            if target is None:
+                target = numpy.empty((nlines, col_count), dtype=data_type)
+                line_in_image = 0 if increment_line == 1 else nlines - 1
+            if increment_line == 1:
+                first_row = line_in_image
+            else:
+                first_row = line_in_image - nlines + 1
+
+            #
+            # Map the lines to be processed, no reading of
+            # skipped lines.
+            #
+            lines = seg.read_lines(init_line_in_segment - 1, nlines)
+
+            if mda.line_offset == 0:
                 #
-                # Skip lines not processed.
+                # Decode all lines of the segment at once, straight
+                # into the image rows.
                 #
-                while line_in_segment < init_line_in_segment:
-                    line = seg.readline()
-                    line_in_segment += 1
+                if increment_line == 1:
+                    rows_in_image = target[line_in_image:
+                                           line_in_image + nlines]
+                else:
+                    rows_in_image = target[line_in_image - nlines + 1:
+                                           line_in_image + 1][::-1]
+                rows_in_image[:] = _decode_lines(
+                    lines, mda.data_type, data_type,
+                    columns.start, col_count)[:, ::factor_col]
 
+            else:
                 #
-                # Reading and processing segment lines.
+                # Processing segment lines, one by one.
                 #
-                while line_in_segment <= end_line_in_segment:
-                    line = seg.readline()[mda.line_offset:]
-                    line = converter(line)
+                if lines.dtype != numpy.uint8:
+                    raise mipp.ReaderError(
+                        "can't apply a line offset to decompressed pixel "
+                        "values: '%s'" % seg.file_name)
+                for line in lines:
+                    line = converter(line[mda.line_offset:])
 
                     line = (numpy.frombuffer(line,
                                              dtype=data_type,
@@ -425,14 +666,35 @@ class ImageLoader(object):
                     #
                     # Insert image data.
                     #
-                    image[line_in_image] = line
+                    target[line_in_image] = line
 
-                    line_in_segment += 1
                     line_in_image += increment_line
 
-                seg.close()
+            seg.close()
 
-            seg_no += 1
+            if hist is not None:
+                _add_histogram(hist, target[first_row:first_row + nlines],
+                               hist_lock)
+
+        #
+        # Begin the segment processing. Segments fill disjoint rows of the
+        # image, so they can be processed concurrently (the decoding is done
+        # by numpy, which releases the GIL).
+        #
+        if self.workers > 1 and len(jobs) > 1:
+            pool = ThreadPool(min(self.workers, len(jobs)))
+            try:
+                pool.map(read_segment, jobs, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for job in jobs:
+                read_segment(job)
+
+        if image is None:
+            # statistics only
+            return None
 
         #
         # Compute mask before calibration
@@ -444,25 +706,127 @@ class ImageLoader(object):
         # Calibrate ?
         #
         mda.is_calibrated = False
-        if self.do_calibrate:
+        if isinstance(self.do_calibrate, (tuple, list)):
+            # several quantities, in one pass
+            results = mda.calibrate.calibrate_many(
+                image, [int(c) for c in self.do_calibrate], dtype=self.dtype)
+            mda.calibration_unit = tuple(unit for data, unit in results)
+            mda.is_calibrated = True
+            images = []
+            for data, unit in results:
+                if unit == "counts" and self.dtype is not None:
+                    data = data.astype(self.dtype)
+                images.append(self._mask(data, mask, mda))
+            return tuple(images)
+        elif self.do_calibrate:
             # do this before masking.
             calibrate = self.do_calibrate
             if isinstance(calibrate, bool):
                 # allow boolean True/False for 1/0
                 calibrate = int(calibrate)
             image, mda.calibration_unit = mda.calibrate(
-                image, calibrate=calibrate)
+                image, calibrate=calibrate, dtype=self.dtype)
             mda.is_calibrated = True
         else:
             mda.calibration_unit = ""
+            if self.dtype is not None:
+                image = image.astype(self.dtype)
+
+        return self._mask(image, mask, mda)
 
+    def _mask(self, image, mask, mda):
         #
         # With or without mask ?
         #
-        if self.do_mask and not isinstance(image, numpy.ma.core.MaskedArray):
+        if self.fill is not None:
+            image = _fill(image, mask, self.fill)
+        elif self.do_mask and not isinstance(image, numpy.ma.core.MaskedArray):
             image = numpy.ma.array(image, mask=mask, copy=False)
         elif ((not self.do_mask) and
                 isinstance(image, numpy.ma.core.MaskedArray)):
             image = image.filled(mda.no_data_value)
 
         return image
+
+
+def _fill(image, mask, fill):
+    """Return *image* as a plain array with *fill* in the pixels of *mask*
+    and those masked by the calibration.
+    """
+    if isinstance(image, numpy.ma.core.MaskedArray):
+        if image.mask is not numpy.ma.nomask:
+            mask = mask | image.mask
+        image = image.data
+    if not numpy.can_cast(numpy.min_scalar_type(fill), image.dtype):
+        # e.g. NaN in counts
+        image = image.astype(numpy.float64)
+    numpy.copyto(image, fill, where=mask)
+    return image
+
+
+def _add_histogram(hist, counts, lock):
+    """Add the histogram of *counts* to *hist*.
+    """
+    counts = numpy.bincount(counts.ravel(), minlength=len(hist))
+    with lock:
+        hist += counts[:len(hist)]
+
+
+def _statistics(hist, values, valid):
+    """Count, min, max, mean and standard deviation of the pixels, from the
+    histogram *hist* of their counts, the calibrated *values* of each count
+    and which counts are *valid*.
+    """
+    valid = valid & (hist > 0)
+    weights = hist[valid]
+    values = values[valid]
+    count = int(weights.sum())
+    if count == 0:
+        return {'count': 0, 'min': None, 'max': None, 'mean': None,
+                'std': None, 'histogram': hist}
+    mean = numpy.dot(weights, values) / count
+    std = numpy.sqrt(numpy.dot(weights, (values - mean) ** 2) / count)
+    return {'count': count,
+            'min': float(values.min()),
+            'max': float(values.max()),
+            'mean': float(mean),
+            'std': float(std),
+            'histogram': hist}
+
+
+def _decode_lines(lines, bits_per_pixel, data_type, col_start, col_count):
+    """Decode a block of raw image lines, (lines, bytes per line), and return
+    the columns [col_start, col_start + col_count) as (lines, columns).
+    """
+    if lines.dtype != numpy.uint8:
+        # pixel values, from an in process decompressor
+        data = lines
+    elif bits_per_pixel == 10:
+        return convert.unpack10_columns(lines, col_start, col_count)
+    elif bits_per_pixel == 8:
+        data = lines
+    else:
+        data = lines.view(data_type)
+    return data[:, col_start:col_start + col_count]
+
+
+def _is_written(segment):
+    """Check if the data field of *segment* is complete.
+    """
+    if segment.is_compressed:
+        return True
+    size = os.path.getsize(segment.file_name) - segment.data_offset
+    return size >= segment.structure.nl * segment.bytes_per_line
+
+
+def _segment_catalog(image_files):
+    """Map segment number to image segment (with decoded headers), and return
+    it together with the number of lines per segment.
+    """
+    segments = {}
+    segment_nlines = None
+    for f in image_files:
+        s = _xrit.read_imagedata(f)
+        segments[s.segment.seg_no] = s
+        segment_nlines = s.structure.nl
+    return segments, segment_nlines
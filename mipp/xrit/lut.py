@@ -0,0 +1,308 @@
+#
+# $Id$
+#
+"""Calibration through count lookup tables.
+
+Image data are counts of at most *nb* bits (the image structure header), so
+a calibration has at most 2**nb distinct results. :class:`LutCalibrator`
+evaluates the calibration formulas of a format once, for all count values,
+and then calibrates an image with a single gather (numpy.take) into the
+lookup table.
+
+Images which can't be looked up are calibrated in blocks of rows, so the
+temporaries of the formulas stay cache sized, into one output array.
+
+The tables also give the inverse calibration: the counts with calibrated
+values within physical thresholds, so thresholds can be applied to count
+images without calibrating them.
+"""
+import threading
+
+import numpy as np
+
+from mipp import CalibrationError
+
+__all__ = ['LutCalibrator']
+
+
+class _Table(object):
+
+    def __init__(self, result, unit, dtype=None):
+        if dtype is not None:
+            result = result.astype(dtype)
+        self.unit = unit
+        self.mask = None
+        self.masked_range = None
+        if isinstance(result, np.ma.MaskedArray):
+            self.values = result.data
+            self.mask = np.ma.getmaskarray(result)
+            # Usually the masked counts are a single run (e.g. no data
+            # value, or counts below the space count), then comparing is
+            # cheaper than a second gather.
+            masked = np.flatnonzero(self.mask)
+            if len(masked) == 0:
+                self.masked_range = (1, 0)
+            elif masked[-1] - masked[0] + 1 == len(masked):
+                self.masked_range = (masked[0], masked[-1])
+        else:
+            self.values = result
+
+    def range_mask(self, image):
+        first, last = self.masked_range
+        if first > last:
+            return np.zeros(image.shape, dtype=bool)
+        elif first == last:
+            return image == first
+        elif first == 0:
+            return image <= last
+        return (image >= first) & (image <= last)
+
+    def apply(self, image, out=None, block_pixels=None):
+        return _lookup([self], image, [out], block_pixels)[0]
+
+
+class LutCalibrator(object):
+    """Base class of the calibrators of the XRIT formats.
+
+    Subclasses implement *convert(image, calibrate)*, computing the
+    calibration of an array of counts per pixel, and set *bits_per_pixel*.
+    A call, *calibrator(image, calibrate=1)*, evaluates *convert* on all
+    possible counts the first time it's called with a given *calibrate*,
+    and then looks the counts of *image* up in that table.
+
+    Images which are no arrays of unsigned integers, or with counts outside
+    the table, are converted per pixel, *block_pixels* pixels at a time. The
+    mask of a masked image is kept.
+
+    Several quantities are calibrated in one pass with
+    :meth:`calibrate_many`. Subclasses can implement *convert_many(image,
+    calibrates)* to share intermediate results (e.g. radiances) between
+    them.
+    """
+
+    bits_per_pixel = None
+
+    # Pixels per block for per pixel conversion and table look up, the
+    # formulas keep a few float64 temporaries of this size.
+    block_pixels = 32768
+
+    def __call__(self, image, calibrate=1, out=None, dtype=None):
+        """Calibrate *image* (counts), returning (calibrated image, unit). If
+        given, the calibrated values are written into the array *out*, else
+        into a new array of type *dtype* (e.g. numpy.float32), by default
+        that of the calibration formulas. Counts (*calibrate* = 0) are
+        returned as they are.
+        """
+        if calibrate == 0:
+            return _into(self.convert(image, calibrate), out)
+        return self._calibrate(image, [calibrate], [out], dtype)[0]
+
+    def calibrate_many(self, image, calibrates=(0, 2, 1), outs=None,
+                       dtype=None):
+        """Calibrate *image* to each of *calibrates* (see :meth:`__call__`)
+        in one pass over the image, returning a list of (image, unit). *outs*
+        is an optional list of output arrays, one per *calibrates*.
+        """
+        calibrates = list(calibrates)
+        if outs is None:
+            outs = [None] * len(calibrates)
+        results = [_into((image, "counts"), out) for out in outs]
+        todo = [i for i, calibrate in enumerate(calibrates) if calibrate != 0]
+        if todo:
+            for i, result in zip(todo, self._calibrate(
+                    image, [calibrates[i] for i in todo],
+                    [outs[i] for i in todo], dtype)):
+                results[i] = result
+        return results
+
+    def table(self, calibrate=1, dtype=None):
+        """Return the lookup table for *calibrate*, with values of type
+        *dtype*.
+        """
+        key = (calibrate, dtype and np.dtype(dtype))
+        tables = self.__dict__.setdefault('_tables', {})
+        try:
+            return tables[key]
+        except KeyError:
+            pass
+        # guards the building of the tables of this calibrator
+        lock = self.__dict__.setdefault('_tables_lock', threading.Lock())
+        with lock:
+            if key not in tables:
+                counts = np.arange(2 ** self.bits_per_pixel,
+                                   dtype=np.uint16)
+                # e.g. brightness temperatures of zero radiance, those
+                # counts are masked
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    result, unit = self.convert(counts, calibrate)
+                tables[key] = _Table(result, unit, dtype)
+            return tables[key]
+
+    def count_range(self, low=None, high=None, calibrate=1):
+        """Inverse calibration: return (first, last), the counts (not masked
+        by the calibration) with calibrated values *v*, low <= v <= high, are
+        first, ..., last. Either threshold can be None. If there are no such
+        counts, first > last. Raises CalibrationError if the counts are not
+        one range (the calibration is not monotonic over them).
+        """
+        selected = np.flatnonzero(self._selected(low, high, calibrate))
+        if len(selected) == 0:
+            return 1, 0
+        first, last = int(selected[0]), int(selected[-1])
+        if last - first + 1 != len(selected):
+            raise CalibrationError("Calibrated values in [%s, %s] are not "
+                                   "one range of counts" % (low, high))
+        return first, last
+
+    def in_range(self, image, low=None, high=None, calibrate=1):
+        """Return the boolean array of the pixels of *image* (counts) with
+        calibrated values *v*, low <= v <= high, computed on the counts.
+        Masked pixels are False.
+        """
+        if isinstance(image, np.ma.MaskedArray):
+            return (self.in_range(image.data, low, high, calibrate) &
+                    ~np.ma.getmaskarray(image))
+        if not self._in_table(image):
+            data = self(image, calibrate)[0]
+            with np.errstate(invalid='ignore'):
+                selected = ~np.ma.getmaskarray(data)
+                if low is not None:
+                    selected &= np.ma.getdata(data) >= low
+                if high is not None:
+                    selected &= np.ma.getdata(data) <= high
+            return selected
+        try:
+            first, last = self.count_range(low, high, calibrate)
+        except CalibrationError:
+            selected = self._selected(low, high, calibrate)
+            result = np.empty(image.shape, dtype=bool)
+            for block in _blocks(image, self.block_pixels):
+                selected.take(image[block], out=result[block], mode='clip')
+            return result
+        if first > last:
+            return np.zeros(image.shape, dtype=bool)
+        elif first == 0:
+            return image <= last
+        elif last == len(self.table(calibrate).values) - 1:
+            return image >= first
+        return (image >= first) & (image <= last)
+
+    def convert(self, image, calibrate=1):
+        raise NotImplementedError
+
+    def convert_many(self, image, calibrates):
+        return [self.convert(image, calibrate) for calibrate in calibrates]
+
+    def _calibrate(self, image, calibrates, outs, dtype):
+        if isinstance(image, np.ma.MaskedArray):
+            # calibrate the counts, masked pixels stay masked
+            mask = np.ma.getmask(image)
+            results = self._calibrate(image.data, calibrates, outs, dtype)
+            if mask is np.ma.nomask:
+                return results
+            return [(np.ma.MaskedArray(data, mask=np.ma.getmaskarray(data) |
+                                       mask, copy=False), unit)
+                    for data, unit in results]
+        if not self._in_table(image):
+            return self._convert_blocks(image, calibrates, outs, dtype)
+        return _lookup([self.table(calibrate, dtype)
+                        for calibrate in calibrates],
+                       image, outs, self.block_pixels)
+
+    def _in_table(self, image):
+        """Check if *image* are unsigned counts, all inside the tables.
+        """
+        if (not self.bits_per_pixel or self.bits_per_pixel > 16 or
+                image.dtype.kind != 'u'):
+            return False
+        return (image.dtype.itemsize * 8 <= self.bits_per_pixel or
+                image.size == 0 or image.max() < 2 ** self.bits_per_pixel)
+
+    def _selected(self, low, high, calibrate):
+        """Boolean table of the counts with calibrated values in [low, high].
+        """
+        table = self.table(calibrate)
+        if table.mask is None:
+            selected = np.ones(table.values.shape, dtype=bool)
+        else:
+            selected = ~table.mask
+        with np.errstate(invalid='ignore'):
+            if low is not None:
+                selected &= table.values >= low
+            if high is not None:
+                selected &= table.values <= high
+        return selected
+
+    def _convert_blocks(self, image, calibrates, outs, dtype):
+        outs = list(outs)
+        masks = [None] * len(calibrates)
+        units = [None] * len(calibrates)
+        for block in _blocks(image, self.block_pixels):
+            results = self.convert_many(image[block], calibrates)
+            for i, (data, unit) in enumerate(results):
+                if outs[i] is None:
+                    outs[i] = np.empty(image.shape, dtype=dtype or data.dtype)
+                outs[i][block] = np.ma.getdata(data)
+                units[i] = unit
+                if isinstance(data, np.ma.MaskedArray):
+                    if masks[i] is None:
+                        masks[i] = np.zeros(image.shape, dtype=bool)
+                    masks[i][block] = np.ma.getmaskarray(data)
+        return [(out, unit) if mask is None else
+                (np.ma.MaskedArray(out, mask=mask, copy=False), unit)
+                for out, mask, unit in zip(outs, masks, units)]
+
+
+def _blocks(image, block_pixels):
+    """Slices of blocks of rows of *image*, of about *block_pixels* pixels.
+    """
+    if image.ndim == 0 or not block_pixels or image.size <= block_pixels:
+        return [Ellipsis]
+    rows = max(1, block_pixels * len(image) // image.size)
+    return [slice(i, i + rows) for i in range(0, len(image), rows)]
+
+
+def _lookup(tables, image, outs, block_pixels):
+    """Look the counts of *image* up in each of *tables*, in one pass over
+    the image, returning a list of (image, unit).
+    """
+    # Counts are known to be inside the tables. take() converts them to intp
+    # indices first, so large images are done in blocks of rows.
+    outs = [np.empty(image.shape, dtype=table.values.dtype)
+            if out is None else out for table, out in zip(tables, outs)]
+    masks = [np.empty(image.shape, dtype=bool)
+             if table.mask is not None and table.masked_range is None
+             else None for table in tables]
+    for block in _blocks(image, block_pixels):
+        index = image[block]
+        if len(tables) > 1:
+            # once, instead of in each take()
+            index = index.astype(np.intp)
+        for table, out, mask in zip(tables, outs, masks):
+            if out.dtype == table.values.dtype:
+                table.values.take(index, out=out[block], mode='clip')
+            else:
+                out[block] = table.values.take(index, mode='clip')
+            if mask is not None:
+                table.mask.take(index, out=mask[block], mode='clip')
+    results = []
+    for table, out, mask in zip(tables, outs, masks):
+        if table.mask is None:
+            results.append((out, table.unit))
+            continue
+        if mask is None:
+            mask = table.range_mask(image)
+        results.append((np.ma.MaskedArray(out, mask=mask, copy=False),
+                        table.unit))
+    return results
+
+
+def _into(result, out):
+    if out is None or not isinstance(result, tuple):
+        return result
+    data, unit = result
+    out[...] = np.ma.getdata(data)
+    if isinstance(data, np.ma.MaskedArray):
+        return np.ma.MaskedArray(out, mask=np.ma.getmaskarray(data),
+                                 copy=False), unit
+    return out, unit
@@ -1,20 +1,22 @@
 #
 # $Id$
 #
-import glob
+import fnmatch
+import glob as _glob
 import imp
 import logging
 import os
 import re
 import types
 from datetime import timedelta
+from multiprocessing.pool import ThreadPool
 
 import numpy
 import six
 
 import mipp
 import mipp.cfg
-from mipp.xrit import _xrit
+from mipp.xrit import _xrit, decompcache, dirindex
 from mipp.xrit.loader import ImageLoader
 
 logger = logging.getLogger('mipp')
@@ -30,6 +32,7 @@ __all__ = ['load_meteosat07',
            'load_electrol',
            'load_himawari8',
            'load',
+           'load_slot',
            'load_files']
 
 CHECK_CONFIG_SUBLON = False
@@ -107,69 +110,160 @@ class SatelliteLoader(object):
     def load(self, time_stamp, channel, **kwarg):
         if channel not in self._config_reader.channel_names:
             raise mipp.ReaderError("unknown channel name '%s'" % channel)
-        opt = self._config_reader('level1')
-        val = {}
-        val["channel"] = channel + '*'
-
-        if isinstance(time_stamp, (tuple, list)):
-            start_time, end_time = time_stamp
-        else:
-            start_time = time_stamp
-            end_time = time_stamp
+        start_time, end_time = _time_range(time_stamp)
 
         # Prologue
 
-        val["segment"] = "PRO".ljust(9, '_')
-
-        filename_pro = opt.get('filename_pro', opt['filename'])
-        prologue = glob.glob(start_time.strftime(
-            os.path.join(opt['dir'], filename_pro)) % val)
-
+        prologue = self._find_file(start_time, channel, 'PRO',
+                                   'filename_pro')
         if not prologue:
             logger.info("No prologue file to read.")
             prologue = None
         else:
-            prologue = prologue[0]
             logger.info("Read %s" % prologue)
             prologue = _xrit.read_prologue(prologue)
 
         # Regular channels
 
-        val["segment"] = "0??*"
-        dt = timedelta(minutes=1)
-        image_files = []
-        while start_time <= end_time:
-            image_files.extend(glob.glob(start_time.strftime(
-                os.path.join(opt['dir'], opt['filename'])) % val))
-            start_time += dt
-
-        if not image_files:
-            raise mipp.NoFiles("no data files: '%s'" %
-                               (start_time.strftime(opt['filename']) % val))
-        image_files.sort()
+        image_files = self._find_image_files(start_time, end_time, channel)
 
         # Check if the files are xrit-compressed, and decompress them
         # accordingly:
-        decomp_files = decompress(image_files)
+        decomp_files = decompress(image_files,
+                                  max_workers=kwarg.get('workers', None))
 
         # Epilogue
 
-        val["segment"] = "EPI".ljust(9, '_')
-
-        filename_epi = opt.get('filename_epi', opt['filename'])
-        epilogue = glob.glob(
-            end_time.strftime(os.path.join(opt['dir'], filename_epi)) % val)
+        epilogue = self._find_file(end_time, channel, 'EPI', 'filename_epi')
 
         if not epilogue:
             logger.info("No epilogue file to read.")
+            image = self.load_files(prologue, decomp_files, **kwarg)
         else:
-            epilogue = epilogue[0]
             logger.info("Read %s" % epilogue)
             epilogue = _xrit.read_epilogue(epilogue)
-            return self.load_files(prologue, decomp_files,
-                                   epilogue=epilogue, **kwarg)
+            image = self.load_files(prologue, decomp_files,
+                                    epilogue=epilogue, **kwarg)
+
+        if isinstance(image, ImageLoader):
+            # segments still to come, for progressive loading
+            def find_files():
+                return decompress(
+                    self._find_image_files(start_time, end_time, channel),
+                    max_workers=kwarg.get('workers', None))
+            image.find_files = find_files
+        return image
+
+    def load_slot(self, time_stamp, channels=None, workers=None, **kwarg):
+        """Load several channels (default all) of the same time slot, and
+        return a dictionary of channel name and image loader.
+
+        The directory is only searched once, and prologue and epilogue files
+        shared between channels are only read and decoded once. With
+        *workers* > 1, the loaders are set up concurrently, and each loader
+        reads its segments with that many threads.
+        """
+        if channels is None:
+            channels = self._config_reader.channel_names
+        for channel in channels:
+            if channel not in self._config_reader.channel_names:
+                raise mipp.ReaderError("unknown channel name '%s'" % channel)
+        start_time, end_time = _time_range(time_stamp)
+
+        # All segment files of the slot, assigned to channels afterwards.
+        slot_files = self._find_image_files(start_time, end_time, '')
+        image_files = {}
+        for channel in channels:
+            patterns = self._patterns(start_time, end_time, channel, '0??*')
+            image_files[channel] = [f for f in slot_files
+                                    if _match(f, patterns)]
+        selected = sorted(set(sum(image_files.values(), [])))
+        if not selected:
+            raise mipp.NoFiles("no data files for channels: %s" %
+                               ', '.join(channels))
+        decomp_files = dict(zip(selected, decompress(selected,
+                                                     max_workers=workers)))
+
+        # Prologues and epilogues, read once for all channels using them.
+        trailers = {}
+
+        def read_trailer(file_name, reader):
+            if not file_name:
+                return None
+            if file_name not in trailers:
+                logger.info("Read %s" % file_name)
+                trailers[file_name] = reader(file_name)
+            return trailers[file_name]
+
+        args = []
+        for channel in channels:
+            if not image_files[channel]:
+                logger.warning("No data files for channel '%s'" % channel)
+                continue
+            prologue = read_trailer(
+                self._find_file(start_time, channel, 'PRO', 'filename_pro'),
+                _xrit.read_prologue)
+            epilogue = read_trailer(
+                self._find_file(end_time, channel, 'EPI', 'filename_epi'),
+                _xrit.read_epilogue)
+            args.append((channel, prologue,
+                         [decomp_files[f] for f in image_files[channel]],
+                         epilogue))
+
+        kwarg['workers'] = workers
+
+        def load_channel(arg):
+            channel, prologue, files, epilogue = arg
+            if epilogue:
+                loader = self.load_files(prologue, files, epilogue=epilogue,
+                                         **kwarg)
+            else:
+                loader = self.load_files(prologue, files, **kwarg)
+            return channel, loader
 
-        return self.load_files(prologue, decomp_files, **kwarg)
+        if (workers or 1) > 1 and len(args) > 1:
+            pool = ThreadPool(min(workers, len(args)))
+            try:
+                loaders = pool.map(load_channel, args, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            loaders = [load_channel(arg) for arg in args]
+        return dict(loaders)
+
+    def _patterns(self, start_time, end_time, channel, segment,
+                  filename='filename'):
+        """File name patterns, one per minute of the time range.
+        """
+        opt = self._config_reader('level1')
+        filename = opt.get(filename, opt['filename'])
+        val = {"channel": channel + '*', "segment": segment}
+        patterns = []
+        dt = timedelta(minutes=1)
+        while start_time <= end_time:
+            patterns.append(start_time.strftime(
+                os.path.join(opt['dir'], filename)) % val)
+            start_time += dt
+        return patterns
+
+    def _find_image_files(self, start_time, end_time, channel):
+        patterns = self._patterns(start_time, end_time, channel, '0??*')
+        image_files = _query_files(patterns, start_time, end_time)
+        if not image_files:
+            raise mipp.NoFiles("no data files: '%s'" %
+                               os.path.basename(patterns[-1]))
+        return image_files
+
+    def _find_file(self, time_stamp, channel, segment, filename):
+        """Name of the prologue or epilogue file, or None.
+        """
+        pattern = self._patterns(time_stamp, time_stamp, channel,
+                                 segment.ljust(9, '_'), filename)[0]
+        files = dirindex.glob(pattern)
+        if files:
+            return files[0]
+        return None
 
     def load_files(self, prologue, image_files, only_metadata=False, **kwargs):
         image_files.sort()
@@ -178,7 +272,9 @@ class SatelliteLoader(object):
         else:
             return self._read(prologue, image_files, **kwargs)
 
-    def _read_metadata(self, prologue, image_files, epilogue=None):
+    def _read_metadata(self, prologue, image_files, epilogue=None,
+                       workers=None):
+        # *workers* is for reading image data, metadata is from the headers.
         if epilogue:
             mda = self._metadata_reader(
                 prologue, image_files, epilogue=epilogue)
@@ -209,8 +305,6 @@ class SatelliteLoader(object):
             if k[0] != '_' and type(v) != types.FunctionType:
                 setattr(mda, k, v)
 
-        img = _xrit.read_imagedata(image_files[0])
-
         return mda
 
     def _read(self, prologue, image_files, epilogue=None, **kwargs):
@@ -256,9 +350,19 @@ class SatelliteLoader(object):
 #-----------------------------------------------------------------------------
 
 
-def decompress(infiles, **options):
+def decompress(infiles, max_workers=None, **options):
     """Check if the files are xrit-compressed, and decompress them
     accordingly:
+
+    With *max_workers* > 1, up to that many files are decompressed
+    concurrently. The decompressed files are returned in the order of
+    *infiles*.
+
+    Decompressed files from earlier calls are reused, unless the option
+    *cache* is False (see :mod:`mipp.xrit.decompcache`), and old ones are
+    evicted once the batch is done. Files with an in
+    process decompressor (see :func:`_xrit.register_decompressor`) are
+    returned as is.
     """
     if 'outdir' in options:
         cmd = options['outdir']
@@ -270,21 +374,87 @@ def decompress(infiles, **options):
                     "The decompressed files will be put in " +
                     "the same directory as compressed ones")
 
-    decomp_files = []
-    for filename in infiles:
-        if filename.endswith('C_'):
+    def decompress_file(filename):
+        if filename.endswith('C_') and not _in_process(filename):
             # Try decompress it:
             logger.debug('Try decompressing ' + filename)
             if cmd:
                 outdir = cmd
             else:
                 outdir = os.path.dirname(filename)
-            outfile = _xrit.decompress(filename, outdir)
-            decomp_files.append(outfile)
-        else:
-            decomp_files.append(filename)
+            if options.get('cache', True):
+                return decompcache.decompress(filename, outdir)
+            return _xrit.decompress(filename, outdir)
+        return filename
+
+    compressed = [f for f in infiles if f.endswith('C_')]
+    if (max_workers or 1) > 1 and len(compressed) > 1:
+        pool = ThreadPool(min(max_workers, len(compressed)))
+        try:
+            outfiles = pool.map(decompress_file, infiles, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        outfiles = [decompress_file(f) for f in infiles]
 
-    return decomp_files
+    if compressed and options.get('cache', True):
+        # once for the batch, keeping all of its files
+        decompcache.evict_configured([o for f, o in zip(infiles, outfiles)
+                                      if o != f])
+    return outfiles
+
+
+def _in_process(file_name):
+    """Check if *file_name* has an in process decompressor, then it's read
+    straight from the compressed file.
+    """
+    if not _xrit._decompressors:
+        return False
+    try:
+        segment = _xrit.read_imagedata(file_name)
+    except mipp.DecodeError:
+        return False
+    return (segment.is_compressed and
+            _xrit.find_decompressor(segment) is not None)
+
+
+def _time_range(time_stamp):
+    if isinstance(time_stamp, (tuple, list)):
+        return time_stamp
+    return time_stamp, time_stamp
+
+
+def _query_files(patterns, start_time, end_time):
+    """Paths of the files matching *patterns* (one per minute of the time
+    range), found by a time range query of the directory index. Only the
+    time stamps in the range are looked at, the rest of the name is matched
+    against the pattern with its time stamp wildcarded.
+    """
+    queries = {}
+    for pattern in patterns:
+        dirname, basename = os.path.split(pattern)
+        fields = basename.split('-')
+        if (_glob.has_magic(dirname) or len(fields) != 8 or
+                not fields[6].isdigit()):
+            # not an XRIT name pattern, or wildcards in the directory part
+            return dirindex.glob(patterns)
+        fields[6] = '?' * len(fields[6])
+        queries.setdefault(dirname, set()).add('-'.join(fields))
+    image_files = []
+    for dirname, basenames in sorted(queries.items()):
+        index = dirindex.get_index(dirname or os.curdir)
+        image_files.extend(os.path.join(dirname, rec.name)
+                           for rec in index.query(start_time, end_time)
+                           if _match(rec.name, basenames))
+    return sorted(image_files)
+
+
+def _match(file_name, patterns):
+    for pattern in patterns:
+        if fnmatch.fnmatchcase(file_name, pattern):
+            return True
+    return False
 
 
 def load_files(prologue, image_files, epilogue=None, **kwarg):
@@ -308,6 +478,11 @@ def load(satname, time_stamp, channel, **kwarg):
     return SatelliteLoader(mipp.cfg.read_config(satname)).load(time_stamp, channel, **kwarg)
 
 
+def load_slot(satname, time_stamp, channels=None, **kwarg):
+    return SatelliteLoader(mipp.cfg.read_config(satname)).load_slot(
+        time_stamp, channels, **kwarg)
+
+
 def load_meteosat07(time_stamp, channel, **kwarg):
     return load('meteosat07', time_stamp, channel, **kwarg)
 
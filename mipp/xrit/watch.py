@@ -0,0 +1,325 @@
+#
+# $Id$
+#
+"""Assemble the XRIT files arriving in a directory into time slots.
+
+A :class:`SlotAssembler` watches an incoming directory, using inotify (if
+the module pyinotify is available) or else by listing the directory at a
+fixed interval (a file is then only taken once its size and modification
+time have settled). The files are grouped per platform, channel and time stamp
+(parsed from the file names), and a callback is called with the
+:class:`Slot` as soon as all planned image segments and the prologue have
+arrived, or when the slot gets older than *max_age*.
+
+Only the headers of the first image segment of each slot are read (for the
+planned segment numbers), all other bookkeeping is done from file names.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import mipp
+from mipp.xrit import _xrit, dirindex
+
+logger = logging.getLogger('mipp')
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+__all__ = ['Slot',
+           'SlotAssembler']
+
+
+class Slot(object):
+    """The files of one channel of one time slot.
+    """
+
+    def __init__(self, platform, channel, time_stamp, first_seen):
+        self.platform = platform
+        self.channel = channel
+        self.time_stamp = datetime.strptime(time_stamp, '%Y%m%d%H%M')
+        self.first_seen = first_seen
+        self.prologue = None
+        self.epilogue = None
+        self.segments = {}
+        # (first, last) planned segment number, from the segment headers.
+        self.planned = None
+        self.is_complete = False
+
+    @property
+    def image_files(self):
+        return [self.segments[k] for k in sorted(self.segments.keys())]
+
+    @property
+    def missing(self):
+        """Planned segment numbers not received (yet).
+        """
+        if self.planned is None:
+            return []
+        return [n for n in range(self.planned[0], self.planned[1] + 1)
+                if n not in self.segments]
+
+    def __str__(self):
+        return "%s %s %s: %d segments%s" % (
+            self.platform, self.channel,
+            self.time_stamp.strftime('%Y-%m-%d %H:%M'), len(self.segments),
+            '' if self.is_complete else ' (incomplete)')
+
+
+class SlotAssembler(object):
+    """Watch the directory *path*, and call *callback(slot)* once for each
+    slot, when it's complete or older than *max_age*.
+
+    *max_age* is in seconds (or a timedelta), or a dictionary of platform
+    and max age. Slots without a max age are only handed over when complete.
+    If *platforms* is given, only those platforms are handled. *require* are
+    the trailer files which have to be there for a slot to be complete
+    (e.g. ('PRO', 'EPI')).
+
+    If *pool* is given (e.g. a multiprocessing.pool.ThreadPool), callbacks
+    are submitted to it, else they are called by the watching thread.
+    """
+
+    # Seconds between directory listings, without inotify, and between
+    # checks for expired slots.
+    interval = 5.0
+
+    # Seconds handed over slots are remembered, to ignore late files.
+    retention = 3600.0
+
+    def __init__(self, path, callback, max_age=None, platforms=None,
+                 require=('PRO',), pool=None):
+        self.path = path
+        self.callback = callback
+        self.max_age = max_age
+        self.platforms = platforms and set(platforms)
+        self.require = tuple(require)
+        self.pool = pool
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._slots = {}
+        self._trailers = {}
+        self._done = {}
+        self._seen = set()
+        # (size, mtime) of files not registered yet, from the last scan
+        self._pending = {}
+
+    def add(self, file_name, now=None):
+        """Register the arrival of *file_name*.
+        """
+        rec = dirindex.parse_name(os.path.basename(file_name))
+        if rec is None or (self.platforms and
+                           rec.platform not in self.platforms):
+            return
+        if now is None:
+            now = time.time()
+        ready = []
+        with self._lock:
+            if rec.segment in ('PRO', 'EPI'):
+                self._trailers[(rec.platform, rec.channel, rec.time_stamp,
+                                rec.segment)] = (file_name, now)
+                slots = [s for k, s in self._slots.items()
+                         if k[0] == rec.platform and k[2] == rec.time_stamp
+                         and rec.channel in ('', k[1])]
+            elif rec.segment.isdigit():
+                key = (rec.platform, rec.channel, rec.time_stamp)
+                if key in self._done:
+                    logger.debug("Late file for handed over slot: %s" %
+                                 file_name)
+                    return
+                slot = self._slots.get(key, None)
+                if slot is None:
+                    slot = self._slots[key] = Slot(rec.platform, rec.channel,
+                                                   rec.time_stamp, now)
+                slot.segments[int(rec.segment)] = file_name
+                if slot.planned is None:
+                    slot.planned = _planned_segments(file_name)
+                slots = [slot]
+            else:
+                return
+            for slot in slots:
+                self._attach_trailers(slot)
+                if self._is_complete(slot):
+                    slot.is_complete = True
+                    ready.append(self._hand_over(slot, now))
+        for slot in ready:
+            self._call(slot)
+
+    def check(self, now=None):
+        """Hand over slots older than max age, and forget old ones.
+        """
+        if now is None:
+            now = time.time()
+        ready = []
+        with self._lock:
+            for slot in self._slots.values():
+                if slot.planned is None:
+                    # headers were incomplete on arrival
+                    slot.planned = _planned_segments(slot.image_files[0])
+                    if self._is_complete(slot):
+                        slot.is_complete = True
+                        ready.append(self._hand_over(slot, now))
+                        continue
+                max_age = self._max_age(slot.platform)
+                if max_age is not None and now - slot.first_seen > max_age:
+                    ready.append(self._hand_over(slot, now))
+            for key, done in self._done.items():
+                if now - done > self.retention:
+                    del self._done[key]
+            for key, (file_name, seen) in self._trailers.items():
+                if now - seen > self.retention:
+                    del self._trailers[key]
+        for slot in ready:
+            self._call(slot)
+
+    def scan(self, now=None):
+        """Register files in the directory not registered by an earlier scan,
+        once they are completely written: their size and modification time
+        are unchanged since the previous scan, or they're older than
+        *interval*.
+        """
+        if now is None:
+            now = time.time()
+        try:
+            names = set(os.listdir(self.path))
+        except OSError as err:
+            logger.warning("Could not list %s: %s" % (self.path, err))
+            return
+        # forget removed files
+        self._seen &= names
+        pending = {}
+        for name in sorted(names - self._seen):
+            file_name = os.path.join(self.path, name)
+            try:
+                stat = os.stat(file_name)
+            except OSError:
+                continue
+            stamp = (stat.st_size, stat.st_mtime)
+            if (self._pending.get(name, None) == stamp or
+                    now - stat.st_mtime > self.interval):
+                self._seen.add(name)
+                self.add(file_name, now)
+            else:
+                # maybe still being written
+                pending[name] = stamp
+        self._pending = pending
+
+    def run(self, timeout=None):
+        """Watch the directory until :meth:`stop` is called, or for *timeout*
+        seconds. Files already in the directory are handled first.
+        """
+        self._stop.clear()
+        deadline = timeout and time.time() + timeout
+        if pyinotify is not None:
+            self._run_inotify(deadline)
+        else:
+            self._run_polling(deadline)
+
+    def stop(self):
+        self._stop.set()
+
+    #-------------------------------------------------------------------------
+
+    def _running(self, deadline):
+        return not self._stop.is_set() and (deadline is None or
+                                            time.time() < deadline)
+
+    def _run_polling(self, deadline):
+        logger.info("Watching %s (polling)" % self.path)
+        while self._running(deadline):
+            self.scan()
+            self.check()
+            self._stop.wait(self.interval)
+
+    def _run_inotify(self, deadline):
+        logger.info("Watching %s (inotify)" % self.path)
+        assembler = self
+
+        class Handler(pyinotify.ProcessEvent):
+            def process_IN_CLOSE_WRITE(self, event):
+                assembler.add(event.pathname)
+            process_IN_MOVED_TO = process_IN_CLOSE_WRITE
+
+        manager = pyinotify.WatchManager()
+        notifier = pyinotify.Notifier(manager, Handler(),
+                                      timeout=int(self.interval * 1000))
+        manager.add_watch(self.path,
+                          pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO)
+        try:
+            # files arrived before the watch was set up
+            self.scan()
+            while self._running(deadline):
+                if notifier.check_events():
+                    notifier.read_events()
+                    notifier.process_events()
+                self.check()
+        finally:
+            notifier.stop()
+
+    def _max_age(self, platform):
+        max_age = self.max_age
+        if isinstance(max_age, dict):
+            max_age = max_age.get(platform, None)
+        if isinstance(max_age, timedelta):
+            max_age = max_age.days * 86400 + max_age.seconds
+        return max_age
+
+    def _attach_trailers(self, slot):
+        time_stamp = slot.time_stamp.strftime('%Y%m%d%H%M')
+        for segment in ('PRO', 'EPI'):
+            for channel in (slot.channel, ''):
+                entry = self._trailers.get((slot.platform, channel,
+                                            time_stamp, segment), None)
+                if entry:
+                    if segment == 'PRO':
+                        slot.prologue = entry[0]
+                    else:
+                        slot.epilogue = entry[0]
+                    break
+
+    def _is_complete(self, slot):
+        if slot.planned is None or slot.missing:
+            return False
+        return (('PRO' not in self.require or slot.prologue) and
+                ('EPI' not in self.require or slot.epilogue))
+
+    def _hand_over(self, slot, now):
+        key = (slot.platform, slot.channel,
+               slot.time_stamp.strftime('%Y%m%d%H%M'))
+        del self._slots[key]
+        self._done[key] = now
+        return slot
+
+    def _call(self, slot):
+        logger.info("Slot ready: %s" % slot)
+        if self.pool is not None:
+            self.pool.apply_async(self._run_callback, (slot,))
+        else:
+            self._run_callback(slot)
+
+    def _run_callback(self, slot):
+        # a failing slot must not stop the watching.
+        try:
+            self.callback(slot)
+        except Exception:
+            logger.exception("Handling of slot %s failed" % slot)
+
+
+def _planned_segments(file_name):
+    """Return (first, last) planned segment number, or None if the headers
+    can't be read (yet).
+    """
+    try:
+        segment = _xrit.read_imagedata(file_name)
+    except (IOError, OSError, mipp.DecodeError) as err:
+        logger.debug("Could not read segment headers of %s: %s" %
+                     (file_name, err))
+        return None
+    segment = getattr(segment, 'segment', None)
+    if segment is None:
+        return None
+    return segment.planned_start_seg_no, segment.planned_end_seg_no
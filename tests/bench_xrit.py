@@ -0,0 +1,316 @@
+#
+# Micro benchmarks for the XRIT readers.
+#
+# Usage: python bench_xrit.py [repeat]
+#
+import glob
+import os
+import sys
+import timeit
+
+import numpy
+
+import buildpath_to_syspath
+import mipp.xrit.sat
+from mipp.xrit import _xrit, convert
+from mipp.xrit import bin_reader as rbin
+
+datadir = (os.path.dirname(__file__) or '.') + '/data'
+segment_files = sorted(glob.glob(datadir + '/[HL]-000-*-0000*'))
+
+try:
+    # as in test_xrit.py
+    os.environ['PPP_CONFIG_DIR'] = os.environ['LOCAL_PPP_CONFIG_DIR']
+except KeyError:
+    os.environ['PPP_CONFIG_DIR'] = datadir
+
+#-----------------------------------------------------------------------------
+#
+# Header decoding
+#
+#-----------------------------------------------------------------------------
+def _read_header_per_field(fp):
+    """Reference: one read and one unpack per field (the former decoder).
+    """
+    hdrs = []
+    rbin.read_uint1(fp.read(1))
+    rec_len = rbin.read_uint2(fp.read(2))
+    rbin.read_uint1(fp.read(1))
+    total_hdr_len = rbin.read_uint4(fp.read(4))
+    rbin.read_uint8(fp.read(8))
+    hdrs.append(rec_len)
+    current_size = rec_len
+    while current_size < total_hdr_len:
+        hdr_type = rbin.read_uint1(fp.read(1))
+        rec_len = rbin.read_uint2(fp.read(2))
+        if hdr_type == 1:
+            rbin.read_uint1(fp.read(1))
+            rbin.read_uint2(fp.read(2))
+            rbin.read_uint2(fp.read(2))
+            rbin.read_uint1(fp.read(1))
+        elif hdr_type == 2:
+            fp.read(32).strip()
+            for i in range(4):
+                rbin.read_int4(fp.read(4))
+        elif hdr_type == 5:
+            rbin.read_uint1(fp.read(1))
+            rbin.read_cds_time(fp.read(6))
+        elif hdr_type == 128:
+            rbin.read_uint2(fp.read(2))
+            rbin.read_uint1(fp.read(1))
+            for i in range(3):
+                rbin.read_uint2(fp.read(2))
+            rbin.read_uint1(fp.read(1))
+        elif hdr_type == 129:
+            nb = 3
+            while nb < rec_len:
+                rbin.read_int4(fp.read(4))
+                rbin.read_cds_time(fp.read(6))
+                rbin.read_uint1(fp.read(1))
+                rbin.read_uint1(fp.read(1))
+                rbin.read_uint1(fp.read(1))
+                nb += 13
+        else:
+            fp.read(rec_len - 3)
+        hdrs.append(rec_len)
+        current_size += rec_len
+    return hdrs
+
+def _per_field():
+    for f in segment_files:
+        fp = open(f, 'rb')
+        _read_header_per_field(fp)
+        fp.close()
+
+def _single_read():
+    for f in segment_files:
+        fp = open(f, 'rb')
+        _xrit.read_headers(fp)
+        fp.close()
+
+def bench_headers(repeat=20):
+    t_ref = min(timeit.repeat(_per_field, number=1, repeat=repeat))
+    t_new = min(timeit.repeat(_single_read, number=1, repeat=repeat))
+    n = len(segment_files)
+    print "headers: %d files" % n
+    print "    per field read : %8.3f ms/file" % (1000 * t_ref / n)
+    print "    single read    : %8.3f ms/file (x%.1f)" % (1000 * t_new / n,
+                                                        t_ref / t_new)
+
+#-----------------------------------------------------------------------------
+#
+# 10 bit unpacking
+#
+#-----------------------------------------------------------------------------
+def _dec10216_ref(in_buffer):
+    """Reference: the former string based converter.
+    """
+    arr10 = numpy.fromstring(in_buffer, dtype=numpy.uint8).astype(numpy.uint16)
+    arr16 = numpy.zeros((len(arr10) * 4 / 5,), dtype=numpy.uint16)
+    arr10 = arr10[:(len(arr16) * 5) / 4]
+    arr16.flat[::4] = numpy.left_shift(arr10[::5], 2) + \
+        numpy.right_shift((arr10[1::5]), 6)
+    arr16.flat[1::4] = numpy.left_shift((arr10[1::5] & 63), 4) + \
+        numpy.right_shift((arr10[2::5]), 4)
+    arr16.flat[2::4] = numpy.left_shift(arr10[2::5] & 15, 6) + \
+        numpy.right_shift((arr10[3::5]), 2)
+    arr16.flat[3::4] = numpy.left_shift(arr10[3::5] & 3, 8) + \
+        arr10[4::5]
+    return arr16.tostring()
+
+def bench_unpack10(repeat=20):
+    seg = _xrit.read_imagedata(
+        datadir + '/H-000-MSG2__-MSG2________-HRV______-000012___-201010111400-__')
+    lines = numpy.array(seg.read_lines(0, seg.structure.nl))
+    seg.close()
+    nbytes = lines.nbytes
+    strings = [line.tostring() for line in lines]
+    image = numpy.empty((lines.shape[0], lines.shape[1] * 4 // 5),
+                        dtype=numpy.uint16)
+
+    def ref():
+        for i, line in enumerate(strings):
+            image[i] = numpy.frombuffer(_dec10216_ref(line), numpy.uint16)
+
+    def per_line():
+        for i, line in enumerate(lines):
+            convert.unpack10(line, image[i])
+
+    def whole():
+        convert.unpack10(lines, image)
+
+    print "unpack10: %d lines of %d bytes" % lines.shape
+    t_ref = min(timeit.repeat(ref, number=1, repeat=repeat))
+    for name, func in (("former dec10216", ref),
+                       ("unpack10, per line", per_line),
+                       ("unpack10, all lines", whole)):
+        t = min(timeit.repeat(func, number=1, repeat=repeat))
+        print "    %-20s: %8.1f MB/s (x%.1f)" % (name, nbytes / t / 1e6,
+                                                t_ref / t)
+
+#-----------------------------------------------------------------------------
+#
+# Calibration
+#
+#-----------------------------------------------------------------------------
+def bench_calibration(repeat=5):
+    loader = mipp.xrit.sat.load_files(
+        datadir + '/H-000-MSG2__-MSG2________-_________-PRO______-201010111400-__',
+        sorted(glob.glob(datadir + '/H-000-MSG2__-MSG2________-IR_108*')),
+        epilogue=datadir + '/H-000-MSG2__-MSG2________-_________-EPI______-201010111400-__')
+    calibrator = loader.mda.calibrate
+    image = numpy.random.randint(0, 1024, (3712, 3712)).astype(numpy.uint16)
+
+    # The per pixel reference warns on counts of zero radiance.
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        print "calibration: IR_108, %dx%d counts" % image.shape
+        for calibrate, name in ((1, "brightness temperature"),
+                                (2, "radiance")):
+            t_ref = min(timeit.repeat(lambda: calibrator.convert(image, calibrate),
+                                      number=1, repeat=repeat))
+            t_new = min(timeit.repeat(lambda: calibrator(image, calibrate),
+                                      number=1, repeat=repeat))
+            print "    %-22s: per pixel %7.1f ms, lookup table %7.1f ms (x%.1f)" % (
+                name, 1000 * t_ref, 1000 * t_new, t_ref / t_new)
+
+        # Counts outside the lookup table are converted in row blocks.
+        image[0, 0] = 4096
+        print "calibration: IR_108, counts outside table, extra peak memory"
+        for dtype in (None, numpy.float32):
+            t_ref = min(timeit.repeat(lambda: calibrator.convert(image, 1),
+                                      number=1, repeat=repeat))
+            t_new = min(timeit.repeat(lambda: calibrator(image, 1, dtype=dtype),
+                                      number=1, repeat=repeat))
+            m_ref = _peak_memory(lambda: calibrator.convert(image, 1))
+            m_new = _peak_memory(lambda: calibrator(image, 1, dtype=dtype))
+            print ("    %-22s: whole image %7.1f ms %5d MB, "
+                   "row blocks %7.1f ms %5d MB" % (
+                       numpy.dtype(dtype or numpy.float64).name,
+                       1000 * t_ref, m_ref >> 20, 1000 * t_new, m_new >> 20))
+
+
+def bench_output_modes(repeat=5):
+    prologue, epilogue = (
+        datadir + '/H-000-MSG2__-MSG2________-_________-%s______-201010111400-__' % t
+        for t in ('PRO', 'EPI'))
+    image_files = sorted(glob.glob(datadir + '/H-000-MSG2__-MSG2________-IR_108*'))
+
+    print "full disc IR_108, calibrated, extra peak memory"
+    for name, options in (("masked float64", {'mask': True}),
+                          ("float32, NaN fill", {'dtype': numpy.float32,
+                                                 'fill': 'nan'})):
+        loader = mipp.xrit.sat.load_files(prologue, image_files,
+                                          epilogue=epilogue, calibrate=1,
+                                          **options)
+        t = min(timeit.repeat(lambda: loader[:], number=1, repeat=repeat))
+        print "    %-22s: %7.1f ms %5d MB" % (
+            name, 1000 * t, _peak_memory(lambda: loader[:]) >> 20)
+
+
+
+def bench_calibrate_many(repeat=5):
+    prologue, epilogue = (
+        datadir + '/H-000-MSG2__-MSG2________-_________-%s______-201010111400-__' % t
+        for t in ('PRO', 'EPI'))
+    image_files = sorted(glob.glob(datadir + '/H-000-MSG2__-MSG2________-IR_108*'))
+    loaders = [mipp.xrit.sat.load_files(prologue, image_files,
+                                        epilogue=epilogue, calibrate=c)
+               for c in (0, 2, 1)]
+    loader = mipp.xrit.sat.load_files(prologue, image_files,
+                                      epilogue=epilogue, calibrate=(0, 2, 1))
+
+    print "full disc IR_108, counts, radiances and brightness temperatures"
+    t_ref = min(timeit.repeat(lambda: [l[:] for l in loaders],
+                              number=1, repeat=repeat))
+    t_new = min(timeit.repeat(lambda: loader[:], number=1, repeat=repeat))
+    print "    three loads %7.1f ms, one load %7.1f ms (x%.1f)" % (
+        1000 * t_ref, 1000 * t_new, t_ref / t_new)
+
+
+
+def bench_thresholds(repeat=5):
+    loader = mipp.xrit.sat.load_files(
+        datadir + '/H-000-MSG2__-MSG2________-_________-PRO______-201010111400-__',
+        sorted(glob.glob(datadir + '/H-000-MSG2__-MSG2________-IR_108*')),
+        epilogue=datadir + '/H-000-MSG2__-MSG2________-_________-EPI______-201010111400-__')
+    calibrator = loader.mda.calibrate
+    image = numpy.random.randint(0, 1024, (3712, 3712)).astype(numpy.uint16)
+
+    def calibrated():
+        data = calibrator(image, 1)[0]
+        return (data >= 250.).filled(False)
+
+    print "threshold IR_108 >= 250 K, %dx%d counts" % image.shape
+    t_ref = min(timeit.repeat(calibrated, number=1, repeat=repeat))
+    t_new = min(timeit.repeat(lambda: calibrator.in_range(image, 250.),
+                              number=1, repeat=repeat))
+    print "    calibrated %7.1f ms, counts %7.1f ms (x%.1f)" % (
+        1000 * t_ref, 1000 * t_new, t_ref / t_new)
+
+
+
+def bench_stats(repeat=5):
+    prologue, epilogue = (
+        datadir + '/H-000-MSG2__-MSG2________-_________-%s______-201010111400-__' % t
+        for t in ('PRO', 'EPI'))
+    image_files = sorted(glob.glob(datadir + '/H-000-MSG2__-MSG2________-IR_108*'))
+    loader = mipp.xrit.sat.load_files(prologue, image_files,
+                                      epilogue=epilogue, calibrate=1,
+                                      mask=True)
+    stats_loader = mipp.xrit.sat.load_files(prologue, image_files,
+                                            epilogue=epilogue, calibrate=1,
+                                            stats_only=True)
+
+    def whole_image():
+        img = loader[:][1]
+        return (img.count(), img.min(), img.max(), img.mean(), img.std(),
+                numpy.bincount(img.compressed().astype(numpy.int64)))
+
+    print "full disc IR_108 statistics, extra peak memory"
+    for name, func in (("whole image", whole_image),
+                       ("per segment", lambda: stats_loader[:])):
+        t = min(timeit.repeat(func, number=1, repeat=repeat))
+        print "    %-22s: %7.1f ms %5d MB" % (
+            name, 1000 * t, _peak_memory(func) >> 20)
+
+
+def _status(key):
+    fp = open('/proc/self/status')
+    try:
+        for line in fp:
+            if line.startswith(key):
+                return int(line.split()[1]) * 1024
+    finally:
+        fp.close()
+
+
+def _peak_memory(func):
+    """Peak resident memory (bytes) added by *func*, run in a child process.
+    """
+    rfd, wfd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(rfd)
+        base = _status('VmRSS')
+        func()
+        os.write(wfd, str(_status('VmHWM') - base))
+        os._exit(0)
+    os.close(wfd)
+    peak = int(os.read(rfd, 64))
+    os.close(rfd)
+    os.waitpid(pid, 0)
+    return peak
+
+#-----------------------------------------------------------------------------
+if __name__ == '__main__':
+    try:
+        _repeat = int(sys.argv[1])
+    except IndexError:
+        _repeat = 20
+    bench_headers(_repeat)
+    bench_unpack10(_repeat)
+    bench_calibration(max(1, _repeat // 4))
+    bench_output_modes(max(1, _repeat // 4))
+    bench_calibrate_many(max(1, _repeat // 4))
+    bench_thresholds(max(1, _repeat // 4))
+    bench_stats(max(1, _repeat // 4))
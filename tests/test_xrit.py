@@ -1,4 +1,5 @@
 import os
+import json
 import sys
 from datetime import datetime
 import numpy
@@ -94,6 +95,21 @@ def compare_mda(m1, m2):
             
     return True
 
+def _fake_decompressor(tmpdir):
+    """A stand-in for xRITDecompress, writing to its working directory and
+    logging each call to tmpdir/calls.
+    """
+    cmd = os.path.join(tmpdir, 'xRITDecompress')
+    fp = open(cmd, 'w')
+    fp.write('#!/bin/sh\n'
+             'out=`basename "$1" | sed "s/C_$/__/"`\n'
+             'cp "$1" "$out"\n'
+             'echo "$1" >> "%s/calls"\n'
+             'echo "Decompressed file: $out"\n' % tmpdir)
+    fp.close()
+    os.chmod(cmd, 0755)
+    return cmd
+
 class Test(unittest.TestCase):
 
     def setUp(self):
@@ -218,6 +234,949 @@ class Test(unittest.TestCase):
                    'wrong cross_sum (%.3f != %.3f)' % (cross_sum, hrv2_sum))
         self.failUnlessAlmostEqual(cross_sum, hrv2_sum, 3, msg=message)
 
+    def test_segment_catalog(self):
+        loader = xrit.sat.load_files(hrv_files[0], hrv_files[1:-1],
+                                     epilogue=hrv_files[-1], calibrate=False)
+        self.assertEqual(sorted(loader._segments.keys()), [12, 13])
+        mda, img1 = loader[5168:5768, 5068:6068]
+        # no more header parsing once the loader is created
+        read_file_headers = xrit._xrit.read_file_headers
+        def no_parsing(file_name):
+            raise AssertionError("headers parsed again: " + file_name)
+        xrit._xrit.read_file_headers = no_parsing
+        try:
+            mda, img2 = loader[5168:5768, 5068:6068]
+            mda, img3 = loader(mda.area_extent)
+        finally:
+            xrit._xrit.read_file_headers = read_file_headers
+        self.assertTrue(numpy.all(img1 == img2))
+        self.assertTrue(numpy.all(img1 == img3))
+
+    def test_workers(self):
+        for files, item in ((hrv_files, numpy.s_[5168:5768, 5068:6068]),
+                            (goes_files + [None],
+                             numpy.s_[:])):
+            loader = xrit.sat.load_files(files[0], files[1:-1],
+                                         epilogue=files[-1], mask=True)
+            mda, img1 = loader[item]
+            loader = xrit.sat.load_files(files[0], files[1:-1],
+                                         epilogue=files[-1], mask=True,
+                                         workers=4)
+            self.assertEqual(loader.workers, 4)
+            mda, img2 = loader[item]
+            self.assertTrue(numpy.all(img1 == img2))
+            self.assertTrue(numpy.all(img1.mask == img2.mask))
+        # metadata only
+        mda = xrit.sat.load_files(msg_files[0], msg_files[1:-1],
+                                  epilogue=msg_files[-1], only_metadata=True,
+                                  workers=2)
+        self.assertEqual(mda.channel, 'IR_108')
+
+    def test_decompress_workers(self):
+        import shutil
+        import tempfile
+        tmpdir = tempfile.mkdtemp()
+        cmd = _fake_decompressor(tmpdir)
+        outdir = os.path.join(tmpdir, 'out')
+        os.mkdir(outdir)
+        infiles = []
+        for segment in range(8, 14):
+            infiles.append(os.path.join(tmpdir, os.path.basename(
+                cmprs_files[1]).replace('000008', '%06d' % segment)))
+            shutil.copy(cmprs_files[1], infiles[-1])
+        infiles.append(msg_files[1])
+        decomp_exec = os.environ.get('XRIT_DECOMPRESS_PATH', None)
+        cwd = os.getcwd()
+        try:
+            os.environ['XRIT_DECOMPRESS_PATH'] = cmd
+            outfiles = xrit.sat.decompress(infiles, max_workers=4,
+                                           outdir=outdir)
+        finally:
+            if decomp_exec is None:
+                del os.environ['XRIT_DECOMPRESS_PATH']
+            else:
+                os.environ['XRIT_DECOMPRESS_PATH'] = decomp_exec
+            outdir_files = sorted(f for f in os.listdir(outdir)
+                                  if not f.startswith('.'))
+            shutil.rmtree(tmpdir)
+        self.assertEqual(os.getcwd(), cwd)
+        self.assertEqual(outfiles[-1], msg_files[1])
+        self.assertEqual(outfiles[:-1],
+                         [outdir + '/' + os.path.basename(f)[:-2] + '__'
+                          for f in infiles[:-1]])
+        self.assertEqual(outdir_files,
+                         sorted(os.path.basename(f) for f in outfiles[:-1]))
+
+    def test_decompress_cache(self):
+        import shutil
+        import tempfile
+        import threading
+        from mipp.xrit import decompcache
+        tmpdir = tempfile.mkdtemp()
+        cmd = _fake_decompressor(tmpdir)
+        infile = os.path.join(tmpdir, os.path.basename(cmprs_files[1]))
+        shutil.copy(cmprs_files[1], infile)
+        outdir = os.path.join(tmpdir, 'out')
+        os.mkdir(outdir)
+
+        def ncalls():
+            log = os.path.join(tmpdir, 'calls')
+            return len(open(log).readlines()) if os.path.exists(log) else 0
+
+        decomp_exec = os.environ.get('XRIT_DECOMPRESS_PATH', None)
+        try:
+            os.environ['XRIT_DECOMPRESS_PATH'] = cmd
+            # concurrent requests, decompressed once
+            outfiles = []
+            threads = [threading.Thread(
+                target=lambda: outfiles.append(
+                    decompcache.decompress(infile, outdir)))
+                       for i in range(4)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertEqual(ncalls(), 1)
+            self.assertEqual(len(set(outfiles)), 1)
+            self.assertEqual(xrit.sat.decompress([infile], outdir=outdir),
+                             outfiles[:1])
+            self.assertEqual(ncalls(), 1)
+            lock = os.path.join(outdir,
+                                '.' + os.path.basename(infile) + '.lock')
+            self.assertFalse(os.path.exists(lock))
+
+            # a lock left by a killed process doesn't block
+            import signal
+            import subprocess
+            holder = subprocess.Popen(
+                [sys.executable, '-c',
+                 'import fcntl, os, sys, time\n'
+                 'fd = os.open(sys.argv[1], os.O_CREAT | os.O_WRONLY)\n'
+                 'fcntl.flock(fd, fcntl.LOCK_EX)\n'
+                 'print("locked")\n'
+                 'sys.stdout.flush()\n'
+                 'time.sleep(60)\n', lock], stdout=subprocess.PIPE)
+            self.assertEqual(holder.stdout.readline().strip(), 'locked')
+            os.kill(holder.pid, signal.SIGKILL)
+            holder.wait()
+            os.utime(infile, None)
+            decompcache.decompress(infile, outdir)
+            self.assertEqual(ncalls(), 2)
+            self.assertFalse(os.path.exists(lock))
+
+            # a changed input is decompressed again
+            os.utime(infile, (0, 0))
+            decompcache.decompress(infile, outdir)
+            self.assertEqual(ncalls(), 3)
+            # so is a damaged output
+            open(outfiles[0], 'a').write('x')
+            decompcache.decompress(infile, outdir)
+            self.assertEqual(ncalls(), 4)
+
+            self.assertEqual(decompcache.evict(outdir, max_age=3600), 0)
+            self.assertEqual(decompcache.evict(outdir, max_size=0,
+                                               keep=outfiles[:1]), 0)
+            self.assertEqual(decompcache.evict(outdir, max_size=0), 1)
+            self.assertEqual(os.listdir(outdir), [])
+
+            # eviction once per batch, keeping the files of the batch
+            old = decompcache.decompress(infile, outdir)
+            batch = []
+            for segment in (9, 10, 11):
+                batch.append(infile.replace('000008', '%06d' % segment))
+                shutil.copy(infile, batch[-1])
+            os.environ['XRIT_DECOMPRESS_MAX_SIZE'] = '0'
+            outfiles = xrit.sat.decompress(batch, max_workers=2,
+                                           outdir=outdir)
+            self.assertFalse(os.path.exists(old))
+            self.assertTrue(all(os.path.exists(f) for f in outfiles))
+        finally:
+            os.environ.pop('XRIT_DECOMPRESS_MAX_SIZE', None)
+            if decomp_exec is None:
+                del os.environ['XRIT_DECOMPRESS_PATH']
+            else:
+                os.environ['XRIT_DECOMPRESS_PATH'] = decomp_exec
+            shutil.rmtree(tmpdir)
+
+    def test_decompressor_registry(self):
+        import shutil
+        import tempfile
+        from mipp.xrit import _xrit, loader
+        seg = xrit.read_imagedata(cmprs_files[1])
+        nl, nc = seg.structure.nl, seg.structure.nc
+        pixels = (numpy.arange(nl * nc) % 1024).astype(numpy.uint16)
+        # pack 4 10 bit words into 5 bytes
+        w = [pixels.reshape(-1, 4)[:, i] for i in range(4)]
+        packed = numpy.array([w[0] >> 2,
+                              (w[0] & 3) << 6 | w[1] >> 4,
+                              (w[1] & 15) << 4 | w[2] >> 6,
+                              (w[2] & 63) << 2 | w[3] >> 8,
+                              w[3] & 255], dtype=numpy.uint8).T.tostring()
+        pixels = pixels.reshape(nl, nc)
+
+        def as_string(segment):
+            return packed
+
+        def as_pixels(segment):
+            return pixels
+
+        def other(segment):
+            raise AssertionError("wrong decompressor")
+
+        try:
+            xrit.register_decompressor(1, as_string)
+            xrit.register_decompressor(1, other, {'_NAME': 'other'})
+            xrit.register_decompressor(2, other)
+            self.assertTrue(_xrit.find_decompressor(seg) is as_string)
+            # compressed files with a decompressor are read as they are
+            self.assertEqual(xrit.sat.decompress(cmprs_files[1:-1]),
+                             cmprs_files[1:-1])
+            lines = seg.read_lines(10, 5)
+            self.assertEqual(lines.shape, (5, seg.bytes_per_line))
+            self.assertTrue(numpy.all(
+                loader._decode_lines(lines, 10, numpy.uint16, 100, 50) ==
+                pixels[10:15, 100:150]))
+            seg.close()
+
+            xrit.register_decompressor(1, as_pixels)
+            lines = seg.read_lines(10, 5)
+            self.assertTrue(numpy.all(
+                loader._decode_lines(lines, 10, numpy.uint16, 100, 50) ==
+                pixels[10:15, 100:150]))
+            seg.close()
+        finally:
+            for decompressor in (as_string, as_pixels, other):
+                _xrit.unregister_decompressor(decompressor)
+        self.assertTrue(_xrit.find_decompressor(seg) is None)
+
+        # default is xRITDecompress
+        tmpdir = tempfile.mkdtemp()
+        decomp_exec = os.environ.get('XRIT_DECOMPRESS_PATH', None)
+        try:
+            os.environ['XRIT_DECOMPRESS_PATH'] = _fake_decompressor(tmpdir)
+            self.assertEqual(_xrit.external_decompressor(seg), seg.data)
+        finally:
+            if decomp_exec is None:
+                del os.environ['XRIT_DECOMPRESS_PATH']
+            else:
+                os.environ['XRIT_DECOMPRESS_PATH'] = decomp_exec
+            shutil.rmtree(tmpdir)
+
+    def test_dirindex(self):
+        import glob
+        import shutil
+        import tempfile
+        from mipp.xrit import dirindex
+        tmpdir = tempfile.mkdtemp()
+        try:
+            for f in msg_files + cmprs_files + goes_files:
+                shutil.copy(f, tmpdir)
+            open(os.path.join(tmpdir, 'README'), 'w').close()
+            open(os.path.join(tmpdir, '.H-000-MSG2__-MSG2________-'
+                              'IR_108___-000004___-201010111400-__.src'),
+                 'w').close()
+            for pattern in ('H-000-MSG2__-MSG2________-IR_108*-0??*'
+                            '-201010111400-__',
+                            'H-*-201311271015-C_',
+                            '*-PRO______-*',
+                            '*',
+                            'R*'):
+                self.assertEqual(
+                    dirindex.glob(os.path.join(tmpdir, pattern)),
+                    sorted(glob.glob(os.path.join(tmpdir, pattern))))
+            index = dirindex.get_index(tmpdir)
+            self.assertTrue(index is dirindex.get_index(tmpdir + '/'))
+            recs = index.query(datetime(2010, 10, 11, 14, 0),
+                               datetime(2013, 11, 27, 10, 15),
+                               channel='IR_108')
+            self.assertEqual([r.name for r in recs],
+                             [os.path.basename(f) for f in msg_files[1:-1]])
+            self.assertEqual(recs[0].segment, '000004')
+            self.assertEqual(recs[0].platform, 'MSG2')
+            self.assertFalse(recs[0].compressed)
+            recs = index.query(datetime(2013, 11, 27, 10, 15), segment='PRO')
+            self.assertEqual([r.name for r in recs],
+                             [os.path.basename(cmprs_files[0])])
+            # new files are seen
+            name = os.path.basename(msg_files[1]).replace('000004', '000006')
+            shutil.copy(msg_files[1], os.path.join(tmpdir, name))
+            self.assertEqual(len(index.query(datetime(2010, 10, 11, 14, 0),
+                                             channel='IR_108')), 3)
+            # image files of a time range, as found by the loaders
+            patterns = [os.path.join(tmpdir, 'L-000-MSG?__-GOES11______-'
+                                     '10_7*_135W-0??*-20100201%04d-__' % t)
+                        for t in (559, 600, 601)]
+            image_files = xrit.sat._query_files(
+                patterns, datetime(2010, 2, 1, 5, 59),
+                datetime(2010, 2, 1, 6, 1))
+            self.assertEqual(image_files, dirindex.glob(patterns))
+            self.assertEqual(len(image_files), 2)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_slot_assembler(self):
+        import shutil
+        import tempfile
+        import time
+        from mipp.xrit import watch
+        tmpdir = tempfile.mkdtemp()
+
+        def copy(src, segment=None):
+            name = os.path.basename(src)
+            if segment:
+                name = name.replace('000004', '%06d' % segment)
+            shutil.copy(src, os.path.join(tmpdir, name))
+
+        try:
+            slots = []
+            assembler = watch.SlotAssembler(tmpdir, slots.append,
+                                            max_age={'MSG2': 600},
+                                            platforms=['MSG2'],
+                                            require=('PRO', 'EPI'))
+            for f in goes_files + hrv_files[1:-1]:
+                copy(f)
+            copy(msg_files[0])
+            for segment in range(1, 8):
+                copy(msg_files[1], segment)
+            # files are taken when unchanged between two scans
+            assembler.scan()
+            assembler.scan()
+            # a segment still being written
+            last = os.path.join(tmpdir, os.path.basename(
+                msg_files[1]).replace('000004', '000008'))
+            fp = open(last, 'wb')
+            fp.write(open(msg_files[1], 'rb').read(100))
+            fp.flush()
+            assembler.scan()
+            fp.write(open(msg_files[1], 'rb').read()[100:])
+            fp.close()
+            os.utime(last, (time.time() + 1, time.time() + 1))
+            assembler.scan()
+            self.assertEqual(slots, [])
+            copy(msg_files[-1])
+            assembler.scan()
+            self.assertEqual(slots, [])
+            assembler.scan()
+            self.assertEqual(len(slots), 1)
+            slot = slots[0]
+            self.assertTrue(slot.is_complete)
+            self.assertEqual((slot.platform, slot.channel, slot.time_stamp),
+                             ('MSG2', 'IR_108', datetime(2010, 10, 11, 14, 0)))
+            self.assertEqual(len(slot.image_files), 8)
+            self.assertEqual(os.path.basename(slot.prologue),
+                             os.path.basename(msg_files[0]))
+            self.assertEqual(os.path.basename(slot.epilogue),
+                             os.path.basename(msg_files[-1]))
+            # late files are ignored
+            copy(msg_files[1], 9)
+            assembler.scan()
+            assembler.scan()
+            self.assertEqual(len(slots), 1)
+
+            # incomplete slots are handed over when too old
+            assembler.check()
+            self.assertEqual(len(slots), 1)
+            assembler.check(now=time.time() + 601)
+            self.assertEqual(len(slots), 2)
+            slot = slots[1]
+            self.assertFalse(slot.is_complete)
+            self.assertEqual(slot.channel, 'HRV')
+            self.assertEqual(slot.planned, (1, 24))
+            self.assertEqual(len(slot.missing), 22)
+
+            # watching picks up what's in the directory
+            slots = []
+            assembler = watch.SlotAssembler(tmpdir, slots.append,
+                                            platforms=['MSG2'])
+            assembler.interval = 0.01
+            assembler.run(timeout=0.1)
+            self.assertEqual([s.channel for s in slots], ['IR_108'])
+
+            # a failing callback doesn't stop the watching
+            def fail(slot):
+                slots.append(slot)
+                raise ValueError("corrupt prologue")
+            slots = []
+            assembler = watch.SlotAssembler(tmpdir, fail, platforms=['MSG2'],
+                                            max_age={'MSG2': 0})
+            assembler.interval = 0.01
+            assembler.run(timeout=0.1)
+            self.assertEqual(sorted(s.channel for s in slots),
+                             ['HRV', 'IR_108'])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_progressive(self):
+        import shutil
+        import tempfile
+        ref = xrit.sat.load_files(msg_files[0], msg_files[1:-1],
+                                  epilogue=msg_files[-1], calibrate=True)
+        full = ref[:][1]
+        image = xrit.sat.load_files(msg_files[0], msg_files[1:2],
+                                    epilogue=msg_files[-1], calibrate=True)
+        # south up, segment 4 of 8
+        self.assertEqual(image.valid_rows, [slice(1856, 2320)])
+
+        # a segment still being written is skipped
+        tmpdir = tempfile.mkdtemp()
+        try:
+            partial = os.path.join(tmpdir, os.path.basename(msg_files[2]))
+            data = open(msg_files[2], 'rb').read()
+            open(partial, 'wb').write(data[:len(data) // 2])
+            self.assertEqual(image.add_files([partial]), [])
+            # also when its headers are still being written
+            hdr_len = xrit.read_imagedata(msg_files[2]).data_offset
+            for size in range(0, hdr_len + 1, 7):
+                open(partial, 'wb').write(data[:size])
+                self.assertEqual(image.add_files([partial]), [])
+        finally:
+            shutil.rmtree(tmpdir)
+
+        out = numpy.zeros(full.shape, dtype=full.dtype)
+        chunks = list(image.progressive(lambda: msg_files[1:-1],
+                                        interval=0.01, timeout=0.02,
+                                        out=out))
+        self.assertEqual([rows for rows, data in chunks],
+                         [slice(1856, 2320), slice(1392, 1856)])
+        for rows, data in chunks:
+            self.assertTrue(numpy.all(data == full[rows]))
+        self.assertEqual(image.valid_rows, [slice(1392, 2320)])
+        self.assertTrue(numpy.all(out[1392:2320] == full[1392:2320]))
+        self.assertEqual(image.image_files, msg_files[1:-1])
+
+        # several quantities, into a tuple of arrays
+        image = xrit.sat.load_files(msg_files[0], msg_files[1:-1],
+                                    epilogue=msg_files[-1], calibrate=(0, 1))
+        self.assertRaises(ValueError, list,
+                          image.progressive(out=numpy.zeros(full.shape)))
+        outs = (numpy.zeros(full.shape, dtype=numpy.uint16),
+                numpy.zeros(full.shape))
+        chunks = list(image.progressive(out=outs))
+        self.assertEqual(len(chunks), 2)
+        for rows, data in chunks:
+            self.assertEqual(len(data), 2)
+        self.assertTrue(numpy.all(outs[1][1392:2320] == full[1392:2320]))
+        counts = xrit.sat.load_files(msg_files[0], msg_files[1:-1],
+                                     epilogue=msg_files[-1])[:][1]
+        self.assertTrue(numpy.all(outs[0][1392:2320] == counts[1392:2320]))
+
+    def test_lut_calibration(self):
+        counts = numpy.arange(1024, dtype=numpy.uint16).repeat(3)
+        numpy.random.shuffle(counts)
+        counts = counts.reshape(96, 32)
+        for files in (msg_files, goes_files):
+            epilogue = files[-1] if files is msg_files else None
+            image_files = files[1:-1] if epilogue else files[1:]
+            calibrator = xrit.sat.load_files(files[0], image_files,
+                                             epilogue=epilogue).mda.calibrate
+            for calibrate in (1, 2):
+                if files is goes_files and calibrate == 2:
+                    continue
+                ref, ref_unit = calibrator.convert(counts.copy(), calibrate)
+                res, unit = calibrator(counts, calibrate)
+                self.assertEqual(unit, ref_unit)
+                self.assertTrue(numpy.array_equal(
+                    numpy.nan_to_num(numpy.ma.getdata(res)),
+                    numpy.nan_to_num(numpy.ma.getdata(ref))))
+                self.assertTrue(numpy.array_equal(
+                    numpy.ma.getmaskarray(res), numpy.ma.getmaskarray(ref)))
+                # tables are built once
+                self.assertTrue(calibrator.table(calibrate) is
+                                calibrator.table(calibrate))
+        # into a given array
+        out = numpy.empty(counts.shape)
+        res = calibrator(counts, 1, out=out)[0]
+        self.assertTrue(res is out)
+        # counts outside the table are calibrated per pixel
+        counts[0, 0] = 4096
+        res = calibrator(counts, 1)[0]
+        self.assertTrue(numpy.array_equal(res, calibrator.convert(counts, 1)[0]))
+
+    def test_calibration_blocks(self):
+        calibrator = xrit.sat.load_files(msg_files[0], msg_files[1:-1],
+                                         epilogue=msg_files[-1]).mda.calibrate
+        calibrator.block_pixels = 100
+        counts = numpy.random.randint(0, 1024, (50, 60)).astype(numpy.uint16)
+        counts[0, 0] = 4096
+        ref = calibrator.convert(counts, 1)[0]
+        for dtype in (None, numpy.float32):
+            res = calibrator(counts, 1, dtype=dtype)[0]
+            self.assertEqual(res.dtype, dtype or ref.dtype)
+            self.assertTrue(numpy.array_equal(
+                numpy.ma.getmaskarray(res), numpy.ma.getmaskarray(ref)))
+            self.assertTrue(numpy.array_equal(
+                res.filled(0), ref.filled(0).astype(res.dtype)))
+        # float32 tables
+        counts[0, 0] = 0
+        res = calibrator(counts, 1, dtype=numpy.float32)[0]
+        self.assertEqual(res.dtype, numpy.float32)
+        self.assertTrue(numpy.array_equal(
+            res.filled(0), calibrator.convert(counts, 1)[0].filled(0).astype(
+                numpy.float32)))
+        # masked pixels stay masked
+        masked = numpy.ma.masked_greater(counts, 900)
+        res = calibrator(masked, 1)[0]
+        self.assertTrue(numpy.all(res.mask[masked.mask]))
+
+    def test_dtype_fill(self):
+        for files, item in ((msg_files, (slice(1656, 1956),
+                                         slice(1756, 2656))),
+                            (hrv_files, (slice(5168, 5768),
+                                         slice(5068, 6068)))):
+            ref = xrit.sat.load_files(files[0], files[1:-1],
+                                      epilogue=files[-1], calibrate=True,
+                                      mask=True)[item][1]
+            loader = xrit.sat.load_files(files[0], files[1:-1],
+                                         epilogue=files[-1], calibrate=True,
+                                         mask=True, dtype=numpy.float32,
+                                         fill='nan')
+            mda, img = loader[item]
+            self.assertFalse(isinstance(img, numpy.ma.MaskedArray))
+            self.assertEqual(img.dtype, numpy.float32)
+            self.assertEqual(mda.data_type, 32)
+            self.assertTrue(numpy.array_equal(numpy.isnan(img),
+                                              numpy.ma.getmaskarray(ref)))
+            self.assertTrue(numpy.array_equal(
+                img[~ref.mask], ref.compressed().astype(numpy.float32)))
+        # counts
+        img = xrit.sat.load_files(msg_files[0], msg_files[1:-1],
+                                  epilogue=msg_files[-1], fill='nan')[:][1]
+        self.assertEqual(img.dtype, numpy.float64)
+        self.assertTrue(numpy.isnan(img).any())
+
+    def test_calibrate_many(self):
+        for files, item in ((msg_files, (slice(1656, 1956),
+                                         slice(1756, 2656))),
+                            (hrv_files, (slice(5168, 5768),
+                                         slice(5068, 6068)))):
+            loader = xrit.sat.load_files(files[0], files[1:-1],
+                                         epilogue=files[-1], mask=True,
+                                         calibrate=(0, 2, 1))
+            mda, images = loader[item]
+            self.assertEqual(len(images), 3)
+            self.assertEqual(mda.calibration_unit[0], "counts")
+            for calibrate, img in zip((0, 2, 1), images):
+                ref = xrit.sat.load_files(files[0], files[1:-1],
+                                          epilogue=files[-1], mask=True,
+                                          calibrate=calibrate)[item][1]
+                self.assertTrue(numpy.array_equal(img.mask, ref.mask))
+                self.assertTrue(numpy.array_equal(img.filled(0),
+                                                  ref.filled(0)))
+        # per pixel, in blocks
+        calibrator = loader.mda.calibrate
+        calibrator.block_pixels = 100
+        counts = numpy.random.randint(0, 1024, (50, 60)).astype(numpy.uint16)
+        counts[0, 0] = 4096
+        results = calibrator.calibrate_many(counts, (1, 0, 2))
+        self.assertTrue(results[1][0] is counts)
+        for calibrate, (img, unit) in zip((1, 0, 2), results):
+            ref, ref_unit = calibrator.convert(counts, calibrate)
+            self.assertEqual(unit, ref_unit)
+            self.assertTrue(numpy.array_equal(numpy.ma.getmaskarray(img),
+                                              numpy.ma.getmaskarray(ref)))
+            self.assertTrue(numpy.array_equal(numpy.ma.filled(img, 0),
+                                              numpy.ma.filled(ref, 0)))
+
+    def test_inverse_calibration(self):
+        calibrator = xrit.sat.load_files(msg_files[0], msg_files[1:-1],
+                                         epilogue=msg_files[-1]).mda.calibrate
+        counts = numpy.random.randint(0, 1024, (50, 60)).astype(numpy.uint16)
+        for calibrate, low, high in ((1, 250., None), (1, 220., 280.),
+                                     (2, None, 50.), (1, 400., None)):
+            first, last = calibrator.count_range(low, high, calibrate)
+            data = calibrator.convert(counts, calibrate)[0]
+            expected = ~data.mask
+            if low is not None:
+                expected &= data.filled(low) >= low
+            if high is not None:
+                expected &= data.filled(high) <= high
+            self.assertTrue(numpy.array_equal(
+                (counts >= first) & (counts <= last), expected))
+            self.assertTrue(numpy.array_equal(
+                calibrator.in_range(counts, low, high, calibrate), expected))
+        self.assertEqual(calibrator.count_range(400.), (1, 0))
+
+        # not monotonic
+        from mipp.xrit.lut import LutCalibrator
+
+        class Calibrator(LutCalibrator):
+            bits_per_pixel = 4
+
+            def convert(self, image, calibrate=1):
+                return numpy.cos(image), "1"
+        calibrator = Calibrator()
+        self.assertRaises(mipp.CalibrationError, calibrator.count_range, 0.5)
+        counts = numpy.arange(16, dtype=numpy.uint16).reshape(4, 4)
+        self.assertTrue(numpy.array_equal(calibrator.in_range(counts, 0.5),
+                                          numpy.cos(counts) >= 0.5))
+
+    def test_stats(self):
+        for files, item in ((msg_files, (slice(1656, 1956),
+                                         slice(1756, 2656))),
+                            (hrv_files, (slice(5168, 5768),
+                                         slice(5068, 6068)))):
+            ref = xrit.sat.load_files(files[0], files[1:-1],
+                                      epilogue=files[-1], mask=True,
+                                      calibrate=(0, 1))[item][1]
+            mda, images = xrit.sat.load_files(files[0], files[1:-1],
+                                              epilogue=files[-1],
+                                              calibrate=(0, 1),
+                                              stats=True)[item]
+            self.assertEqual(len(mda.stats), 2)
+            for img, stats in zip(ref, mda.stats):
+                self.assertEqual(stats['count'], img.count())
+                self.assertAlmostEqual(stats['min'], img.min())
+                self.assertAlmostEqual(stats['max'], img.max())
+                self.assertAlmostEqual(stats['mean'], img.mean(), 6)
+                self.assertAlmostEqual(stats['std'], img.std(), 6)
+            hist = mda.stats[0]['histogram']
+            self.assertTrue(numpy.array_equal(
+                hist[1:], numpy.bincount(ref[0].compressed(),
+                                         minlength=len(hist))[1:]))
+            self.assertTrue(hist.sum() <= ref[0].size)
+
+            # statistics only, the same
+            mda_only, img = xrit.sat.load_files(files[0], files[1:-1],
+                                                epilogue=files[-1],
+                                                calibrate=1, stats_only=True,
+                                                workers=2)[item]
+            self.assertTrue(img is None)
+            for key in ('count', 'min', 'max', 'mean', 'std'):
+                self.assertEqual(mda_only.stats[key], mda.stats[1][key])
+            self.assertTrue(numpy.array_equal(mda_only.stats['histogram'],
+                                              hist))
+            self.assertTrue(numpy.array_equal(mda_only.image_size,
+                                              mda.image_size))
+
+    def test_load_slot(self):
+        import shutil
+        import tempfile
+        # a configuration pointing to the test data
+        cfgdir = tempfile.mkdtemp()
+        config_dir = os.environ['PPP_CONFIG_DIR']
+        try:
+            fp = open(os.path.join(cfgdir, 'msg2.cfg'), 'w')
+            for line in open(os.path.join(config_dir, 'msg2.cfg')):
+                if line.startswith('dir'):
+                    line = 'dir = %r\n' % os.path.abspath(datadir)
+                elif line.startswith('filename_pro'):
+                    fp.write(line.replace('filename_pro', 'filename_epi'))
+                fp.write(line)
+            fp.close()
+            os.environ['PPP_CONFIG_DIR'] = cfgdir
+            loaders = xrit.sat.load_slot('msg2', datetime(2010, 10, 11, 14, 0),
+                                         ['IR_108', 'HRV', 'VIS006'],
+                                         calibrate=True, workers=2)
+        finally:
+            os.environ['PPP_CONFIG_DIR'] = config_dir
+            shutil.rmtree(cfgdir)
+        self.assertEqual(sorted(loaders.keys()), ['HRV', 'IR_108'])
+        # prologue decoded once
+        self.assertTrue(loaders['HRV'].mda.calibrate.hdr is
+                        loaders['IR_108'].mda.calibrate.hdr)
+        for files in (msg_files, hrv_files):
+            loader = xrit.sat.load_files(files[0], files[1:-1],
+                                         epilogue=files[-1], calibrate=True)
+            # the configured directory is absolute
+            self.assertEqual(
+                [os.path.abspath(f)
+                 for f in loaders[loader.mda.channel].image_files],
+                [os.path.abspath(f) for f in files[1:-1]])
+            mda, img1 = loader[1656:1956, 1756:2656]
+            mda, img2 = loaders[loader.mda.channel][1656:1956, 1756:2656]
+            self.assertTrue(numpy.all(img1 == img2))
+
+    def test_decoded_cache(self):
+        import shutil
+        import tempfile
+        from mipp.xrit import MSG
+        loader1 = xrit.sat.load_files(msg_files[0], msg_files[1:-1],
+                                      epilogue=msg_files[-1])
+        loader2 = xrit.sat.load_files(hrv_files[0], hrv_files[1:-1],
+                                      epilogue=hrv_files[-1])
+        self.assertTrue(loader1.mda.calibrate.hdr is
+                        loader2.mda.calibrate.hdr)
+        ftr = xrit._xrit.decoded(xrit._xrit.read_epilogue(msg_files[-1]),
+                                 MSG.read_epiheader)
+        self.assertEqual(MSG.read_obstimes(msg_files[-1]),
+                         (ftr['ForwardScanStart'], ftr['ForwardScanEnd']))
+
+        # invalidated when the file changes
+        tmpdir = tempfile.mkdtemp()
+        try:
+            prologue = os.path.join(tmpdir, os.path.basename(msg_files[0]))
+            shutil.copy(msg_files[0], prologue)
+            hdr1 = xrit._xrit.decoded(xrit._xrit.read_prologue(prologue),
+                                      MSG.read_proheader)
+            self.assertTrue(hdr1 is xrit._xrit.decoded(
+                xrit._xrit.read_prologue(prologue), MSG.read_proheader))
+            os.utime(prologue, (0, 0))
+            hdr2 = xrit._xrit.decoded(xrit._xrit.read_prologue(prologue),
+                                      MSG.read_proheader)
+            self.assertFalse(hdr1 is hdr2)
+            self.assertEqual(hdr1['SatelliteDefinition'],
+                             hdr2['SatelliteDefinition'])
+        finally:
+            shutil.rmtree(tmpdir)
+
+        # bounded
+        cache = xrit._xrit._DecodedCache(1)
+        epilogue = xrit._xrit.read_epilogue(msg_files[-1])
+        ftr1 = cache.get(epilogue, MSG.read_epiheader)
+        cache.get(xrit._xrit.read_epilogue(hrv2_files[-1]), MSG.read_epiheader)
+        self.assertFalse(ftr1 is cache.get(epilogue, MSG.read_epiheader))
+
+        # decoding is done outside the cache lock
+        import threading
+        cache = xrit._xrit._DecodedCache(4)
+        started, release = threading.Event(), threading.Event()
+        released = []
+        def slow_reader(fp):
+            started.set()
+            released.append(release.wait(5))
+            return MSG.read_epiheader(fp)
+        result = []
+        thread = threading.Thread(
+            target=lambda: result.append(cache.get(epilogue, slow_reader)))
+        thread.start()
+        try:
+            self.assertTrue(started.wait(10))
+            self.assertEqual(
+                cache.get(epilogue, MSG.read_epiheader)['ForwardScanStart'],
+                ftr1['ForwardScanStart'])
+        finally:
+            release.set()
+            thread.join()
+        self.assertEqual(released, [True])
+        self.assertTrue(result[0] is cache.get(epilogue, slow_reader))
+
+    def test_lazy_proheader(self):
+        from StringIO import StringIO
+        from mipp.xrit import MSG
+        data = xrit._xrit.read_prologue(msg_files[0]).data
+        self.assertEqual(len(data), MSG.PROLOGUE_SIZE)
+        hdr = MSG.read_proheader(StringIO(data))
+        self.assertEqual(len(hdr), len(MSG.PROLOGUE_DTYPE.names))
+        self.assertEqual(hdr._decoded, {})
+        self.assertEqual(hdr["ProjectionDescription"]["LongitudeOfSSP"], 0.0)
+        self.assertEqual(hdr["ReferenceGridHRV"],
+                         {"NumberOfLines": 11136,
+                          "NumberOfColumns": 11136,
+                          "LineDirGridStep": hdr["ReferenceGridHRV"][
+                              "LineDirGridStep"],
+                          "ColumnDirGridStep": hdr["ReferenceGridHRV"][
+                              "ColumnDirGridStep"],
+                          "GridOrigin": "south east"})
+        self.assertEqual(sorted(hdr._decoded.keys()),
+                         ["ProjectionDescription", "ReferenceGridHRV"])
+        self.assertEqual(hdr["SatelliteDefinition"]["SatelliteId"], 322)
+        self.assertEqual(
+            hdr["Orbit"]["PeriodStartTime"],
+            xrit.bin_reader.read_cds_time(data[hdr.offsets["Orbit"]:]))
+        calibration = numpy.frombuffer(
+            data, dtype=[("Cal_Slope", ">f8"), ("Cal_Offset", ">f8")],
+            count=12, offset=hdr.offsets["Level1_5ImageCalibration"])
+        self.assertTrue(numpy.all(hdr["Level1_5ImageCalibration"] ==
+                                  calibration))
+        # arrays are writable, as before
+        hdr["Level1_5ImageCalibration"]["Cal_Slope"][0] = 1.0
+        self.assertNotEqual(calibration["Cal_Slope"][0], 1.0)
+        self.assertRaises(mipp.DecodeError, MSG.read_proheader,
+                          StringIO(data[:-1]))
+
+    def test_epiheader(self):
+        from StringIO import StringIO
+        from mipp.xrit import MSG
+        data = xrit._xrit.read_epilogue(msg_files[-1]).data
+        ftr = MSG.read_epiheader(StringIO(data))
+        self.assertEqual(
+            ftr["ForwardScanStart"],
+            xrit.bin_reader.read_cds_time(data[ftr.offsets["ForwardScanStart"]:]))
+        self.assertEqual((ftr["ForwardScanStart"], ftr["ForwardScanEnd"]),
+                         MSG.read_obstimes(msg_files[-1]))
+        self.assertEqual((ftr["SouthernLineActual"],
+                          ftr["NorthernLineActual"]), (1, 3712))
+        self.assertTrue(ftr["NominalImageScanning"] is True)
+        self.assertEqual(ftr["PlannedNumberOfL10Lines"].shape, (12,))
+
+    def test_prologue_records(self):
+        from mipp.xrit import MSG
+        prologues = [msg_files[0], hrv2_files[0], cmprs_files[0]]
+        records = MSG.read_prologue_records(prologues)
+        self.assertEqual(records.shape, (3,))
+        self.assertEqual(records["SatelliteDefinition"]["SatelliteId"].tolist(),
+                         [322, 322, 323])
+        self.assertEqual(records["Level1_5ImageCalibration"].shape, (3, 12))
+
+    def test_read_lines(self):
+        seg = xrit.read_imagedata(goes_files[1])
+        lines = seg.read_lines(100, 3)
+        self.assertEqual(lines.shape, (3, seg.bytes_per_line))
+        self.assertTrue(numpy.may_share_memory(lines, seg.memmap))
+        seg.readline(100)
+        expected = seg.readline(3)
+        self.assertEqual(lines.tostring(), expected)
+        self.assertRaises(mipp.DecodeError, seg.read_lines,
+                          seg.structure.nl - 1, 2)
+        seg.close()
+
+    def test_unpack10(self):
+        from mipp.xrit import convert
+        packed = '\xff\xc0\x05\x56\xaa'
+        expected = [0x3ff, 0, 0x155, 0x2aa]
+        self.assertEqual(convert.unpack10(packed).tolist(), expected)
+        self.assertEqual(numpy.frombuffer(convert.dec10216(packed),
+                                          numpy.uint16).tolist(), expected)
+        # straight into rows of an image
+        image = numpy.zeros((3, 10), dtype=numpy.uint16)
+        lines = numpy.frombuffer(packed * 4, numpy.uint8).reshape((2, 10))
+        result = convert.unpack10(lines, out=image[1:, 1:9])
+        self.assertTrue(result.base is image)
+        self.assertEqual(image[1:, 1:9].tolist(), [expected * 2] * 2)
+        self.assertEqual(image[0].sum() + image[:, 0].sum() + image[:, 9].sum(),
+                         0)
+        self.assertRaises(ValueError, convert.unpack10, packed,
+                          numpy.zeros(5, dtype=numpy.uint16))
+
+    def test_decode_lines(self):
+        from mipp.xrit.loader import _decode_lines
+        lines = numpy.arange(40, dtype=numpy.uint8).reshape((4, 10))
+        self.assertEqual(_decode_lines(lines, 8, numpy.uint8, 2, 3).tolist(),
+                         lines[:, 2:5].tolist())
+        words = _decode_lines(lines, -16, '>u2', 1, 2)
+        self.assertEqual(words.tolist(),
+                         [[(10 * i + 2) * 256 + 10 * i + 3,
+                           (10 * i + 4) * 256 + 10 * i + 5] for i in range(4)])
+        words = _decode_lines(lines, 10, numpy.uint16, 0, 8)
+        self.assertEqual(words[2].tostring(),
+                         xrit.convert.dec10216(lines[2].tostring()))
+
+    def test_unpack10_columns(self):
+        from mipp.xrit import convert
+        lines = numpy.random.randint(0, 256, (3, 30)).astype(numpy.uint8)
+        words = convert.unpack10(lines)
+        for start, count in ((0, 24), (1, 1), (3, 6), (5, 12), (23, 1)):
+            self.assertEqual(
+                convert.unpack10_columns(lines, start, count).tolist(),
+                words[:, start:start + count].tolist())
+
+    def test_hrpt_dec10216(self):
+        from StringIO import StringIO
+        from mipp.xrit import convert
+        reclen = convert.HRPT_PACKED_RECLEN
+        # two and a half record
+        packed = numpy.random.randint(0, 256, 2 * reclen + 1003).astype(
+            numpy.uint8).tostring()
+        words = convert.unpack10(packed)
+        nwords = convert.HRPT_RECLEN - 2
+        pad = numpy.zeros(2, dtype=numpy.uint16)
+        expected = numpy.concatenate((words[:nwords], pad,
+                                      words[nwords:2 * nwords], pad,
+                                      words[2 * nwords:])).tostring()
+        self.assertEqual(convert.hrpt_dec10216(packed), expected)
+        # chunks not aligned on the input
+        fpo = StringIO()
+        convert.hrpt_stream(StringIO(packed), fpo, records=1)
+        self.assertEqual(fpo.getvalue(), expected)
+        fpo = StringIO()
+        convert.hrpt_stream(StringIO(packed[:2 * reclen]), fpo, records=2)
+        self.assertEqual(fpo.getvalue(), expected[:4 * convert.HRPT_RECLEN])
+
+    def test_headers(self):
+        fp = open(msg_files[1], 'rb')
+        hdrs = xrit._xrit.read_headers(fp)
+        data_start = fp.tell()
+        fp.close()
+        hdrs = dict((h.hdr_type, h) for h in hdrs)
+        self.assertEqual(data_start, hdrs[0].total_hdr_len)
+        self.assertEqual((hdrs[1].nb, hdrs[1].nc, hdrs[1].nl), (10, 3712, 464))
+        self.assertEqual((hdrs[2].cfac, hdrs[2].coff, hdrs[2].ssp),
+                         (-13642337, 1856, 0.0))
+        self.assertEqual(hdrs[4].product_id, 'MSG2_IR_108_20101011_1400')
+        self.assertEqual(hdrs[5].time_stamp,
+                         datetime(2010, 10, 11, 14, 15, 10, 623000))
+        self.assertEqual((hdrs[128].seg_no, hdrs[128].planned_end_seg_no),
+                         (4, 8))
+        line_quality = hdrs[129].line_quality
+        self.assertEqual(len(line_quality), 464)
+        self.assertEqual(line_quality[0],
+                         (1393, datetime(2010, 10, 11, 14, 4, 57, 761000),
+                          1, 1, 0))
+
+    def test_header_index(self):
+        import shutil
+        import tempfile
+        from mipp.xrit import index
+        tmpdir = tempfile.mkdtemp()
+        busy_timeout = index.BUSY_TIMEOUT
+        try:
+            index.BUSY_TIMEOUT = 0.1
+            index.set_index(tmpdir + '/headers.db')
+            seg_file = tmpdir + '/' + os.path.basename(msg_files[1])
+            shutil.copy(msg_files[1], seg_file)
+            layout = xrit._xrit._header_layout()
+            self.assertEqual(index.get_index().lookup(seg_file, layout), None)
+            s1 = xrit.read_imagedata(seg_file)
+            data_offset, hdrs = index.get_index().lookup(seg_file, layout)
+            self.assertEqual(data_offset, s1.data_offset)
+            s2 = xrit.read_imagedata(seg_file)
+            self.assertEqual(str(s1.segment), str(s2.segment))
+            self.assertEqual(s1.image_quality.line_quality,
+                             s2.image_quality.line_quality)
+            # entries are plain JSON, committed when stored
+            other = index.SegmentIndex(tmpdir + '/headers.db')
+            try:
+                text, = other._db.execute(
+                    "SELECT headers FROM segment_headers").fetchone()
+                self.assertEqual(json.loads(text)[0][1], 'PrimaryHeader')
+                self.assertEqual(other.lookup(seg_file, layout)[0],
+                                 data_offset)
+            finally:
+                other.close()
+            # modified files are not served from the index
+            os.utime(seg_file, (0, 0))
+            self.assertEqual(index.get_index().lookup(seg_file, layout), None)
+            # a locked catalog doesn't break loads
+            other = index.SegmentIndex(tmpdir + '/headers.db')
+            try:
+                other._db.execute("BEGIN EXCLUSIVE")
+                s3 = xrit.read_imagedata(seg_file)
+                self.assertEqual(s3.data_offset, data_offset)
+            finally:
+                other.close()
+            self.assertEqual(index.get_index().purge(), 1)
+            # neither does one that can't be created
+            index.set_index(tmpdir + '/missing/headers.db')
+            self.assertEqual(xrit.read_imagedata(seg_file).data_offset,
+                             data_offset)
+        finally:
+            index.set_index(None)
+            index.BUSY_TIMEOUT = busy_timeout
+            shutil.rmtree(tmpdir)
+
+    def test_truncated_headers(self):
+        import shutil
+        import tempfile
+        data = open(msg_files[1], 'rb').read()
+        hdr_len = xrit.read_imagedata(msg_files[1]).data_offset
+        tmpdir = tempfile.mkdtemp()
+        try:
+            seg_file = os.path.join(tmpdir, os.path.basename(msg_files[1]))
+            for size in range(hdr_len + 1):
+                fp = open(seg_file, 'wb')
+                fp.write(data[:size])
+                fp.close()
+                if size < hdr_len:
+                    self.assertRaises(mipp.DecodeError,
+                                      xrit.read_imagedata, seg_file)
+                else:
+                    xrit.read_imagedata(seg_file)
+            # buffer ending inside a record header
+            self.assertRaises(mipp.DecodeError, list,
+                              xrit._xrit.decode_headers('\x01\x00'))
+        finally:
+            shutil.rmtree(tmpdir)
+
     def test_decompress(self):
         """Test decompressing MSG SEVIRI data on the fly with xRITDecompress"""
         message = ("Environment variable XRIT_DECOMPRESS_PATH not set. " + 
@@ -243,9 +1202,13 @@ class Test(unittest.TestCase):
 
     def tearDown(self):
         """Clean up"""
-        for filename in self.decompressed_msg_files:
-            if os.path.exists(filename):
-                os.remove(filename)
+        for infile, filename in zip(cmprs_files[1:-1],
+                                    self.decompressed_msg_files):
+            stamp = os.path.join(os.path.dirname(filename),
+                                 '.' + os.path.basename(infile) + '.src')
+            for filename in (filename, stamp):
+                if os.path.exists(filename):
+                    os.remove(filename)
             
         
 if __name__ == '__main__':